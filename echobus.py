@@ -0,0 +1,270 @@
+# Copyright (c) EofE Ultrasonics Co., Ltd., 2024
+import collections
+import threading
+import time
+
+StreamChunk = collections.namedtuple("StreamChunk", "time data")
+StreamChunk.__doc__ = """! Complete lines received at once: host time.monotonic() of arrival and bytes"""
+
+PolicyBlock = "block"
+PolicyDropOldest = "drop-oldest"
+PolicyDropNewest = "drop-newest"
+
+class Subscriber():
+    """! Consumer of the stream bus with its own bounded queue
+    Policy decides what happens when the queue is full:
+    "block" - the bus reader waits (backpressure to the serial port, use only for fast consumers),
+    "drop-oldest" - the oldest queued chunk is dropped, "drop-newest" - the new chunk is dropped.
+    """
+    def __init__(self, name, maxsize = 1024, policy = PolicyDropOldest):
+        """! Constructor
+        @param name Subscriber name
+        @param maxsize Maximum number of queued chunks
+        @param policy PolicyBlock, PolicyDropOldest or PolicyDropNewest
+        """
+        if policy not in (PolicyBlock, PolicyDropOldest, PolicyDropNewest):
+            raise ValueError("Unknown policy: %s" % policy)
+        self._name = name
+        self._maxsize = max(1, maxsize)
+        self._policy = policy
+        self._queue = collections.deque()
+        self._condition = threading.Condition()
+        self._closed = False
+        self._discarded = False
+        self._published = 0
+        self._delivered = 0
+        self._dropped = 0
+        self._high_water = 0
+        self._errors = 0
+        self._error = None
+
+    def _Put(self, chunk):
+        """! Queue chunk according the policy (called by the bus reader)
+        """
+        with self._condition:
+            if True == self._closed:
+                return
+            self._published += 1
+            if len(self._queue) >= self._maxsize:
+                if PolicyDropNewest == self._policy:
+                    self._dropped += 1
+                    return
+                if PolicyDropOldest == self._policy:
+                    self._queue.popleft()
+                    self._dropped += 1
+                else:
+                    while len(self._queue) >= self._maxsize and False == self._closed:
+                        self._condition.wait()
+                    if True == self._discarded: # consumer shut down while the reader waited
+                        self._dropped += 1
+                        return
+            self._queue.append(chunk)
+            self._high_water = max(self._high_water, len(self._queue))
+            self._condition.notify_all()
+
+    def _Close(self):
+        """! Mark end of stream, Get() returns None when the queue is empty
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def _Discard(self):
+        """! Close and drop queued chunks of a consumer which was shut down, they are counted as dropped
+        """
+        with self._condition:
+            self._closed = True
+            self._discarded = True
+            self._dropped += len(self._queue)
+            self._queue.clear()
+            self._condition.notify_all()
+
+    def Get(self, timeout = None):
+        """! Get next chunk
+        @param timeout Timeout in seconds, None - wait forever
+        @result StreamChunk, None - timeout or end of stream
+        """
+        with self._condition:
+            if 0 == len(self._queue) and False == self._closed:
+                self._condition.wait(timeout)
+            if 0 == len(self._queue):
+                return None
+            chunk = self._queue.popleft()
+            self._delivered += 1
+            self._condition.notify_all()
+            return chunk
+
+    def _SetError(self, error):
+        """! Record exception raised by the callback of the subscriber (called by the consumer thread)
+        """
+        with self._condition:
+            self._errors += 1
+            self._error = error
+
+    def GetError(self):
+        """! Return last exception raised by the callback, None - no error
+        """
+        with self._condition:
+            return self._error
+
+    def IsClosed(self):
+        """! Return True when end of stream is reached and the queue is empty
+        """
+        with self._condition:
+            return True == self._closed and 0 == len(self._queue)
+
+    def GetName(self):
+        """! Return subscriber name
+        """
+        return self._name
+
+    def GetStats(self):
+        """! Return counters: published, delivered, dropped, lag (queued now), high_water (maximum queued),
+            errors (exceptions raised by the callback)
+        """
+        with self._condition:
+            return { "published": self._published, "delivered": self._delivered, "dropped": self._dropped,
+                     "lag": len(self._queue), "high_water": self._high_water, "errors": self._errors }
+
+class StreamBus():
+    """! Single reader fan-out bus
+    One thread reads complete lines from the source (Echosounder or SupervisedSession) and publishes every
+    chunk to all subscribers, so a slow disk or terminal never stops the serial port from being drained.
+    """
+    def __init__(self, source, maxbytes = 4096, timeout = 0.5):
+        """! Constructor
+        @param source Object with ReadAvailable(maxbytes, timeout) method
+        @param maxbytes Maximum chunk size
+        @param timeout Read timeout in seconds (how fast Stop() is noticed)
+        """
+        self._source = source
+        self._maxbytes = maxbytes
+        self._timeout = timeout
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._thread = None
+        self._consumers = []
+        self._running = False
+        self._chunks = 0
+        self._bytes = 0
+        self._error = None
+
+    def Subscribe(self, name, maxsize = 1024, policy = PolicyDropOldest, callback = None, max_errors = None):
+        """! Add subscriber
+        @param name Subscriber name
+        @param maxsize Maximum number of queued chunks
+        @param policy PolicyBlock, PolicyDropOldest or PolicyDropNewest
+        @param callback Function called with every StreamChunk from own consumer thread, None - caller uses Get()
+        @param max_errors Number of exceptions raised by the callback after which the subscriber is unsubscribed,
+            None - keep consuming. Exceptions are recorded on the subscriber (see Subscriber.GetError())
+        @result Subscriber
+        """
+        subscriber = Subscriber(name, maxsize, policy)
+        with self._lock:
+            self._subscribers.append(subscriber)
+
+        if None != callback:
+            thread = threading.Thread(target = self.__Consume, args = (subscriber, callback, max_errors), name = "bus-" + name, daemon = True)
+            self._consumers.append(thread)
+            thread.start()
+
+        return subscriber
+
+    def Unsubscribe(self, subscriber):
+        """! Remove subscriber, it gets end of stream
+        """
+        with self._lock:
+            if subscriber in self._subscribers:
+                self._subscribers.remove(subscriber)
+        subscriber._Close()
+
+    def __Consume(self, subscriber, callback, max_errors):
+        """! Consumer thread for callback subscribers
+            A failing callback never ends the thread silently, a blocking subscriber would stall the reader
+        """
+        errors = 0
+        while True:
+            chunk = subscriber.Get()
+            if None == chunk:
+                if True == subscriber.IsClosed():
+                    return
+                continue
+            try:
+                callback(chunk)
+            except Exception as e:
+                subscriber._SetError(e)
+                errors += 1
+                if None != max_errors and errors >= max_errors:
+                    subscriber._Discard() # closed subscriber never blocks the reader
+                    self.Unsubscribe(subscriber)
+                    return
+
+    def Publish(self, chunk):
+        """! Publish chunk to all subscribers
+        @param chunk StreamChunk
+        """
+        self._chunks += 1
+        self._bytes += len(chunk.data)
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            subscriber._Put(chunk)
+
+    def __Read(self):
+        """! Reader thread
+        """
+        try:
+            while True == self._running:
+                data = self._source.ReadAvailable(self._maxbytes, self._timeout)
+                if len(data) > 0:
+                    self.Publish(StreamChunk(time.monotonic(), data))
+        except OSError as e:
+            self._error = e
+        finally:
+            self._running = False
+            with self._lock:
+                subscribers = list(self._subscribers)
+            for subscriber in subscribers:
+                subscriber._Close()
+
+    def Start(self):
+        """! Start reader thread
+        """
+        if None != self._thread and self._thread.is_alive():
+            return
+        self._running = True
+        self._thread = threading.Thread(target = self.__Read, name = "bus-reader", daemon = True)
+        self._thread.start()
+
+    def Stop(self, timeout = None):
+        """! Stop reader thread, subscribers get end of stream and callback consumers finish their queues
+        @param timeout Timeout in seconds to wait for threads
+        """
+        self._running = False
+        if None != self._thread:
+            self._thread.join(timeout)
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            subscriber._Close()
+        for thread in self._consumers:
+            thread.join(timeout)
+
+    def IsRunning(self):
+        """! Return True while reader thread is running
+        """
+        return True == self._running
+
+    def GetError(self):
+        """! Return serial error that stopped the reader, None - no error
+        """
+        return self._error
+
+    def GetStats(self):
+        """! Return bus counters and counters of every subscriber
+        @result dictionary {"chunks": n, "bytes": n, "subscribers": {name: Subscriber.GetStats()}}
+        """
+        with self._lock:
+            subscribers = list(self._subscribers)
+        return { "chunks": self._chunks, "bytes": self._bytes,
+                 "subscribers": { subscriber.GetName(): subscriber.GetStats() for subscriber in subscribers } }
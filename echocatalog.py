@@ -0,0 +1,304 @@
+# Copyright (c) EofE Ultrasonics Co., Ltd., 2024
+import bz2
+import fnmatch
+import gzip
+import json
+import lzma
+import math
+import os
+import sqlite3
+import threading
+
+from echonmea import PingDecoder
+
+CatalogVersion = 1
+
+CatalogSchema = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    size INTEGER, mtime REAL,
+    start REAL, end REAL,
+    pings INTEGER,
+    settings TEXT,
+    stats TEXT);
+CREATE TABLE IF NOT EXISTS chunks (
+    id INTEGER PRIMARY KEY,
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    frequency INTEGER,
+    start REAL, end REAL,
+    offset INTEGER, length INTEGER,
+    pings INTEGER,
+    depth_min REAL, depth_max REAL, depth_mean REAL,
+    ema_min REAL, ema_max REAL, ema_mean REAL);
+CREATE INDEX IF NOT EXISTS chunks_time ON chunks (frequency, start, end);
+CREATE INDEX IF NOT EXISTS chunks_file ON chunks (file_id);
+"""
+
+def _OpenLog(path):
+    """! Open raw or compressed (.gz, .xz, .bz2, .zst) log for binary reading, offsets refer to the raw data
+        Compressed streams are not randomly accessible: seek() decompresses everything before the offset
+    """
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    if path.endswith(".xz"):
+        return lzma.open(path, "rb")
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rb")
+    if path.endswith(".zst"):
+        import zstandard
+        return zstandard.ZstdDecompressor().stream_reader(open(path, "rb"))
+    return open(path, "rb")
+
+def _ReadSettings(path):
+    """! Read settings snapshot of a log: "_meta.csv" sidecar or the entry of a recorder manifest
+    """
+    from echoconvert import ReadMetaCsv
+    base = path
+    for extension in (".gz", ".xz", ".bz2", ".zst"):
+        if base.endswith(extension):
+            base = base[:-len(extension)]
+    settings = ReadMetaCsv(os.path.splitext(base)[0] + "_meta.csv")
+    if len(settings) > 0:
+        return settings
+
+    directory = os.path.dirname(path)
+    name = os.path.basename(path)
+    for manifest in fnmatch.filter(os.listdir(directory or "."), "*_manifest.json"):
+        try:
+            with open(os.path.join(directory, manifest), "r", encoding = "utf-8") as f:
+                segments = json.load(f).get("segments", [])
+        except (OSError, ValueError):
+            continue
+        for segment in segments:
+            if segment.get("file") == name and "settings" in segment:
+                return segment["settings"]
+    return {}
+
+class _ChunkStats():
+    """! Statistics of the pings of one frequency inside a chunk
+    """
+    def __init__(self):
+        self.pings = 0
+        self.start = None
+        self.end = None
+        self.values = { "depth": [math.inf, -math.inf, 0.0, 0], "ema": [math.inf, -math.inf, 0.0, 0] }
+
+    def Add(self, ping):
+        self.pings += 1
+        if None != ping.time:
+            self.start = ping.time if None == self.start else min(self.start, ping.time)
+            self.end = ping.time if None == self.end else max(self.end, ping.time)
+        for name, value in (("depth", ping.depth), ("ema", ping.ema)):
+            if None != value:
+                stats = self.values[name]
+                stats[0] = min(stats[0], value)
+                stats[1] = max(stats[1], value)
+                stats[2] += value
+                stats[3] += 1
+
+    def Row(self, name):
+        """! Return (min, max, mean) of a channel, None if there is no value
+        """
+        minimum, maximum, total, count = self.values[name]
+        if 0 == count:
+            return (None, None, None)
+        return (minimum, maximum, total / count)
+
+class Catalog():
+    """! SQLite catalog of recordings
+    Every log is indexed once: per file time range, ping count, settings snapshot and decoder statistics, and per
+    chunk of chunk_pings ping blocks the byte range and, for every frequency, time range, ping count and depth/EMA
+    min/max/mean. Queries select chunks by frequency, time and value ranges and decode only their byte ranges.
+    Chunk offsets of compressed segments are offsets into the decompressed stream, so a query still decompresses such
+    a file from its start up to the last selected chunk (only the decoding is skipped); only uncompressed segments
+    (RotatingRecorder with compression None) are read at the selected byte ranges alone.
+    Update() re-indexes only new or changed files; AddFile() can be passed to RotatingRecorder as on_closed callback.
+    """
+    def __init__(self, path, chunk_pings = 256):
+        """! Constructor
+        @param path SQLite database file (created if missing)
+        @param chunk_pings Number of ping blocks per chunk
+        """
+        self._chunk_pings = chunk_pings
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread = False)
+        self._db.execute("PRAGMA foreign_keys = ON")
+        self._db.execute("PRAGMA journal_mode = WAL")
+        self._db.executescript(CatalogSchema)
+        self._db.execute("PRAGMA user_version = %d" % CatalogVersion)
+        self._db.commit()
+
+    def Close(self):
+        """! Close database
+        """
+        with self._lock:
+            self._db.close()
+
+    def IsIndexed(self, path):
+        """! Return True if the file is indexed with its current size and modification time
+        """
+        path = os.path.abspath(path)
+        with self._lock:
+            row = self._db.execute("SELECT size, mtime FROM files WHERE path = ?", (path,)).fetchone()
+        return None != row and row[0] == os.path.getsize(path) and row[1] == os.path.getmtime(path)
+
+    def AddFile(self, path):
+        """! Index (or re-index) one log file
+        @param path Raw or compressed log file
+        @result number of pings indexed
+        """
+        path = os.path.abspath(path)
+        size = os.path.getsize(path)
+        mtime = os.path.getmtime(path)
+        decoder = PingDecoder()
+        chunks = []
+
+        def close(stats, offset, end):
+            if len(stats) > 0:
+                chunks.append((offset, end - offset, stats))
+
+        with _OpenLog(path) as f:
+            offset = 0
+            block = 0          # ping blocks in the current chunk
+            chunk_offset = 0
+            stats = {}
+            for raw in f:
+                line = raw.decode("latin_1")
+                sentences = decoder.sentences
+                ping = decoder.Feed(line)
+                if None != ping: # completed by the next "#F" marker, still belongs to the current chunk
+                    stats.setdefault(ping.frequency, _ChunkStats()).Add(ping)
+                if line.startswith("#F") and sentences != decoder.sentences:
+                    if block >= self._chunk_pings:
+                        close(stats, chunk_offset, offset)
+                        stats = {}
+                        block = 0
+                    if 0 == block:
+                        chunk_offset = offset
+                    block += 1
+                offset += len(raw)
+            ping = decoder.Flush()
+            if None != ping:
+                stats.setdefault(ping.frequency, _ChunkStats()).Add(ping)
+            close(stats, chunk_offset, offset)
+
+        times = [s.start for o, l, c in chunks for s in c.values() if None != s.start] + \
+                [s.end for o, l, c in chunks for s in c.values() if None != s.end]
+        decoder_stats = decoder.GetStats()
+
+        with self._lock:
+            self._db.execute("DELETE FROM files WHERE path = ?", (path,))
+            cursor = self._db.execute(
+                "INSERT INTO files (path, size, mtime, start, end, pings, settings, stats) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (path, size, mtime, min(times) if len(times) > 0 else None, max(times) if len(times) > 0 else None,
+                 decoder_stats["pings"], json.dumps(_ReadSettings(path)), json.dumps(decoder_stats)))
+            file_id = cursor.lastrowid
+            rows = []
+            for chunk_offset, length, stats in chunks:
+                for frequency, chunk in stats.items():
+                    rows.append((file_id, frequency, chunk.start, chunk.end, chunk_offset, length, chunk.pings)
+                                + chunk.Row("depth") + chunk.Row("ema"))
+            self._db.executemany(
+                "INSERT INTO chunks (file_id, frequency, start, end, offset, length, pings, depth_min, depth_max, "
+                "depth_mean, ema_min, ema_max, ema_mean) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self._db.commit()
+        return decoder_stats["pings"]
+
+    def Update(self, root, pattern = "*.log*"):
+        """! Index new and changed logs of a directory tree, remove entries of deleted files
+        @param root Directory
+        @param pattern File name pattern
+        @result tuple (number of files indexed, number of entries removed)
+        """
+        indexed = 0
+        for directory, dirs, files in os.walk(root):
+            for name in sorted(fnmatch.filter(files, pattern)):
+                path = os.path.join(directory, name)
+                if False == self.IsIndexed(path):
+                    self.AddFile(path)
+                    indexed += 1
+
+        prefix = os.path.join(os.path.abspath(root), "")
+        with self._lock:
+            paths = [row[0] for row in self._db.execute("SELECT path FROM files WHERE path LIKE ?", (prefix + "%",))]
+            removed = [path for path in paths if not os.path.exists(path)]
+            self._db.executemany("DELETE FROM files WHERE path = ?", [(path,) for path in removed])
+            self._db.commit()
+        return indexed, len(removed)
+
+    def FindChunks(self, frequency = None, start = None, end = None, ema_max = None, ema_min = None,
+                   depth_min = None, depth_max = None):
+        """! Find chunks which may contain matching pings
+        @param frequency Frequency in Hz, None - any
+        @param start, end Time range (UTC seconds), None - open
+        @param ema_max, ema_min Chunks with some EMA below ema_max / above ema_min
+        @param depth_min, depth_max Chunks with some depth inside the range
+        @result list of (path, offset, length, frequency, start, end, pings) ordered by file and offset
+        """
+        conditions = []
+        params = []
+        for clause, value in (("chunks.frequency = ?", frequency), ("chunks.end >= ?", start), ("chunks.start <= ?", end),
+                              ("chunks.ema_min < ?", ema_max), ("chunks.ema_max > ?", ema_min),
+                              ("chunks.depth_max >= ?", depth_min), ("chunks.depth_min <= ?", depth_max)):
+            if None != value:
+                conditions.append(clause)
+                params.append(value)
+        query = "SELECT files.path, chunks.offset, chunks.length, chunks.frequency, chunks.start, chunks.end, chunks.pings " \
+                "FROM chunks JOIN files ON files.id = chunks.file_id"
+        if len(conditions) > 0:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY files.start, files.path, chunks.offset"
+        with self._lock:
+            return self._db.execute(query, params).fetchall()
+
+    def Query(self, frequency = None, start = None, end = None, predicate = None, **limits):
+        """! Return pings of the selected chunks which match exactly
+            Chunks of a file are read in offset order, a compressed file is decompressed once up to its last chunk
+        @param frequency, start, end See FindChunks()
+        @param predicate Function(ping) -> bool applied to every ping of the selected chunks, None - all
+        @param limits ema_max, ema_min, depth_min, depth_max, see FindChunks(); checked for every ping too,
+            a ping without the value does not match
+        @result list of Ping
+        """
+        pings = []
+        ranges = {}
+        for path, offset, length, chunk_frequency, chunk_start, chunk_end, count in self.FindChunks(frequency, start, end, **limits):
+            ranges.setdefault(path, set()).add((offset, length))
+
+        # FindChunks() rejected unknown limits already
+        checks = { "ema_max": lambda ping, limit: None != ping.ema and ping.ema < limit,
+                   "ema_min": lambda ping, limit: None != ping.ema and ping.ema > limit,
+                   "depth_min": lambda ping, limit: None != ping.depth and ping.depth >= limit,
+                   "depth_max": lambda ping, limit: None != ping.depth and ping.depth <= limit }
+        checks = [(checks[name], limit) for name, limit in limits.items() if None != limit]
+
+        for path, chunks in ranges.items():
+            with _OpenLog(path) as f:
+                for offset, length in sorted(chunks):
+                    f.seek(offset)
+                    decoder = PingDecoder()
+                    found = decoder.FeedLines(f.read(length).decode("latin_1").splitlines())
+                    ping = decoder.Flush()
+                    if None != ping:
+                        found.append(ping)
+                    for ping in found:
+                        if None != frequency and ping.frequency != frequency:
+                            continue
+                        if None != start and (None == ping.time or ping.time < start):
+                            continue
+                        if None != end and (None == ping.time or ping.time > end):
+                            continue
+                        if False == all(check(ping, limit) for check, limit in checks):
+                            continue
+                        if None != predicate and False == predicate(ping):
+                            continue
+                        pings.append(ping)
+        return pings
+
+    def GetFiles(self):
+        """! Return list of (path, start, end, pings, settings dictionary, stats dictionary)
+        """
+        with self._lock:
+            rows = self._db.execute("SELECT path, start, end, pings, settings, stats FROM files ORDER BY start, path").fetchall()
+        return [(path, start, end, pings, json.loads(settings), json.loads(stats)) for path, start, end, pings, settings, stats in rows]
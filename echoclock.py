@@ -0,0 +1,149 @@
+# Copyright (c) EofE Ultrasonics Co., Ltd., 2024
+import collections
+import time
+
+from echonmea import ParseZDA
+
+class ClockModel():
+    """! Host/unit clock model
+    Pairs every ZDA timestamp sent by the echosounder with the host monotonic time the sentence arrived
+    and fits the unit to host clock offset and drift online.
+    Drift is an exponentially weighted least squares slope, offset is the lower envelope of the residuals
+    over the last samples, because the serial delay can only make a sentence late, never early.
+    The unit has to output ZDA sentences ("IdNMEAZDA" set to "1").
+    """
+    def __init__(self, echosounder = None, resync_threshold = 1.0, window = 64, forgetting = 0.9999, latency = 0.0):
+        """! Constructor
+        @param echosounder Echosounder instance used by Resync(), None - never resync
+        @param resync_threshold Unit clock error in seconds that triggers SetCurrentTime()
+        @param window Number of last samples used for the offset lower envelope
+        @param forgetting Forgetting factor of the drift fit (0..1], 1 - never forget; the fit remembers about
+            1 / (1 - forgetting) samples (0.9999 - about 17 minutes at 10 Hz), enough to average ZDA quantization out
+        @param latency Known fixed delay in seconds between the ping and the ZDA arrival (e.g. sentence length / baud rate)
+        """
+        self._echosounder = echosounder
+        self._resync_threshold = resync_threshold
+        self._window = window
+        self._forgetting = forgetting
+        self._latency = latency
+        # Host wall clock on the monotonic time base, captured once to avoid per-line clock calls
+        self._wall_offset = time.time() - time.monotonic()
+        self.Reset()
+
+    def Reset(self):
+        """! Forget all samples (the unit clock was set or jumped)
+        """
+        self._samples = collections.deque(maxlen = self._window)
+        self._origin = None
+        self._sw = 0.0  # sum of weights
+        self._mx = 0.0  # weighted means
+        self._my = 0.0
+        self._cxx = 0.0 # weighted sums of centered products
+        self._cxy = 0.0
+        self._drift = 0.0
+        self._offset = None
+
+    def AddSample(self, unit_time, host_time = None):
+        """! Add a clock sample
+        @param unit_time Unit UTC time in seconds (from ZDA)
+        @param host_time Host time.monotonic() at the sentence arrival, None - take it now
+        """
+        if None == host_time:
+            host_time = time.monotonic()
+
+        if None == self._origin:
+            self._origin = unit_time
+
+        x = unit_time - self._origin
+        y = host_time + self._wall_offset - unit_time
+
+        # weighted least squares on the time axis centered at the weighted mean, stable for long windows
+        lam = self._forgetting
+        self._sw = self._sw * lam + 1.0
+        dx = x - self._mx
+        self._mx += dx / self._sw
+        self._my += (y - self._my) / self._sw
+        self._cxx = self._cxx * lam + dx * (x - self._mx)
+        self._cxy = self._cxy * lam + dx * (y - self._my)
+
+        if len(self._samples) > 0 and self._cxx > 1e-9:
+            self._drift = self._cxy / self._cxx
+
+        self._samples.append((x, y))
+        self._offset = min(sy - self._drift * sx for sx, sy in self._samples)
+
+    def AddLine(self, line, host_time = None):
+        """! Add a clock sample from a received line
+        Non ZDA lines are ignored, so every received line can be passed here
+        @param line Received line
+        @param host_time Host time.monotonic() when the line (or the chunk containing it) was read
+        @result Unit UTC time of the ZDA sentence, None - line is not a ZDA sentence
+        """
+        if "ZDA" not in line:
+            return None
+        unit_time = ParseZDA(line)
+        if None != unit_time:
+            self.AddSample(unit_time, host_time)
+        return unit_time
+
+    def IsValid(self):
+        """! Return True when at least one sample was added since the last Reset()
+        """
+        return None != self._offset
+
+    def GetOffset(self):
+        """! Unit clock error: host UTC minus unit UTC in seconds at the first sample, None - no samples
+        """
+        return self._offset
+
+    def GetDrift(self):
+        """! Unit clock drift in seconds per second (positive - unit clock runs slow)
+        """
+        return self._drift
+
+    def UnitToHost(self, unit_time):
+        """! Correct a unit timestamp
+        @param unit_time Unit UTC time in seconds (e.g. ZDA of a ping)
+        @result Tuple (host UTC, host time.monotonic()) of the same instant, None - no samples
+        """
+        if None == self._offset:
+            return None
+        utc = unit_time + self._offset + self._drift * (unit_time - self._origin) - self._latency
+        return (utc, utc - self._wall_offset)
+
+    def GetError(self, unit_time = None):
+        """! Current unit clock error in seconds
+        @param unit_time Unit time to evaluate the error at, None - the last sample
+        @result host UTC minus unit UTC, None - no samples
+        """
+        if None == self._offset:
+            return None
+        if None == unit_time:
+            x = self._samples[-1][0]
+        else:
+            x = unit_time - self._origin
+        return self._offset + self._drift * x - self._latency
+
+    def NeedsResync(self):
+        """! Return True when the unit clock error exceeds resync threshold
+        """
+        error = self.GetError()
+        return None != error and abs(error) > self._resync_threshold
+
+    def Resync(self):
+        """! Set the unit time by SetCurrentTime() and restart the fit
+        @result SetCurrentTime() result, False - no echosounder attached
+        """
+        if None == self._echosounder:
+            return False
+        result = self._echosounder.SetCurrentTime()
+        self.Reset()
+        return result
+
+    def CheckResync(self):
+        """! Resync the unit clock only if drift exceeds the threshold
+        @result True - resync done, False - not needed or failed
+        """
+        if True == self.NeedsResync():
+            return True == self.Resync()
+        return False
@@ -0,0 +1,145 @@
+# Copyright (c) EofE Ultrasonics Co., Ltd., 2024
+"""! Echologger(c) protocol tables and parsers
+This module does not need pyserial, so recordings and "#info" dumps can be processed on hosts without serial ports.
+echosndr re-exports everything defined here.
+"""
+import enum
+import re
+
+SingleEchosounderCommands = [ 
+    ( "IdInfo",            "#info",       "",      ""),
+    ( "IdRange",           "#range",      "50000", " - #range[ ]{0,}\\[[ ]{0,}([0-9]{1,}) mm[ ]{0,}\\].*"),
+    ( "IdInterval",        "#interval",   "0.1",   " - #interval[ ]{0,}\\[[ ]{0,}(([0-9]*[.])?[0-9]+) sec[ ]{0,}\\].*") ,
+    ( "IdTxLength",        "#txlength",   "50",    " - #txlength[ ]{0,}\\[[ ]{0,}([0-9]{1,}) uks[ ]{0,}\\].*" ),
+    ( "IdGain",            "#gain",       "0.0",   " - #gain[ ]{0,}\\[[ ]{0,}([+-]?([0-9]*[.])?[0-9]+) dB[ ]{0,}\\].*" ),
+    ( "IdTVGMode",         "#tvgmode",    "1",     " - #tvgmode[ ]{0,}\\[[ ]{0,}([0-4]{1})[ ]{0,}\\].*" ),
+    ( "IdTVGAbs",          "#tvgabs",     "0.140", " - #tvgabs[ ]{0,}\\[[ ]{0,}([+-]?([0-9]*[.])?[0-9]+) dB\\/m[ ]{0,}\\].*" ),
+    ( "IdTVGSprd",         "#tvgsprd",    "15.0",  " - #tvgsprd[ ]{0,}\\[[ ]{0,}([+-]?([0-9]*[.])?[0-9]+)[ ]{0,}\\].*" ),
+    ( "IdSound",           "#sound",      "1500",  " - #sound[ ]{0,}\\[[ ]{0,}([0-9]{1,}) mps[ ]{0,}\\].*" ),
+    ( "IdDeadzone",        "#deadzone",   "300",   " - #deadzone[ ]{0,}\\[[ ]{0,}([0-9]{1,}) mm[ ]{0,}\\].*" ),
+    ( "IdThreshold",       "#threshold",  "10",    " - #threshold[ ]{0,}\\[[ ]{0,}([0-9]{1,}) %[ ]{0,}\\].*" ),
+    ( "IdOffset",          "#offset",     "0",     " - #offset[ ]{0,}\\[[ ]{0,}([0-9]{1,}) mm[ ]{0,}\\].*" ),
+    ( "IdMedianFlt",       "#medianflt",  "2",     " - #medianflt[ ]{0,}\\[[ ]{0,}([0-9]{1,3})[ ]{0,}\\].*" ),
+    ( "IdSMAFlt",          "#movavgflt",  "1",     " - #movavgflt[ ]{0,}\\[[ ]{0,}([0-9]{1,3})[ ]{0,}\\].*" ),
+    ( "IdOutrate",         "#outrate",    "0.0",   " - #nmearate[ ]{0,}\\[[ ]{0,}([+-]?([0-9]*[.])?[0-9]+) sec[ ]{0,}\\].*" ),
+    ( "IdNMEADBT",         "#nmeadbt",    "1",     " - #nmeadbt[ ]{0,}\\[[ ]{0,}([01]{1})[ ]{0,}\\].*" ),
+    ( "IdNMEADPT",         "#nmeadpt",    "1",     " - #nmeadpt[ ]{0,}\\[[ ]{0,}([01]{1})[ ]{0,}\\].*" ),
+    ( "IdNMEADPTOffset",   "#nmeadptoff", "0.0",   " - #nmeadptoff[ ]{0,}\\[[ ]{0,}([+-]?([0-9]*[.])?[0-9]+) m[ ]{0,}\\].*" ),
+    ( "IdNMEADPTZero",     "#nmeadpzero", "1",     " - #nmeadpzero[ ]{0,}\\[[ ]{0,}([01]{1})[ ]{0,}\\].*" ),
+    ( "IdNMEAMTW",         "#nmeamtw",    "1",     " - #nmeamtw[ ]{0,}\\[[ ]{0,}([01]{1})[ ]{0,}\\].*" ),
+    ( "IdAltprec",         "#altprec",    "3",     " - #altprec[ ]{0,}\\[[ ]{0,}([1-4]{1})[ ]{0,}\\].*" ),
+    ( "IdNMEAXDR",         "#nmeaxdr",    "1",     " - #nmeaxdr[ ]{0,}\\[[ ]{0,}([01]{1})[ ]{0,}\\].*" ),
+    ( "IdNMEAEMA",         "#nmeaema",    "1",     " - #nmeaema[ ]{0,}\\[[ ]{0,}([01]{1})[ ]{0,}\\].*" ),
+    ( "IdNMEAZDA",         "#nmeazda",    "0",     " - #nmeazda[ ]{0,}\\[[ ]{0,}([01]{1})[ ]{0,}\\].*" ),
+    ( "IdOutput",          "#output",     "3",     " - #output[ ]{0,}\\[[ ]{0,}([0-9]{1,})[ ]{0,}\\].*" ),
+    ( "IdTime",            "#time",       "0",     " - #time[ ]{0,}\\[[ ]{0,}([0-9]{1,})[ ]{0,}\\].*" ),
+    ( "IdSyncExtern",      "#syncextern", "0",     " - #syncextern[ ]{0,}\\[[ ]{0,}([01]{1})[ ]{0,}\\].*" ),
+    ( "IdSyncExternMode",  "#syncextmod", "1",     " - #syncextmod[ ]{0,}\\[[ ]{0,}([01]{1})[ ]{0,}\\].*" ),
+    ( "IdSyncOutPolarity", "#syncoutpol", "1",     " - #syncoutpol[ ]{0,}\\[[ ]{0,}([01]{1})[ ]{0,}\\].*" ),
+    ( "IdGetWorkFreq",     "",            "",      ".*Working Frequency:[ ]{0,}([0-9]{4,})Hz.*" ),
+    ( "IdVersion",         "#version",    "",      " S\\/W Ver: ([0-9]{1,}[.][0-9]{1,}) .*" ),
+    ( "IdGo",              "#go",         "",      "" )]
+
+DualEchosounderCommands = [
+    ( "IdInfo",            "#info",       "",      ""),
+    ( "IdRange",           "#range",      "50000", " - #range[ ]{0,}\\[[ ]{0,}([0-9]{1,}) mm[ ]{0,}\\].*"),
+    ( "IdRangeH",          "#rangeh",     "50000", " - #rangeh[ ]{0,}\\[[ ]{0,}([0-9]{1,}) mm[ ]{0,}\\].*"),
+    ( "IdRangeL",          "#rangel",     "50000", " - #rangel[ ]{0,}\\[[ ]{0,}([0-9]{1,}) mm[ ]{0,}\\].*"),
+    ( "IdInterval",        "#interval",   "1.0",   " - #interval[ ]{0,}\\[[ ]{0,}(([0-9]*[.])?[0-9]+) sec[ ]{0,}\\].*") ,
+    ( "IdPingonce",        "#pingonce",   "0",     " - #pingonce[ ]{0,}\\[[ ]{0,}([01]{1})[ ]{0,}\\].*" ),
+    ( "IdTxLength",        "#txlength",   "50",    " - #txlength[ ]{0,}\\[[ ]{0,}([0-9]{1,}) uks[ ]{0,}\\].*" ),
+    ( "IdTxLengthH",       "#txlengthh",  "50",    " - #txlengthh[ ]{0,}\\[[ ]{0,}([0-9]{1,}) uks[ ]{0,}\\].*" ),
+    ( "IdTxLengthL",       "#txlengthl",  "100",   " - #txlengthl[ ]{0,}\\[[ ]{0,}([0-9]{1,}) uks[ ]{0,}\\].*" ),
+    ( "IdTxPower",         "#txpower",    "0.0",   " - #txpower[ ]{0,}\\[[ ]{0,}([+-]?([0-9]*[.])?[0-9]+) dB[ ]{0,}\\].*" ),
+    ( "IdGain",            "#gain",       "0.0",   " - #gain[ ]{0,}\\[[ ]{0,}([+-]?([0-9]*[.])?[0-9]+) dB[ ]{0,}\\].*" ),
+    ( "IdGainH",           "#gainh",      "0.0",   " - #gainh[ ]{0,}\\[[ ]{0,}([+-]?([0-9]*[.])?[0-9]+) dB[ ]{0,}\\].*" ),
+    ( "IdGainL",           "#gainl",      "0.0",   " - #gainl[ ]{0,}\\[[ ]{0,}([+-]?([0-9]*[.])?[0-9]+) dB[ ]{0,}\\].*" ),
+    ( "IdTVGMode",         "#tvgmode",    "1",     " - #tvgmode[ ]{0,}\\[[ ]{0,}([0-4]{1})[ ]{0,}\\].*" ),
+    ( "IdTVGAbs",          "#tvgabs",     "0.140", " - #tvgabs[ ]{0,}\\[[ ]{0,}([+-]?([0-9]*[.])?[0-9]+) dB\\/m[ ]{0,}\\].*" ),
+    ( "IdTVGAbsH",         "#tvgabsh",    "0.140", " - #tvgabsh[ ]{0,}\\[[ ]{0,}([+-]?([0-9]*[.])?[0-9]+) dB\\/m[ ]{0,}\\].*" ),
+    ( "IdTVGAbsL",         "#tvgabsl",    "0.060", " - #tvgabsl[ ]{0,}\\[[ ]{0,}([+-]?([0-9]*[.])?[0-9]+) dB\\/m[ ]{0,}\\].*" ),
+    ( "IdTVGSprd",         "#tvgsprd",    "15.0",  " - #tvgsprd[ ]{0,}\\[[ ]{0,}([+-]?([0-9]*[.])?[0-9]+)[ ]{0,}\\].*" ),
+    ( "IdTVGSprdH",        "#tvgsprdh",   "15.0",  " - #tvgsprdh[ ]{0,}\\[[ ]{0,}([+-]?([0-9]*[.])?[0-9]+)[ ]{0,}\\].*" ),
+    ( "IdTVGSprdL",        "#tvgsprdl",   "15.0",  " - #tvgsprdl[ ]{0,}\\[[ ]{0,}([+-]?([0-9]*[.])?[0-9]+)[ ]{0,}\\].*" ),
+    ( "IdAttn",            "#attn",       "0",     " - #attn[ ]{0,}\\[[ ]{0,}([0-9]{1,}) uks[ ]{0,}\\].*" ),
+    ( "IdAttnH",           "#attnh",      "0",     " - #attnh[ ]{0,}\\[[ ]{0,}([0-9]{1,}) uks[ ]{0,}\\].*" ),
+    ( "IdAttnL",           "#attnl",      "0",     " - #attnl[ ]{0,}\\[[ ]{0,}([0-9]{1,}) uks[ ]{0,}\\].*" ),
+    ( "IdSound",           "#sound",      "1500",  " - #sound[ ]{0,}\\[[ ]{0,}([0-9]{1,}) mps[ ]{0,}\\].*" ),
+    ( "IdDeadzone",        "#deadzone",   "300",   " - #deadzone[ ]{0,}\\[[ ]{0,}([0-9]{1,}) mm[ ]{0,}\\].*" ),
+    ( "IdDeadzoneH",       "#deadzoneh",  "300",   " - #deadzoneh[ ]{0,}\\[[ ]{0,}([0-9]{1,}) mm[ ]{0,}\\].*" ),
+    ( "IdDeadzoneL",       "#deadzonel",  "500",   " - #deadzonel[ ]{0,}\\[[ ]{0,}([0-9]{1,}) mm[ ]{0,}\\].*" ),
+    ( "IdThreshold",       "#threshold",  "10",    " - #threshold[ ]{0,}\\[[ ]{0,}([0-9]{1,}) %[ ]{0,}\\].*" ),
+    ( "IdThresholdH",      "#thresholdh", "10",    " - #thresholdh[ ]{0,}\\[[ ]{0,}([0-9]{1,}) %[ ]{0,}\\].*" ),
+    ( "IdThresholdL",      "#thresholdl", "10",    " - #thresholdl[ ]{0,}\\[[ ]{0,}([0-9]{1,}) %[ ]{0,}\\].*" ),
+    ( "IdOffset",          "#offset",     "0",     " - #offset[ ]{0,}\\[[ ]{0,}([0-9]{1,}) mm[ ]{0,}\\].*" ),
+    ( "IdOffsetH",         "#offseth",    "0",     " - #offseth[ ]{0,}\\[[ ]{0,}([0-9]{1,}) mm[ ]{0,}\\].*" ),
+    ( "IdOffsetL",         "#offsetl",    "0",     " - #offsetl[ ]{0,}\\[[ ]{0,}([0-9]{1,}) mm[ ]{0,}\\].*" ),
+    ( "IdMedianFlt",       "#medianflt",  "2",     " - #medianflt[ ]{0,}\\[[ ]{0,}([0-9]{1,3})[ ]{0,}\\].*" ),
+    ( "IdSMAFlt",          "#movavgflt",  "1",     " - #movavgflt[ ]{0,}\\[[ ]{0,}([0-9]{1,3})[ ]{0,}\\].*" ),
+    ( "IdNMEADBT",         "#nmeadbt",    "1",     " - #nmeadbt[ ]{0,}\\[[ ]{0,}([01]{1})[ ]{0,}\\].*" ),
+    ( "IdNMEADPT",         "#nmeadpt",    "0",     " - #nmeadpt[ ]{0,}\\[[ ]{0,}([01]{1})[ ]{0,}\\].*" ),
+    ( "IdNMEAMTW",         "#nmeamtw",    "1",     " - #nmeamtw[ ]{0,}\\[[ ]{0,}([01]{1})[ ]{0,}\\].*" ),
+    ( "IdNMEAXDR",         "#nmeaxdr",    "1",     " - #nmeaxdr[ ]{0,}\\[[ ]{0,}([01]{1})[ ]{0,}\\].*" ),
+    ( "IdNMEAEMA",         "#nmeaema",    "0",     " - #nmeaema[ ]{0,}\\[[ ]{0,}([01]{1})[ ]{0,}\\].*" ),
+    ( "IdNMEAZDA",         "#nmeazda",    "0",     " - #nmeazda[ ]{0,}\\[[ ]{0,}([01]{1})[ ]{0,}\\].*" ),
+    ( "IdOutrate",         "#outrate",    "0.0",   " - #nmearate[ ]{0,}\\[[ ]{0,}([+-]?([0-9]*[.])?[0-9]+) sec[ ]{0,}\\].*" ),
+    ( "IdNMEADPTOffset",   "#nmeadptoff", "0.0",   " - #nmeadptoff[ ]{0,}\\[[ ]{0,}([+-]?([0-9]*[.])?[0-9]+) m[ ]{0,}\\].*" ),
+    ( "IdNMEADPTZero",     "#nmeadpzero", "1",     " - #nmeadpzero[ ]{0,}\\[[ ]{0,}([01]{1})[ ]{0,}\\].*" ),
+    ( "IdOutput",          "#output",     "3",     " - #output[ ]{0,}\\[[ ]{0,}([0-9]{1,})[ ]{0,}\\].*" ),
+    ( "IdAltprec",         "#altprec",    "3",     " - #altprec[ ]{0,}\\[[ ]{0,}([1-4]{1})[ ]{0,}\\].*" ),
+    ( "IdSamplFreq",       "#samplfreq",  "0",     " - #samplfreq[ ]{0,}\\[[ ]{0,}([0-9]{1,6})[ ]{0,}\\].*" ),
+    ( "IdTime",            "#time",       "0",     " - #time[ ]{0,}\\[[ ]{0,}([0-9]{1,})[ ]{0,}\\].*" ),
+    ( "IdSyncExtern",      "#syncextern", "0",     " - #syncextern[ ]{0,}\\[[ ]{0,}([01]{1})[ ]{0,}\\].*" ),
+    ( "IdSyncExternMode",  "#syncextmod", "1",     " - #syncextmod[ ]{0,}\\[[ ]{0,}([01]{1})[ ]{0,}\\].*" ),
+    ( "IdSyncOutPolarity", "#syncoutpol", "1",     " - #syncoutpol[ ]{0,}\\[[ ]{0,}([01]{1})[ ]{0,}\\].*" ),
+    ( "IdAnlgMode",        "#anlgmode",   "0",     " - #anlgmode[ ]{0,}\\[[ ]{0,}([01]{1})[ ]{0,}\\].*" ),
+    ( "IdAnlgRate",        "#anlgrate",   "0.100", " - #anlgrate[ ]{0,}\\[[ ]{0,}([+-]?([0-9]*[.])?[0-9]+) V\/m[ ]{0,}\\].*" ),
+    ( "IdAnlgMaxOut",      "#anlgmax",    "4",     " - #anlgmax[ ]{0,}\\[[ ]{0,}([1-4]{1})[ ]{0,}\\].*" ),
+    ( "IdVersion",         "#version",    "",      " S\\/W Ver: ([0-9]{1,}[.][0-9]{1,}) .*" ),
+
+    ( "IdSetHighFreq",     "#setfh",      "",      "" ),
+    ( "IdSetLowFreq",      "#setfl",      "",      "" ),
+    ( "IdSetDualFreq",     "#setfd",      "",      "" ),
+
+    ( "IdGetHighFreq",     "#getfh",      "",      ".*High Frequency:[ ]{0,}([0-9]{4,})Hz.*" ),
+    ( "IdGetLowFreq",      "#getfl",      "",      ".*Low Frequency:[ ]{0,}([0-9]{4,})Hz.*" ),
+    ( "IdGetWorkFreq",     "#getf",       "",      ".*:[ ]{1,}([0-9]{4,})Hz[ ]{0,}\\(Active\\).*" ),
+
+    ( "IdGo",              "#go",         "",      "" )]
+
+class EchosounderState(enum.IntEnum):
+    """! Protocol state of the echosounder as seen by the host
+    Disconnected - not detected (or lost), Idle - command prompt, Commanding - command sent, waiting for response,
+    Running - "#go" accepted, unit outputs data
+    """
+    Disconnected = 0
+    Idle = 1
+    Commanding = 2
+    Running = 3
+
+def FindCommand(commands, Command):
+    """! Find command in command table
+    @param commands Command table (e.g. DualEchosounderCommands)
+    @param Command CommandID
+    @result tuple (CommandID, text command, default value, regular expression), None - not found
+    """
+    for command in commands:
+        if command[0] == Command:
+            return command
+    return None
+
+def ParseInfo(lines, commands):
+    """! Parse "#info" response into parameter values
+    @param lines List of "#info" response lines
+    @param commands Command table (e.g. DualEchosounderCommands)
+    @result dictionary {CommandID: value}
+    """
+    settings = {}
+    for command in commands:
+        if len(command[3]) > 0:
+            reg = re.compile(command[3])
+            for line in lines:
+                match = reg.match(line)
+                if None != match:
+                    settings[command[0]] = match.group(1)
+    return settings
@@ -0,0 +1,212 @@
+# Copyright (c) EofE Ultrasonics Co., Ltd., 2024
+"""! Parallel batch converter of recorded echosounder logs
+
+    python echoconvert.py <input directory> <output directory> [--jobs N] [--format npz|parquet|hdf5|csv] [--pattern *.log]
+                          [--pyramid BASE]
+
+Every log found in the input tree is decoded into Ping records, checksums are validated and the pings are written
+into the same relative path of the output tree together with a "<name>.json" file of per-file statistics
+and optionally a "<name>.lod.npz" min/max/mean pyramid for plotting (see echopyramid).
+The statistics file is written last, so an interrupted conversion is resumed without redoing finished files.
+"""
+import argparse
+import concurrent.futures
+import csv
+import fnmatch
+import json
+import os
+import sys
+
+from echonmea import Ping, ReadPings
+
+def ReadMetaCsv(path):
+    """! Read "_meta.csv" sidecar written by the recorders (freq_hz,group,param,value)
+    @param path Sidecar path
+    @result dictionary {param: value}, empty if there is no sidecar
+    """
+    settings = {}
+    if not os.path.exists(path):
+        return settings
+    with open(path, "r", newline = "", encoding = "utf-8") as f:
+        for row in csv.DictReader(f):
+            if "param" in row and "value" in row:
+                settings[row["param"]] = row["value"]
+    return settings
+
+def FindGaps(pings, gap):
+    """! Find interruptions of ping times
+    @param pings List of Ping
+    @param gap Minimum time in seconds between two pings of the same frequency treated as a gap
+    @result list of (start, end) UTC times
+    """
+    gaps = []
+    last = {}
+    for ping in pings:
+        if None == ping.time:
+            continue
+        previous = last.get(ping.frequency)
+        if None != previous and (ping.time - previous > gap or ping.time < previous):
+            gaps.append((previous, ping.time))
+        last[ping.frequency] = ping.time
+    return gaps
+
+OutputExtensions = { "npz": ".npz", "parquet": ".parquet", "hdf5": ".h5", "csv": ".csv" }
+
+def WritePings(path, pings, fmt, settings = None):
+    """! Write pings to output file
+    @param path Output path without extension
+    @param pings List of Ping
+    @param fmt "npz" (numpy), "parquet" (pyarrow), "hdf5" (h5py) or "csv"
+    @param settings Settings stored as metadata of columnar formats
+    @result written file path
+    """
+    target = path + OutputExtensions[fmt]
+    if "csv" != fmt:
+        from echoexport import ColumnarSink
+        sink = ColumnarSink(target + ".tmp", settings, fmt)
+        sink.WritePings(pings)
+        sink.Close()
+    else:
+        with open(target + ".tmp", "w", newline = "", encoding = "utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(Ping._fields)
+            writer.writerows(["" if None == value else repr(value) for value in ping] for ping in pings)
+    os.replace(target + ".tmp", target)
+    return target
+
+def ConvertFile(source, output, fmt = "npz", gap = 2.0, pyramid = None):
+    """! Convert one log file (runs in a worker process)
+    @param source Log file path
+    @param output Output path without extension
+    @param fmt Output format
+    @param gap Gap threshold in seconds
+    @param pyramid Level 0 bucket width in seconds of the plotting pyramid, None - no pyramid
+    @result dictionary of per-file statistics
+    """
+    pings, decoder = ReadPings(source)
+    gaps = FindGaps(pings, gap)
+    times = [ping.time for ping in pings if None != ping.time]
+    frequencies = {}
+    for ping in pings:
+        frequencies[str(ping.frequency)] = frequencies.get(str(ping.frequency), 0) + 1
+
+    settings = ReadMetaCsv(os.path.splitext(source)[0] + "_meta.csv")
+
+    stats = decoder.GetStats()
+    stats.update({
+        "source": source,
+        "size": os.path.getsize(source),
+        "mtime": os.path.getmtime(source),
+        "output": WritePings(output, pings, fmt, settings),
+        "frequencies": frequencies,
+        "gaps": len(gaps),
+        "gap_time": sum(end - start for start, end in gaps),
+        "start": min(times) if len(times) > 0 else None,
+        "end": max(times) if len(times) > 0 else None,
+        "settings": settings })
+
+    if None != pyramid:
+        from echopyramid import PyramidBuilder
+        builder = PyramidBuilder(pyramid)
+        builder.AddPings(pings)
+        builder.Finish(settings).Save(output + ".lod.npz")
+        stats["pyramid"] = output + ".lod.npz"
+
+    with open(output + ".json.tmp", "w", encoding = "utf-8") as f:
+        json.dump(stats, f, indent = 1)
+    os.replace(output + ".json.tmp", output + ".json")
+    return stats
+
+def IsConverted(source, output):
+    """! Return True if the statistics file of a previous run matches the source file
+    """
+    try:
+        with open(output + ".json", "r", encoding = "utf-8") as f:
+            stats = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return stats.get("size") == os.path.getsize(source) and stats.get("mtime") == os.path.getmtime(source) \
+        and os.path.exists(stats.get("output", ""))
+
+def FindLogs(root, pattern = "*.log"):
+    """! Find log files in directory tree
+    @result sorted list of paths
+    """
+    found = []
+    for directory, dirs, files in os.walk(root):
+        for name in files:
+            if fnmatch.fnmatch(name, pattern):
+                found.append(os.path.join(directory, name))
+    return sorted(found)
+
+def ConvertTree(source_root, output_root, fmt = "npz", jobs = None, pattern = "*.log", gap = 2.0, force = False, report = None,
+                pyramid = None):
+    """! Convert all logs of a directory tree with a process pool
+    @param source_root Input directory
+    @param output_root Output directory (same relative layout)
+    @param fmt Output format
+    @param jobs Number of worker processes, None - number of CPUs
+    @param pattern File name pattern of logs
+    @param gap Gap threshold in seconds
+    @param force True - convert already converted files again
+    @param report Function called with statistics of every converted file
+    @param pyramid Level 0 bucket width in seconds of plotting pyramids, None - no pyramids
+    @result tuple (list of statistics of converted files, number of skipped files, list of (source, error))
+    """
+    tasks = []
+    skipped = 0
+    for source in FindLogs(source_root, pattern):
+        output = os.path.join(output_root, os.path.splitext(os.path.relpath(source, source_root))[0])
+        if False == force and True == IsConverted(source, output):
+            skipped += 1
+            continue
+        os.makedirs(os.path.dirname(output), exist_ok = True)
+        tasks.append((source, output))
+
+    results = []
+    errors = []
+    if 0 == len(tasks):
+        return results, skipped, errors
+
+    # Largest files first keeps all workers busy until the end
+    tasks.sort(key = lambda task: os.path.getsize(task[0]), reverse = True)
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers = jobs) as pool:
+        futures = { pool.submit(ConvertFile, source, output, fmt, gap, pyramid): source for source, output in tasks }
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                stats = future.result()
+            except Exception as e: # one broken file must not stop the batch
+                errors.append((futures[future], "%s: %s" % (type(e).__name__, e)))
+                continue
+            results.append(stats)
+            if None != report:
+                report(stats)
+
+    return results, skipped, errors
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Convert recorded echosounder logs in parallel")
+    parser.add_argument("input", help = "input directory")
+    parser.add_argument("output", help = "output directory")
+    parser.add_argument("--jobs", type = int, default = None, help = "worker processes (default: number of CPUs)")
+    parser.add_argument("--format", choices = list(OutputExtensions.keys()), default = "npz", help = "output format")
+    parser.add_argument("--pattern", default = "*.log", help = "log file name pattern")
+    parser.add_argument("--gap", type = float, default = 2.0, help = "gap threshold in seconds")
+    parser.add_argument("--force", action = "store_true", help = "convert already converted files again")
+    parser.add_argument("--pyramid", type = float, default = None, help = "also write min/max/mean pyramid with this base bucket in seconds")
+    args = parser.parse_args(argv)
+
+    def report(stats):
+        print("%s: %d pings, %d bad checksums, %d gaps" % (stats["source"], stats["pings"], stats["bad_checksums"], stats["gaps"]))
+
+    results, skipped, errors = ConvertTree(args.input, args.output, args.format, args.jobs, args.pattern, args.gap, args.force, report,
+                                           args.pyramid)
+
+    for source, error in errors:
+        print("%s: %s" % (source, error), file = sys.stderr)
+    print("Converted %d files (%d pings), skipped %d, failed %d" % (len(results), sum(stats["pings"] for stats in results), skipped, len(errors)))
+    return 1 if len(errors) > 0 else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,159 @@
+# Copyright (c) EofE Ultrasonics Co., Ltd., 2024
+import json
+import os
+import zipfile
+
+import numpy
+
+# Column types of the exported ping records, missing values are NaN (0 for frequency)
+PingColumns = [
+    ("frequency",   numpy.int32),
+    ("time",        numpy.float64),
+    ("depth",       numpy.float64),
+    ("dpt",         numpy.float64),
+    ("temperature", numpy.float64),
+    ("pitch",       numpy.float64),
+    ("roll",        numpy.float64),
+    ("ema",         numpy.float64)]
+
+SettingsKey = "__settings__"
+
+def _FormatFromPath(path):
+    """! Guess format from file extension
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension in (".parquet", ".pq"):
+        return "parquet"
+    if extension in (".h5", ".hdf5"):
+        return "hdf5"
+    return "npz"
+
+class ColumnarSink():
+    """! Columnar export sink for ping records
+    Pings are stored into preallocated column buffers and written as one row group every row_group pings, so there
+    is one write per column and row group instead of one per ping. NPZ is always available (numpy), Parquet needs
+    pyarrow and HDF5 needs h5py. Echosounder settings are stored as file metadata.
+    NPZ keeps every row group as "<column>.<group>" arrays, LoadColumns() joins them back.
+    """
+    def __init__(self, path, settings = None, fmt = None, row_group = 4096, compress = True):
+        """! Constructor
+        @param path Output file path
+        @param settings Echosounder settings stored as metadata (e.g. Echosounder.GetSettings())
+        @param fmt "npz", "parquet" or "hdf5", None - from file extension
+        @param row_group Number of pings per row group
+        @param compress True - compress row groups
+        """
+        self._path = path
+        self._format = fmt if None != fmt else _FormatFromPath(path)
+        self._row_group = row_group
+        self._settings = json.dumps(dict(settings) if None != settings else {})
+        self._columns = { name: numpy.zeros(row_group, dtype) for name, dtype in PingColumns }
+        self._count = 0
+        self._groups = 0
+        self._rows = 0
+        self._writer = None
+
+        if "npz" == self._format:
+            self._writer = zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED if True == compress else zipfile.ZIP_STORED)
+            with self._writer.open(SettingsKey + ".npy", "w") as f:
+                numpy.lib.format.write_array(f, numpy.array(self._settings))
+        elif "parquet" == self._format:
+            import pyarrow
+            import pyarrow.parquet
+            fields = [pyarrow.field(name, pyarrow.from_numpy_dtype(dtype)) for name, dtype in PingColumns]
+            schema = pyarrow.schema(fields, metadata = { SettingsKey: self._settings })
+            self._writer = pyarrow.parquet.ParquetWriter(path, schema, compression = "zstd" if True == compress else "none")
+        elif "hdf5" == self._format:
+            import h5py
+            self._writer = h5py.File(path, "w")
+            self._writer.attrs[SettingsKey] = self._settings
+            for name, dtype in PingColumns:
+                self._writer.create_dataset(name, (0,), dtype = dtype, maxshape = (None,), chunks = (row_group,),
+                                            compression = "gzip" if True == compress else None)
+        else:
+            raise ValueError("Unknown format: %s" % self._format)
+
+    def Write(self, ping):
+        """! Add ping record
+        @param ping Ping
+        """
+        i = self._count
+        columns = self._columns
+        for (name, dtype), value in zip(PingColumns, ping):
+            columns[name][i] = value if None != value else (0 if numpy.int32 == dtype else numpy.nan)
+        self._count += 1
+        if self._count == self._row_group:
+            self.Flush()
+
+    def WritePings(self, pings):
+        """! Add several ping records
+        """
+        for ping in pings:
+            self.Write(ping)
+
+    def Flush(self):
+        """! Write buffered pings as a row group
+        """
+        count = self._count
+        if 0 == count:
+            return
+
+        if "npz" == self._format:
+            for name, dtype in PingColumns:
+                with self._writer.open("%s.%05d.npy" % (name, self._groups), "w") as f:
+                    numpy.lib.format.write_array(f, self._columns[name][:count])
+        elif "parquet" == self._format:
+            import pyarrow
+            arrays = [pyarrow.array(self._columns[name][:count]) for name, dtype in PingColumns]
+            self._writer.write_table(pyarrow.Table.from_arrays(arrays, schema = self._writer.schema))
+        else:
+            for name, dtype in PingColumns:
+                dataset = self._writer[name]
+                dataset.resize((self._rows + count,))
+                dataset[self._rows:] = self._columns[name][:count]
+
+        self._rows += count
+        self._groups += 1
+        self._count = 0
+
+    def Close(self):
+        """! Write the last row group and close the file
+        """
+        if None == self._writer:
+            return
+        self.Flush()
+        self._writer.close()
+        self._writer = None
+
+    def GetRows(self):
+        """! Return number of pings written and buffered
+        """
+        return self._rows + self._count
+
+def LoadColumns(path, fmt = None):
+    """! Load exported ping records
+    @param path File written by ColumnarSink
+    @param fmt "npz", "parquet" or "hdf5", None - from file extension
+    @result tuple (dictionary {column: numpy array}, settings dictionary)
+    """
+    fmt = fmt if None != fmt else _FormatFromPath(path)
+
+    if "parquet" == fmt:
+        import pyarrow.parquet
+        table = pyarrow.parquet.read_table(path)
+        metadata = table.schema.metadata or {}
+        settings = json.loads(metadata.get(SettingsKey.encode(), b"{}"))
+        return { name: table.column(name).to_numpy() for name, dtype in PingColumns }, settings
+
+    if "hdf5" == fmt:
+        import h5py
+        with h5py.File(path, "r") as f:
+            return { name: f[name][:] for name, dtype in PingColumns }, json.loads(f.attrs.get(SettingsKey, "{}"))
+
+    with numpy.load(path) as f:
+        settings = json.loads(str(f[SettingsKey])) if SettingsKey in f.files else {}
+        columns = {}
+        for name, dtype in PingColumns:
+            groups = sorted(key for key in f.files if key.startswith(name + "."))
+            columns[name] = numpy.concatenate([f[key] for key in groups]) if len(groups) > 0 else numpy.zeros(0, dtype)
+        return columns, settings
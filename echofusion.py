@@ -0,0 +1,124 @@
+# Copyright (c) EofE Ultrasonics Co., Ltd., 2024
+import collections
+
+FusedPing = collections.namedtuple("FusedPing", "time hf_frequency lf_frequency hf_depth lf_depth difference ema_ratio consistent")
+FusedPing.__doc__ = """! Pair of high and low frequency pings of the dual frequency mode: time of the high frequency ping,
+    frequencies in Hz, DBT depths in meters, difference = lf_depth - hf_depth (soft sediment thickness),
+    ema_ratio = hf EMA / lf EMA and consistent = both depths received and difference within the limits.
+    Values which can not be calculated are None"""
+
+FusedColumns = FusedPing._fields
+
+class FusionStage():
+    """! Incremental fusion of dual frequency pings
+    Pings are paired in arrival order: a ping is paired with the directly preceding unpaired ping when their
+    frequencies differ and their ZDA times are within tolerance, otherwise it waits for the next ping.
+    FuseColumns() applies the same rule to archived columns, so live and post-processed products are identical.
+    """
+    def __init__(self, tolerance = 0.5, min_difference = -0.1, max_difference = 5.0):
+        """! Constructor
+        @param tolerance Maximum ZDA time difference in seconds of a pair
+        @param min_difference Smallest consistent lf_depth - hf_depth in meters (negative - allowed disagreement)
+        @param max_difference Largest consistent lf_depth - hf_depth in meters
+        """
+        self._tolerance = tolerance
+        self._min_difference = min_difference
+        self._max_difference = max_difference
+        self._pending = None
+        self.pairs = 0
+        self.unpaired = 0
+
+    def __Pairs(self, a, b):
+        """! Return True if pings a and b (a received first) form a pair
+        """
+        if None == a.frequency or None == b.frequency or 0 == a.frequency or 0 == b.frequency:
+            return False
+        if a.frequency == b.frequency or None == a.time or None == b.time:
+            return False
+        return abs(b.time - a.time) <= self._tolerance
+
+    def __Fuse(self, a, b):
+        """! Build FusedPing of a pair
+        """
+        hf, lf = (a, b) if a.frequency > b.frequency else (b, a)
+        difference = None
+        if None != hf.depth and None != lf.depth:
+            difference = lf.depth - hf.depth
+        ema_ratio = None
+        if None != hf.ema and None != lf.ema and 0 != lf.ema:
+            ema_ratio = hf.ema / lf.ema
+        consistent = None != difference and difference >= self._min_difference and difference <= self._max_difference
+        return FusedPing(hf.time, hf.frequency, lf.frequency, hf.depth, lf.depth, difference, ema_ratio, consistent)
+
+    def Feed(self, ping):
+        """! Add ping
+        @param ping Ping (see echonmea)
+        @result FusedPing completed by this ping, None - no pair completed
+        """
+        pending = self._pending
+        if None != pending and True == self.__Pairs(pending, ping):
+            self._pending = None
+            self.pairs += 1
+            return self.__Fuse(pending, ping)
+        if None != pending:
+            self.unpaired += 1
+        self._pending = ping
+        return None
+
+    def FeedPings(self, pings):
+        """! Add several pings
+        @result list of FusedPing
+        """
+        fused = []
+        for ping in pings:
+            pair = self.Feed(ping)
+            if None != pair:
+                fused.append(pair)
+        return fused
+
+    def GetStats(self):
+        """! Return counters: pairs, unpaired (pings which found no partner)
+        """
+        return { "pairs": self.pairs, "unpaired": self.unpaired }
+
+def FuseColumns(columns, tolerance = 0.5, min_difference = -0.1, max_difference = 5.0):
+    """! Vectorized fusion of archived pings with the FusionStage pairing rule
+    @param columns Dictionary of ping columns {name: numpy array} in arrival order (see echoexport.LoadColumns())
+    @param tolerance, min_difference, max_difference See FusionStage
+    @result dictionary {FusedColumns name: numpy array}, missing values are NaN
+    """
+    import numpy
+
+    frequency = numpy.asarray(columns["frequency"])
+    time = numpy.asarray(columns["time"], dtype = numpy.float64)
+    depth = numpy.asarray(columns["depth"], dtype = numpy.float64)
+    ema = numpy.asarray(columns["ema"], dtype = numpy.float64)
+
+    # link i - ping i and ping i + 1 may form a pair (NaN times never pair)
+    with numpy.errstate(invalid = "ignore"):
+        link = (frequency[:-1] != frequency[1:]) & (frequency[:-1] != 0) & (frequency[1:] != 0) & \
+               (numpy.abs(time[1:] - time[:-1]) <= tolerance)
+
+    # In a run of consecutive links the pings pair up from the start of the run: links 0, 2, 4... of the run
+    index = numpy.arange(len(link))
+    previous = numpy.concatenate(([False], link[:-1]))
+    start = numpy.maximum.accumulate(numpy.where(link & ~previous, index, -1)) if len(link) > 0 else index
+    first = index[link & (0 == (index - start) % 2)]
+    second = first + 1
+
+    high = frequency[first] > frequency[second]
+    hf = numpy.where(high, first, second)
+    lf = numpy.where(high, second, first)
+
+    hf_ema = ema[hf]
+    lf_ema = ema[lf]
+    difference = depth[lf] - depth[hf]
+    ema_ratio = numpy.full(len(hf), numpy.nan)
+    valid = numpy.isfinite(hf_ema) & numpy.isfinite(lf_ema) & (0 != lf_ema)
+    ema_ratio[valid] = hf_ema[valid] / lf_ema[valid]
+    with numpy.errstate(invalid = "ignore"):
+        consistent = numpy.isfinite(difference) & (difference >= min_difference) & (difference <= max_difference)
+
+    return { "time": time[hf], "hf_frequency": frequency[hf], "lf_frequency": frequency[lf],
+             "hf_depth": depth[hf], "lf_depth": depth[lf], "difference": difference, "ema_ratio": ema_ratio,
+             "consistent": consistent }
@@ -0,0 +1,343 @@
+# Copyright (c) EofE Ultrasonics Co., Ltd., 2024
+import calendar
+import collections
+import heapq
+
+from echonmea import IsValidSentence, ReadPings
+
+Fix = collections.namedtuple("Fix", "time latitude longitude quality satellites hdop altitude")
+Fix.__doc__ = """! GNSS position: UTC time in seconds, latitude/longitude in degrees (north/east positive), GGA fix quality
+    (1 for RMC), number of satellites, HDOP and altitude in meters. Values which were not received are None"""
+
+Sounding = collections.namedtuple("Sounding", "time latitude longitude frequency depth ema quality span")
+Sounding.__doc__ = """! Geo-referenced ping: ping time, position interpolated between the surrounding fixes (None - GNSS dropout),
+    frequency in Hz, DBT depth in meters, EMA, fix quality of the fix before the ping and span of the surrounding
+    fixes in seconds"""
+
+def _Coordinate(value, hemisphere, degrees):
+    """! Convert NMEA "dddmm.mmmm" coordinate to degrees
+    """
+    if len(value) < degrees + 2:
+        return None
+    try:
+        coordinate = int(value[:degrees]) + float(value[degrees:]) / 60.0
+    except ValueError:
+        return None
+    return -coordinate if hemisphere in ("S", "W") else coordinate
+
+def _Seconds(hms):
+    """! Convert "hhmmss.ss" to seconds of day
+    """
+    if len(hms) < 6:
+        return None
+    try:
+        return int(hms[0:2]) * 3600 + int(hms[2:4]) * 60 + float(hms[4:])
+    except ValueError:
+        return None
+
+def _Float(field):
+    """! Convert NMEA field to float, None for empty or bad field
+    """
+    try:
+        return float(field)
+    except ValueError:
+        return None
+
+class GnssDecoder():
+    """! Streaming decoder of GNSS NMEA sentences ($GPGGA, $GNGGA, $GPRMC, $GNRMC, any talker) into Fix records
+    GGA has no date, it is taken from the last RMC (or ZDA) sentence, or from the date given to the constructor.
+    A time of day smaller than the previous one moves the date to the next day. Fixes without position or with
+    quality 0 / status "V" are counted as invalid and skipped, a fix with the time of the previous one (GGA and
+    RMC of the same epoch) is skipped as duplicate.
+    """
+    def __init__(self, date = None, validate = True):
+        """! Constructor
+        @param date UTC time in seconds of any moment of the first day, None - wait for RMC/ZDA
+        @param validate True - check sentence checksums
+        """
+        self._validate = validate
+        self._day = None if None == date else date - date % 86400
+        self._last_seconds = None
+        self._last_time = None
+        self.sentences = 0
+        self.bad_checksums = 0
+        self.invalid = 0
+        self.fixes = 0
+
+    def __Time(self, seconds):
+        """! Combine time of day with the current date
+        """
+        if None != self._last_seconds and seconds < self._last_seconds - 43200:
+            self._day += 86400
+        self._last_seconds = seconds
+        return self._day + seconds
+
+    def __SetDate(self, day, month, year, seconds):
+        """! Set current date from RMC/ZDA
+        """
+        try:
+            self._day = calendar.timegm((year, month, day, 0, 0, 0, 0, 0, 0))
+        except (ValueError, OverflowError):
+            return
+        self._last_seconds = seconds
+
+    def Feed(self, line):
+        """! Decode one line
+        @param line Received line (str)
+        @result Fix, None - line is not a new valid fix
+        """
+        line = line.strip()
+        if len(line) < 7 or line[0] != '$':
+            return None
+        kind = line[3:6]
+        if kind not in ("GGA", "RMC", "ZDA"):
+            return None
+        if True == self._validate and False == IsValidSentence(line):
+            self.bad_checksums += 1
+            return None
+        self.sentences += 1
+        fields = line.split('*')[0].split(',')
+
+        if "ZDA" == kind:
+            seconds = _Seconds(fields[1]) if len(fields) > 4 else None
+            if None != seconds:
+                try:
+                    self.__SetDate(int(fields[2]), int(fields[3]), int(fields[4]), seconds)
+                except ValueError:
+                    pass
+            return None
+
+        if "RMC" == kind:
+            if len(fields) < 10:
+                self.invalid += 1
+                return None
+            seconds = _Seconds(fields[1])
+            date = fields[9]
+            if None != seconds and len(date) == 6 and date.isdigit():
+                self.__SetDate(int(date[0:2]), int(date[2:4]), 2000 + int(date[4:6]), seconds)
+            if "A" != fields[2] or None == seconds or None == self._day:
+                self.invalid += 1
+                return None
+            fix = Fix(self.__Time(seconds), _Coordinate(fields[3], fields[4], 2), _Coordinate(fields[5], fields[6], 3),
+                      1, None, None, None)
+        else:
+            if len(fields) < 10:
+                self.invalid += 1
+                return None
+            seconds = _Seconds(fields[1])
+            quality = int(fields[6]) if fields[6].isdigit() else 0
+            if 0 == quality or None == seconds or None == self._day:
+                self.invalid += 1
+                return None
+            fix = Fix(self.__Time(seconds), _Coordinate(fields[2], fields[3], 2), _Coordinate(fields[4], fields[5], 3),
+                      quality, int(fields[7]) if fields[7].isdigit() else None, _Float(fields[8]), _Float(fields[9]))
+
+        if None == fix.latitude or None == fix.longitude:
+            self.invalid += 1
+            return None
+        if None != self._last_time and fix.time <= self._last_time:
+            return None
+        self._last_time = fix.time
+        self.fixes += 1
+        return fix
+
+    def FeedLines(self, lines):
+        """! Decode several lines
+        @result list of Fix
+        """
+        fixes = []
+        for line in lines:
+            fix = self.Feed(line)
+            if None != fix:
+                fixes.append(fix)
+        return fixes
+
+    def GetStats(self):
+        """! Return counters: sentences, bad_checksums, invalid, fixes
+        """
+        return { "sentences": self.sentences, "bad_checksums": self.bad_checksums, "invalid": self.invalid, "fixes": self.fixes }
+
+def ReadFixes(path, date = None, validate = True):
+    """! Decode recorded GNSS log file
+    @param path Log file path
+    @param date See GnssDecoder
+    @result tuple (list of Fix, GnssDecoder with counters)
+    """
+    decoder = GnssDecoder(date, validate)
+    with open(path, "rb") as f:
+        fixes = decoder.FeedLines(f.read().decode("latin_1").splitlines())
+    return fixes, decoder
+
+def _Interpolate(a, b, t):
+    """! Interpolate position between fixes a and b at time t, longitude across +-180 degrees
+    """
+    k = (t - a.time) / (b.time - a.time)
+    dlon = b.longitude - a.longitude
+    if dlon > 180.0:
+        dlon -= 360.0
+    elif dlon < -180.0:
+        dlon += 360.0
+    longitude = a.longitude + k * dlon
+    if longitude > 180.0:
+        longitude -= 360.0
+    elif longitude < -180.0:
+        longitude += 360.0
+    return a.latitude + k * (b.latitude - a.latitude), longitude
+
+class GeoMerger():
+    """! Streaming merge of echosounder pings with GNSS fixes
+    Pings and fixes can be added as they arrive from two ports. A ping gets the position interpolated between the
+    last fix at or before its time and the first fix after it: a ping newer than the last fix waits for the next
+    fix, a ping older than the last fix (GNSS stream ahead) is interpolated from the recent fixes at once.
+    When the surrounding fixes are more than max_gap seconds apart (GNSS dropout) the ping is released without
+    position, and a waiting ping is released as soon as a ping max_gap seconds newer arrives, so a dropout never
+    stalls the output or grows memory.
+    """
+    def __init__(self, max_gap = 2.0):
+        """! Constructor
+        @param max_gap Longest interval in seconds between fixes which is interpolated
+        """
+        self._max_gap = max_gap
+        self._fixes = collections.deque()
+        self._waiting = collections.deque()
+        self.soundings = 0
+        self.unpositioned = 0
+
+    def __Release(self, ping, before, after):
+        """! Build Sounding of ping between fixes (None - no fix)
+        """
+        latitude = longitude = span = None
+        if None != before and None != after:
+            span = after.time - before.time
+            if span <= self._max_gap:
+                latitude, longitude = _Interpolate(before, after, ping.time)
+        self.soundings += 1
+        if None == latitude:
+            self.unpositioned += 1
+        return Sounding(ping.time, latitude, longitude, ping.frequency, ping.depth, ping.ema,
+                        before.quality if None != before else None, span)
+
+    def AddPing(self, ping):
+        """! Add ping
+        @param ping Ping (see echonmea)
+        @result list of Sounding released by this ping
+        """
+        if None == ping.time:
+            return [self.__Release(ping, None, None)]
+
+        fixes = self._fixes
+        released = []
+        while len(self._waiting) > 0 and ping.time - self._waiting[0].time > self._max_gap:
+            waiting = self._waiting.popleft()
+            released.append(self.__Release(waiting, fixes[-1] if len(fixes) > 0 else None, None))
+
+        if 0 == len(fixes) or ping.time >= fixes[-1].time:
+            if len(fixes) > 0 and ping.time - fixes[-1].time > self._max_gap:
+                released.append(self.__Release(ping, fixes[-1], None))
+            else:
+                self._waiting.append(ping)
+            return released
+
+        # GNSS stream is ahead: find the surrounding fixes in the recent history
+        after = len(fixes) - 1
+        while after > 0 and fixes[after - 1].time > ping.time:
+            after -= 1
+        released.append(self.__Release(ping, fixes[after - 1] if after > 0 else None, fixes[after] if after > 0 else None))
+        return released
+
+    def AddFix(self, fix):
+        """! Add fix
+        @param fix Fix (increasing times, see GnssDecoder)
+        @result list of Sounding released by this fix
+        """
+        fixes = self._fixes
+        if len(fixes) > 0 and fix.time <= fixes[-1].time:
+            return []
+        released = []
+        previous = fixes[-1] if len(fixes) > 0 else None
+        while len(self._waiting) > 0 and self._waiting[0].time < fix.time:
+            released.append(self.__Release(self._waiting.popleft(), previous, fix))
+        fixes.append(fix)
+        while len(fixes) > 2 and fix.time - fixes[1].time > 2 * self._max_gap:
+            fixes.popleft()
+        return released
+
+    def Flush(self):
+        """! Release all waiting pings (end of stream)
+        @result list of Sounding
+        """
+        released = []
+        while len(self._waiting) > 0:
+            released.append(self.__Release(self._waiting.popleft(), self._fixes[-1] if len(self._fixes) > 0 else None, None))
+        return released
+
+    def GetStats(self):
+        """! Return counters: soundings, unpositioned (released without position)
+        """
+        return { "soundings": self.soundings, "unpositioned": self.unpositioned }
+
+def MergeStreams(pings, fixes, max_gap = 2.0):
+    """! K-way merge of time ordered ping and fix sequences (e.g. recorded files) through GeoMerger
+    @param pings Iterable of Ping ordered by time
+    @param fixes Iterable of Fix ordered by time
+    @param max_gap See GeoMerger
+    @result tuple (list of Sounding, GeoMerger with counters)
+    """
+    merger = GeoMerger(max_gap)
+    soundings = []
+    # fixes go first at equal times: a ping at a fix time is interpolated from that fix and the next one
+    stream = heapq.merge(((fix.time, 0, fix) for fix in fixes),
+                         ((ping.time if None != ping.time else float("-inf"), 1, ping) for ping in pings),
+                         key = lambda item: (item[0], item[1]))
+    for time, kind, item in stream:
+        soundings.extend(merger.AddFix(item) if 0 == kind else merger.AddPing(item))
+    soundings.extend(merger.Flush())
+    return soundings, merger
+
+def MergeFiles(echosounder_path, gnss_path, max_gap = 2.0, date = None):
+    """! Geo-reference recorded echosounder log with recorded GNSS log
+    @result tuple (list of Sounding, GeoMerger with counters)
+    """
+    pings = ReadPings(echosounder_path)[0]
+    fixes = ReadFixes(gnss_path, date)[0]
+    pings.sort(key = lambda ping: float("-inf") if None == ping.time else ping.time)
+    return MergeStreams(pings, fixes, max_gap)
+
+def InterpolatePositions(ping_times, fix_times, latitudes, longitudes, max_gap = 2.0):
+    """! Vectorized position interpolation (batch mode, same rule as GeoMerger)
+    @param ping_times numpy array of ping times (NaN - no time)
+    @param fix_times numpy array of fix times, increasing
+    @param latitudes, longitudes numpy arrays of fix positions in degrees
+    @param max_gap See GeoMerger
+    @result tuple (latitude, longitude) numpy arrays, NaN - no position
+    """
+    import numpy
+
+    ping_times = numpy.asarray(ping_times, dtype = numpy.float64)
+    fix_times = numpy.asarray(fix_times, dtype = numpy.float64)
+    latitudes = numpy.asarray(latitudes, dtype = numpy.float64)
+    longitudes = numpy.asarray(longitudes, dtype = numpy.float64)
+
+    latitude = numpy.full(len(ping_times), numpy.nan)
+    longitude = numpy.full(len(ping_times), numpy.nan)
+    if len(fix_times) < 2:
+        return latitude, longitude
+
+    # surrounding fixes: last fix at or before the ping and first fix after it
+    after = numpy.searchsorted(fix_times, ping_times, side = "right")
+    valid = numpy.isfinite(ping_times) & (after > 0) & (after < len(fix_times))
+    after = numpy.where(valid, after, 1)
+    before = after - 1
+    span = fix_times[after] - fix_times[before]
+    valid &= span <= max_gap
+
+    k = (ping_times - fix_times[before]) / numpy.where(span > 0, span, 1.0)
+    dlon = longitudes[after] - longitudes[before]
+    dlon = numpy.where(dlon > 180.0, dlon - 360.0, numpy.where(dlon < -180.0, dlon + 360.0, dlon))
+    lon = longitudes[before] + k * dlon
+    lon = numpy.where(lon > 180.0, lon - 360.0, numpy.where(lon < -180.0, lon + 360.0, lon))
+    lat = latitudes[before] + k * (latitudes[after] - latitudes[before])
+
+    latitude[valid] = lat[valid]
+    longitude[valid] = lon[valid]
+    return latitude, longitude
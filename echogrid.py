@@ -0,0 +1,290 @@
+# Copyright (c) EofE Ultrasonics Co., Ltd., 2024
+import collections
+import json
+import math
+import os
+
+import numpy
+
+# Per cell layers of a tile: count, mean, M2 (sum of squared deviations, Welford), min, max
+TileLayers = ("count", "mean", "m2", "min", "max")
+
+class LocalProjection():
+    """! Equirectangular projection to meters around a reference point, good enough for survey areas of a few km
+    """
+    def __init__(self, latitude, longitude):
+        """! Constructor
+        @param latitude, longitude Reference point in degrees
+        """
+        self._latitude = latitude
+        self._longitude = longitude
+        self._my = 111320.0
+        self._mx = 111320.0 * math.cos(math.radians(latitude))
+
+    def Forward(self, latitude, longitude):
+        """! Convert degrees to (x east, y north) meters, works with numpy arrays
+        """
+        dlon = longitude - self._longitude
+        dlon = numpy.where(dlon > 180.0, dlon - 360.0, numpy.where(dlon < -180.0, dlon + 360.0, dlon))
+        return dlon * self._mx, (latitude - self._latitude) * self._my
+
+    def GetReference(self):
+        """! Return (latitude, longitude) of the reference point
+        """
+        return (self._latitude, self._longitude)
+
+def _NewTile(size):
+    """! Return empty tile {layer: array}
+    """
+    return { "count": numpy.zeros((size, size), numpy.int64),
+             "mean": numpy.zeros((size, size), numpy.float64),
+             "m2": numpy.zeros((size, size), numpy.float64),
+             "min": numpy.full((size, size), numpy.inf),
+             "max": numpy.full((size, size), -numpy.inf) }
+
+def _Combine(tile, count, mean, m2, minimum, maximum, index = None):
+    """! Merge cell statistics into tile (Chan et al. parallel variance), index - flat cell indexes of the arrays
+    """
+    layers = { name: tile[name].reshape(-1) for name in TileLayers }
+    if index is None: # index is a numpy array
+        index = numpy.arange(layers["count"].size)
+    n_a = layers["count"][index].astype(numpy.float64)
+    n_b = count.astype(numpy.float64)
+    n = n_a + n_b
+    safe = numpy.where(n > 0, n, 1.0)
+    delta = mean - layers["mean"][index]
+    layers["mean"][index] = layers["mean"][index] + delta * n_b / safe
+    layers["m2"][index] = layers["m2"][index] + m2 + delta * delta * n_a * n_b / safe
+    layers["count"][index] += count
+    layers["min"][index] = numpy.minimum(layers["min"][index], minimum)
+    layers["max"][index] = numpy.maximum(layers["max"][index], maximum)
+
+class DepthGrid():
+    """! Incremental sparse tiled depth grid
+    Soundings are accumulated into square cells of cell_size (units of the x/y coordinates, meters with
+    LocalProjection). Cells are grouped into tile_size x tile_size tiles created on first use, every cell keeps
+    count, mean, min, max and variance (Welford update, O(1) per sounding). At most max_tiles tiles stay in memory,
+    the least recently used tiles are written to directory and loaded back when needed. Grids of parallel jobs
+    with the same cell and tile size are merged by Merge().
+    """
+    def __init__(self, cell_size, tile_size = 256, directory = None, max_tiles = None):
+        """! Constructor
+        @param cell_size Cell size in coordinate units
+        @param tile_size Number of cells along a tile side
+        @param directory Directory of tile files (Save(), evicted tiles), None - tiles stay in memory
+        @param max_tiles Maximum number of tiles in memory (needs directory), None - no limit
+        """
+        if None != max_tiles and None == directory:
+            raise ValueError("max_tiles needs a tile directory")
+        self._cell_size = float(cell_size)
+        self._tile_size = int(tile_size)
+        self._directory = directory
+        self._max_tiles = max_tiles
+        self._tiles = collections.OrderedDict()
+        self._stored = set()
+        self._last = None
+        self.soundings = 0
+        if None != directory:
+            os.makedirs(directory, exist_ok = True)
+
+    def __TilePath(self, key):
+        """! Return file path of tile
+        """
+        return os.path.join(self._directory, "tile_%d_%d.npz" % key)
+
+    def __WriteTile(self, key, tile):
+        """! Write tile file
+        """
+        path = self.__TilePath(key)
+        with open(path + ".tmp", "wb") as f:
+            numpy.savez(f, **tile)
+        os.replace(path + ".tmp", path)
+        self._stored.add(key)
+
+    def __Tile(self, key):
+        """! Return tile, load it from disk or create it
+        """
+        if None != self._last and self._last[0] == key:
+            return self._last[1]
+        tile = self._tiles.get(key)
+        if None == tile:
+            if key in self._stored:
+                with numpy.load(self.__TilePath(key)) as f:
+                    tile = { name: f[name].copy() for name in TileLayers }
+            else:
+                tile = _NewTile(self._tile_size)
+            self._tiles[key] = tile
+            if None != self._max_tiles and len(self._tiles) > self._max_tiles:
+                old_key, old_tile = self._tiles.popitem(last = False)
+                self.__WriteTile(old_key, old_tile)
+        else:
+            self._tiles.move_to_end(key)
+        self._last = (key, tile)
+        return tile
+
+    def Add(self, x, y, depth):
+        """! Add one sounding
+        @param x, y Coordinates
+        @param depth Depth in meters (None or NaN - ignored)
+        """
+        if None == depth or depth != depth:
+            return
+        size = self._tile_size
+        column = math.floor(x / self._cell_size)
+        row = math.floor(y / self._cell_size)
+        tile = self.__Tile((column // size, row // size))
+        i = row % size
+        j = column % size
+
+        count = tile["count"][i, j] + 1
+        mean = tile["mean"][i, j]
+        delta = depth - mean
+        mean += delta / count
+        tile["count"][i, j] = count
+        tile["mean"][i, j] = mean
+        tile["m2"][i, j] += delta * (depth - mean)
+        if depth < tile["min"][i, j]:
+            tile["min"][i, j] = depth
+        if depth > tile["max"][i, j]:
+            tile["max"][i, j] = depth
+        self.soundings += 1
+
+    def AddSoundings(self, soundings, projection):
+        """! Add geo-referenced soundings (see echognss.Sounding), soundings without position are ignored
+        @param soundings List of Sounding
+        @param projection LocalProjection
+        """
+        for sounding in soundings:
+            if None != sounding.latitude and None != sounding.depth:
+                x, y = projection.Forward(sounding.latitude, sounding.longitude)
+                self.Add(float(x), float(y), sounding.depth)
+
+    def AddArrays(self, x, y, depth):
+        """! Add soundings from numpy arrays (batch mode, same statistics as Add())
+        @param x, y Coordinate arrays
+        @param depth Depth array, NaN - ignored
+        """
+        x = numpy.asarray(x, dtype = numpy.float64)
+        y = numpy.asarray(y, dtype = numpy.float64)
+        depth = numpy.asarray(depth, dtype = numpy.float64)
+        valid = numpy.isfinite(x) & numpy.isfinite(y) & numpy.isfinite(depth)
+        x, y, depth = x[valid], y[valid], depth[valid]
+        if 0 == len(depth):
+            return
+
+        size = self._tile_size
+        column = numpy.floor(x / self._cell_size).astype(numpy.int64)
+        row = numpy.floor(y / self._cell_size).astype(numpy.int64)
+        tile_x = column // size
+        tile_y = row // size
+        cell = (row % size) * size + column % size
+
+        order = numpy.lexsort((cell, tile_y, tile_x))
+        tile_x, tile_y, cell, depth = tile_x[order], tile_y[order], cell[order], depth[order]
+        # groups of equal (tile, cell)
+        change = numpy.concatenate(([True], (tile_x[1:] != tile_x[:-1]) | (tile_y[1:] != tile_y[:-1]) | (cell[1:] != cell[:-1])))
+        starts = numpy.flatnonzero(change)
+        group = numpy.cumsum(change) - 1
+        count = numpy.diff(numpy.append(starts, len(depth)))
+        mean = numpy.add.reduceat(depth, starts) / count
+        m2 = numpy.add.reduceat((depth - mean[group]) ** 2, starts)
+        minimum = numpy.minimum.reduceat(depth, starts)
+        maximum = numpy.maximum.reduceat(depth, starts)
+
+        tiles = numpy.flatnonzero(numpy.concatenate(([True], (tile_x[starts][1:] != tile_x[starts][:-1]) |
+                                                              (tile_y[starts][1:] != tile_y[starts][:-1]))))
+        for first, last in zip(tiles, numpy.append(tiles[1:], len(starts))):
+            tile = self.__Tile((int(tile_x[starts[first]]), int(tile_y[starts[first]])))
+            _Combine(tile, count[first:last], mean[first:last], m2[first:last], minimum[first:last],
+                     maximum[first:last], cell[starts[first:last]])
+        self.soundings += len(depth)
+
+    def Merge(self, other):
+        """! Add statistics of another grid with the same cell and tile size (e.g. of a parallel batch job)
+        """
+        if other._cell_size != self._cell_size or other._tile_size != self._tile_size:
+            raise ValueError("Grids have different cell or tile size")
+        for key in other.GetTileKeys():
+            source = other.GetTile(key)
+            _Combine(self.__Tile(key), source["count"].reshape(-1), source["mean"].reshape(-1), source["m2"].reshape(-1),
+                     source["min"].reshape(-1), source["max"].reshape(-1))
+        self.soundings += other.soundings
+
+    def GetTileKeys(self):
+        """! Return sorted list of (tile x, tile y) of all tiles
+        """
+        return sorted(set(self._tiles.keys()) | self._stored)
+
+    def GetTile(self, key):
+        """! Return tile arrays {"count", "mean", "m2", "min", "max"}, row 0 is the southern row of cells
+        """
+        return self.__Tile(key)
+
+    def GetTileProducts(self, key):
+        """! Return tile products: count, mean, std, min, max arrays, NaN in empty cells
+        @result dictionary {name: array}
+        """
+        tile = self.__Tile(key)
+        count = tile["count"]
+        empty = 0 == count
+        with numpy.errstate(invalid = "ignore", divide = "ignore"):
+            std = numpy.sqrt(tile["m2"] / numpy.where(count > 1, count - 1, 1))
+        std[count < 2] = numpy.nan
+        return { "count": count.copy(), "mean": numpy.where(empty, numpy.nan, tile["mean"]), "std": std,
+                 "min": numpy.where(empty, numpy.nan, tile["min"]), "max": numpy.where(empty, numpy.nan, tile["max"]) }
+
+    def GetTileOrigin(self, key):
+        """! Return (x, y) of the south west corner of tile
+        """
+        extent = self._cell_size * self._tile_size
+        return (key[0] * extent, key[1] * extent)
+
+    def GetLayer(self, name = "mean"):
+        """! Assemble one product of all tiles into a single array (coverage and QC maps)
+        @param name "count", "mean", "std", "min" or "max"
+        @result tuple (array, x, y of the south west corner), None - grid is empty
+        """
+        keys = self.GetTileKeys()
+        if 0 == len(keys):
+            return None
+        size = self._tile_size
+        x0 = min(key[0] for key in keys)
+        y0 = min(key[1] for key in keys)
+        width = (max(key[0] for key in keys) - x0 + 1) * size
+        height = (max(key[1] for key in keys) - y0 + 1) * size
+        layer = numpy.zeros((height, width), numpy.int64) if "count" == name else numpy.full((height, width), numpy.nan)
+        for key in keys:
+            i = (key[1] - y0) * size
+            j = (key[0] - x0) * size
+            layer[i:i + size, j:j + size] = self.GetTileProducts(key)[name]
+        return layer, x0 * size * self._cell_size, y0 * size * self._cell_size
+
+    def Save(self, directory = None):
+        """! Write all tiles and "grid.json" with grid parameters
+        @param directory Output directory, None - tile directory of the grid
+        """
+        target = directory if None != directory else self._directory
+        os.makedirs(target, exist_ok = True)
+        for key in self.GetTileKeys():
+            tile = self.__Tile(key)
+            path = os.path.join(target, "tile_%d_%d.npz" % key)
+            with open(path + ".tmp", "wb") as f:
+                numpy.savez(f, **tile)
+            os.replace(path + ".tmp", path)
+        if None != self._directory and os.path.abspath(target) == os.path.abspath(self._directory):
+            self._stored |= set(self._tiles.keys())
+        with open(os.path.join(target, "grid.json"), "w", encoding = "utf-8") as f:
+            json.dump({ "cell_size": self._cell_size, "tile_size": self._tile_size, "soundings": self.soundings,
+                        "tiles": [list(key) for key in self.GetTileKeys()] }, f, indent = 1)
+
+    @staticmethod
+    def Load(directory, max_tiles = None):
+        """! Open grid written by Save(), tiles are loaded when used
+        @result DepthGrid
+        """
+        with open(os.path.join(directory, "grid.json"), "r", encoding = "utf-8") as f:
+            document = json.load(f)
+        grid = DepthGrid(document["cell_size"], document["tile_size"], directory, max_tiles)
+        grid._stored = set(tuple(key) for key in document["tiles"])
+        grid.soundings = document["soundings"]
+        return grid
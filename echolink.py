@@ -0,0 +1,130 @@
+# Copyright (c) EofE Ultrasonics Co., Ltd., 2024
+import collections
+import time
+
+from echonmea import PingDecoder
+
+# Counters with rolling rates, errors are also reported relative to "lines" and incomplete pings relative to "pings"
+RateCounters = ("lines", "sentences", "bad_checksums", "truncated", "junk", "pings", "incomplete_pings")
+LineErrors = ("bad_checksums", "truncated", "junk")
+
+def _Snapshot(stats):
+    """! Flatten decoder statistics into {counter: value} and {(frequency, counter): value}
+    """
+    flat = { name: stats[name] for name in RateCounters }
+    for frequency, counters in stats["per_frequency"].items():
+        for name in ("pings", "incomplete_pings", "bad_checksums", "truncated", "junk"):
+            flat[(frequency, name)] = counters[name]
+    return flat
+
+def _Rates(first, last):
+    """! Calculate rolling rates between two snapshots (time, flat counters)
+    """
+    elapsed = last[0] - first[0]
+    old = first[1]
+    new = last[1]
+    delta = { key: value - old.get(key, 0) for key, value in new.items() }
+
+    rates = { "window": elapsed }
+    for name in RateCounters:
+        rates[name + "_per_s"] = delta[name] / elapsed if elapsed > 0 else 0.0
+    lines = delta["lines"]
+    for name in LineErrors:
+        rates[name + "_ratio"] = delta[name] / lines if lines > 0 else 0.0
+    rates["incomplete_ratio"] = delta["incomplete_pings"] / delta["pings"] if delta["pings"] > 0 else 0.0
+
+    per_frequency = {}
+    for key, value in delta.items():
+        if isinstance(key, tuple):
+            per_frequency.setdefault(key[0], {})[key[1]] = value
+    for frequency, counters in per_frequency.items():
+        pings = counters["pings"]
+        per_frequency[frequency] = {
+            "pings_per_s": pings / elapsed if elapsed > 0 else 0.0,
+            "incomplete_ratio": counters["incomplete_pings"] / pings if pings > 0 else 0.0,
+            "errors_per_ping": sum(counters[name] for name in LineErrors) / pings if pings > 0 else 0.0 }
+    rates["per_frequency"] = per_frequency
+    return rates
+
+class LinkMonitor():
+    """! Link quality telemetry of one or several echosounders
+    Every device has its own PingDecoder, the received lines are decoded once and the decoder counters are sampled
+    at most every interval seconds into a short history, so rolling rates over the window cost nothing per line.
+    """
+    def __init__(self, window = 60.0, interval = 1.0, validate = True):
+        """! Constructor
+        @param window Rolling rate window in seconds
+        @param interval Sampling interval of the counters in seconds
+        @param validate True - check sentence checksums
+        """
+        self._window = window
+        self._interval = interval
+        self._validate = validate
+        self._decoders = {}
+        self._history = {}
+
+    def GetDecoder(self, device):
+        """! Return PingDecoder of device, created on first use
+        @param device Device name (e.g. serial port)
+        """
+        decoder = self._decoders.get(device)
+        if None == decoder:
+            decoder = PingDecoder(self._validate)
+            self._decoders[device] = decoder
+            self._history[device] = collections.deque()
+        return decoder
+
+    def Feed(self, device, lines, now = None):
+        """! Decode received lines of device
+        @param device Device name
+        @param lines List of received lines (str)
+        @param now Host time.monotonic() of reception, None - now
+        @result list of completed Ping records
+        """
+        pings = self.GetDecoder(device).FeedLines(lines)
+        self.Sample(device, now)
+        return pings
+
+    def Sample(self, device, now = None, force = False):
+        """! Take counter snapshot of device if the sampling interval elapsed
+        """
+        if None == now:
+            now = time.monotonic()
+        history = self._history[device]
+        if False == force and len(history) > 0 and now - history[-1][0] < self._interval:
+            return
+        history.append((now, _Snapshot(self._decoders[device].GetStats())))
+        while len(history) > 2 and now - history[1][0] >= self._window:
+            history.popleft()
+
+    def GetRates(self, device):
+        """! Return rolling rates of device over the window
+        @result dictionary: window (seconds covered), <counter>_per_s, bad_checksums_ratio, truncated_ratio,
+            junk_ratio (per line), incomplete_ratio (per ping) and per_frequency {"<frequency>": {pings_per_s,
+            incomplete_ratio, errors_per_ping}}
+        """
+        history = self._history[device]
+        if len(history) < 2:
+            return _Rates(history[0], history[0]) if len(history) > 0 else None
+        return _Rates(history[0], history[-1])
+
+    def GetStats(self):
+        """! Return {device: {"totals": decoder counters, "rates": rolling rates}}, can be stored with recordings
+        """
+        return { device: { "totals": decoder.GetStats(), "rates": self.GetRates(device) }
+                 for device, decoder in self._decoders.items() }
+
+    def CheckAlarms(self, limits):
+        """! Compare rolling rates with limits
+        @param limits Dictionary {rate name: maximum}, e.g. {"bad_checksums_ratio": 0.01, "incomplete_ratio": 0.05}
+        @result list of (device, rate name, value) over the limit
+        """
+        alarms = []
+        for device in self._decoders:
+            rates = self.GetRates(device)
+            if None == rates:
+                continue
+            for name, limit in limits.items():
+                if rates.get(name, 0.0) > limit:
+                    alarms.append((device, name, rates[name]))
+        return alarms
@@ -0,0 +1,226 @@
+# Copyright (c) EofE Ultrasonics Co., Ltd., 2024
+import calendar
+import collections
+
+def NmeaChecksum(body):
+    """! Calculate NMEA 0183 checksum
+    @param body Sentence text between '$' (or '#') and '*'
+    @result Checksum as integer 0..255
+    """
+    checksum = 0
+    for ch in body:
+        checksum ^= ord(ch)
+    return checksum
+
+def IsValidSentence(line):
+    """! Check the "*hh" checksum of a sentence
+    Echologger(c) units protect both "$SD..." sentences and "#F ... Hz" markers with a NMEA checksum,
+    the leading '#' of the markers is included in the checksum
+    @param line Sentence text, with or without trailing "\\r\\n"
+    @result True - checksum matches, False - checksum missing or wrong
+    """
+    line = line.strip()
+    star = line.rfind('*')
+    if len(line) < 4 or star < 1 or len(line) - star != 3:
+        return False
+    try:
+        expected = int(line[star + 1:], 16)
+    except ValueError:
+        return False
+    first = 1 if line[0] == '$' else 0
+    return NmeaChecksum(line[first:star]) == expected
+
+def ParseZDA(line):
+    """! Parse "$xxZDA,hhmmss.ss,dd,mm,yyyy,zh,zm*cs" sentence
+    @param line ZDA sentence
+    @result UTC time in seconds since 1970/01/01 00:00 (float), None - not a valid ZDA sentence
+    """
+    fields = line.strip().split('*')[0].split(',')
+    if len(fields) < 5 or not fields[0].endswith("ZDA") or len(fields[1]) < 6:
+        return None
+    try:
+        hms = fields[1]
+        seconds = float(hms[4:])
+        whole = calendar.timegm((int(fields[4]), int(fields[3]), int(fields[2]),
+                                 int(hms[0:2]), int(hms[2:4]), 0, 0, 0, 0))
+    except ValueError:
+        return None
+    return whole + seconds
+
+Ping = collections.namedtuple("Ping", "frequency time depth dpt temperature pitch roll ema")
+Ping.__doc__ = """! One ping block of the Echologger(c) NMEA output: frequency in Hz ("#F" marker), ZDA UTC time in seconds,
+    DBT depth and DPT depth in meters, MTW water temperature in C, XDR pitch/roll in degrees and EMA in % of FS.
+    Values which were not received are None"""
+
+def _Float(field):
+    """! Convert NMEA field to float, None for empty or bad field
+    """
+    try:
+        return float(field)
+    except ValueError:
+        return None
+
+class PingDecoder():
+    """! Streaming decoder of NMEA lines into Ping records
+    A ping starts with the "#F <frequency> Hz" marker and lasts until the next marker. Sentences with bad checksums
+    are counted and skipped.
+    Link quality counters: truncated - sentence without "*hh" tail, bad_checksums - checksum mismatch,
+    junk - line with non printable characters, incomplete_pings - ping block without a sentence type which earlier
+    pings of the same frequency had (e.g. "#F" without "$SDDBT"). Errors inside a ping block are also counted
+    per frequency (see GetStats()).
+    """
+    def __init__(self, validate = True):
+        """! Constructor
+        @param validate True - check sentence checksums
+        """
+        self._validate = validate
+        self._current = None
+        self._kinds = None
+        self._expected = {}
+        self._frequencies = {}
+        self.lines = 0
+        self.sentences = 0
+        self.bad_checksums = 0
+        self.truncated = 0
+        self.junk = 0
+        self.pings = 0
+        self.incomplete_pings = 0
+
+    def Feed(self, line):
+        """! Decode one line
+        @param line Received line (str)
+        @result Ping completed by this line (the previous ping block), None - no ping completed
+        """
+        self.lines += 1
+        line = line.strip()
+        if len(line) < 2:
+            return None
+        if not line.isascii() or not line.isprintable():
+            self.junk += 1
+            self.__Count("junk")
+        if line[0] != '$' and line[0] != '#':
+            return None
+
+        if True == self._validate and False == IsValidSentence(line):
+            star = line.rfind('*')
+            if star < 1 or len(line) - star != 3:
+                self.truncated += 1
+                self.__Count("truncated")
+            else:
+                self.bad_checksums += 1
+                self.__Count("bad_checksums")
+            return None
+        self.sentences += 1
+
+        if line.startswith("#F"):
+            fields = line.split('*')[0].split()
+            completed = self.Flush()
+            try:
+                self._current = { "frequency": int(fields[1]) }
+            except (IndexError, ValueError):
+                self._current = { "frequency": None }
+            self._kinds = set()
+            return completed
+
+        if None == self._current:
+            return None
+
+        fields = line.split('*')[0].split(',')
+        kind = fields[0][3:]
+        current = self._current
+        self._kinds.add(kind)
+
+        if "DBT" == kind and len(fields) > 3:
+            current["depth"] = _Float(fields[3])
+        elif "DPT" == kind and len(fields) > 1:
+            current["dpt"] = _Float(fields[1])
+        elif "MTW" == kind and len(fields) > 1:
+            current["temperature"] = _Float(fields[1])
+        elif "ZDA" == kind:
+            current["time"] = ParseZDA(line)
+        elif "XDR" == kind:
+            if len(fields) > 6 and "PTCH" in fields:
+                current["pitch"] = _Float(fields[2])
+                current["roll"] = _Float(fields[6])
+            elif len(fields) > 4 and "EMA" == fields[4]:
+                current["ema"] = _Float(fields[2])
+
+        return None
+
+    def FeedLines(self, lines):
+        """! Decode several lines
+        @result list of completed Ping records
+        """
+        pings = []
+        for line in lines:
+            ping = self.Feed(line)
+            if None != ping:
+                pings.append(ping)
+        return pings
+
+    def Flush(self):
+        """! Complete the current ping block (end of stream)
+        @result Ping, None - no ping block started
+        """
+        current = self._current
+        self._current = None
+        if None == current:
+            return None
+        self.pings += 1
+
+        frequency = current.get("frequency")
+        stats = self.__Frequency(frequency)
+        stats["pings"] += 1
+        expected = self._expected.get(frequency)
+        if None == expected:
+            self._expected[frequency] = self._kinds
+        elif len(expected - self._kinds) > 0:
+            self.incomplete_pings += 1
+            stats["incomplete_pings"] += 1
+            for kind in expected - self._kinds:
+                stats["missing"][kind] = stats["missing"].get(kind, 0) + 1
+            expected |= self._kinds
+        else:
+            expected |= self._kinds
+
+        return Ping(current.get("frequency"), current.get("time"), current.get("depth"), current.get("dpt"),
+                    current.get("temperature"), current.get("pitch"), current.get("roll"), current.get("ema"))
+
+    def __Frequency(self, frequency):
+        """! Return per frequency counters
+        """
+        stats = self._frequencies.get(frequency)
+        if None == stats:
+            stats = { "pings": 0, "incomplete_pings": 0, "bad_checksums": 0, "truncated": 0, "junk": 0, "missing": {} }
+            self._frequencies[frequency] = stats
+        return stats
+
+    def __Count(self, counter):
+        """! Count link error inside the current ping block
+        """
+        if None != self._current:
+            self.__Frequency(self._current.get("frequency"))[counter] += 1
+
+    def GetStats(self):
+        """! Return counters: lines, sentences, bad_checksums, truncated, junk, pings, incomplete_pings and
+            per_frequency {"<frequency>": {pings, incomplete_pings, bad_checksums, truncated, junk, missing {type: n}}}
+        """
+        per_frequency = {}
+        for frequency, stats in self._frequencies.items():
+            per_frequency[str(frequency)] = dict(stats, missing = dict(stats["missing"]))
+        return { "lines": self.lines, "sentences": self.sentences, "bad_checksums": self.bad_checksums,
+                 "truncated": self.truncated, "junk": self.junk, "pings": self.pings,
+                 "incomplete_pings": self.incomplete_pings, "per_frequency": per_frequency }
+
+def ReadPings(path, validate = True):
+    """! Decode recorded log file
+    @param path Log file path (raw NMEA output as written by the recorders)
+    @result tuple (list of Ping, PingDecoder with counters)
+    """
+    decoder = PingDecoder(validate)
+    with open(path, "rb") as f:
+        pings = decoder.FeedLines(f.read().decode("latin_1").splitlines())
+    ping = decoder.Flush()
+    if None != ping:
+        pings.append(ping)
+    return pings, decoder
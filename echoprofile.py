@@ -0,0 +1,274 @@
+# Copyright (c) EofE Ultrasonics Co., Ltd., 2024
+import json
+import math
+
+# Valid values of settable commands, see Echosounder_commands.md
+# (type, minimum, maximum) or (type, minimum, maximum, special) - the special value outside of the range is also
+# valid (0 - output rate same as #interval, automatic sampling frequency).
+# Median/SMA filters accept 1 (filter off) as in the factory defaults.
+CommandRanges = {
+    "IdRange":           (int,   1000,   200000),
+    "IdRangeH":          (int,   1000,   200000),
+    "IdRangeL":          (int,   1000,   200000),
+    "IdInterval":        (float, 0.01,   10.0),
+    "IdPingonce":        (int,   0,      1),
+    "IdTxLength":        (int,   10,     200),
+    "IdTxLengthH":       (int,   10,     200),
+    "IdTxLengthL":       (int,   10,     200),
+    "IdTxPower":         (float, -40.0,  0.0),
+    "IdGain":            (float, -60.0,  60.0),
+    "IdGainH":           (float, -60.0,  60.0),
+    "IdGainL":           (float, -60.0,  60.0),
+    "IdTVGMode":         (int,   0,      2),
+    "IdTVGAbs":          (float, 0.0,    2.0),
+    "IdTVGAbsH":         (float, 0.0,    2.0),
+    "IdTVGAbsL":         (float, 0.0,    2.0),
+    "IdTVGSprd":         (float, 10.0,   40.0),
+    "IdTVGSprdH":        (float, 10.0,   40.0),
+    "IdTVGSprdL":        (float, 10.0,   40.0),
+    "IdAttn":            (int,   0,      300000),
+    "IdAttnH":           (int,   0,      300000),
+    "IdAttnL":           (int,   0,      300000),
+    "IdSound":           (int,   1000,   2000),
+    "IdDeadzone":        (int,   0,      200000),
+    "IdDeadzoneH":       (int,   0,      200000),
+    "IdDeadzoneL":       (int,   0,      200000),
+    "IdThreshold":       (int,   10,     80),
+    "IdThresholdH":      (int,   10,     80),
+    "IdThresholdL":      (int,   10,     80),
+    "IdOffset":          (int,   -1000,  1000),
+    "IdOffsetH":         (int,   -1000,  1000),
+    "IdOffsetL":         (int,   -1000,  1000),
+    "IdMedianFlt":       (int,   1,      21),
+    "IdSMAFlt":          (int,   1,      12),
+    "IdNMEADBT":         (int,   0,      1),
+    "IdNMEADPT":         (int,   0,      1),
+    "IdNMEAMTW":         (int,   0,      1),
+    "IdNMEAXDR":         (int,   0,      1),
+    "IdNMEAEMA":         (int,   0,      1),
+    "IdNMEAZDA":         (int,   0,      1),
+    "IdOutrate":         (float, 0.1,    2.0,    0),
+    "IdNMEADPTOffset":   (float, -50.0,  50.0),
+    "IdNMEADPTZero":     (int,   0,      1),
+    "IdOutput":          (int,   1,      255),
+    "IdAltprec":         (int,   1,      4),
+    "IdSamplFreq":       (int,   6250,   100000, 0),
+    "IdTime":            (int,   0,      4294967295),
+    "IdSyncExtern":      (int,   0,      1),
+    "IdSyncExternMode":  (int,   0,      1),
+    "IdSyncOutPolarity": (int,   0,      1),
+    "IdAnlgMode":        (int,   0,      1),
+    "IdAnlgRate":        (float, 0.005,  10.0),
+    "IdAnlgMaxOut":      (int,   1,      4)}
+
+# Deadzone can not exceed the working range of the same frequency
+DeadzoneRanges = {
+    "IdDeadzone":  "IdRange",
+    "IdDeadzoneH": "IdRangeH",
+    "IdDeadzoneL": "IdRangeL"}
+
+# Commands without value which may be run before the settings (working frequency selection)
+ModeCommands = ["IdSetHighFreq", "IdSetLowFreq", "IdSetDualFreq"]
+
+class ProfileError(ValueError):
+    """! Profile can not be loaded or contains invalid values
+    """
+    def __init__(self, errors):
+        self.errors = list(errors)
+        super().__init__("; ".join(self.errors))
+
+def NormalizeValue(Command, Value):
+    """! Check value against CommandRanges and convert it to the text sent to the echosounder
+    @param Command CommandID
+    @param Value value as number or text
+    @result text value
+    @exception ProfileError value is not a number or out of range
+    """
+    kind, minimum, maximum = CommandRanges[Command][:3]
+    special = CommandRanges[Command][3] if len(CommandRanges[Command]) > 3 else None
+    try:
+        number = float(Value)
+    except (TypeError, ValueError):
+        raise ProfileError(["%s: '%s' is not a number" % (Command, Value)])
+
+    if False == math.isfinite(number):
+        raise ProfileError(["%s: '%s' is not a finite number" % (Command, Value)])
+
+    if int == kind:
+        if number != int(number):
+            raise ProfileError(["%s: '%s' is not an integer" % (Command, Value)])
+        number = int(number)
+
+    if (number < minimum or number > maximum) and number != special:
+        if None != special:
+            raise ProfileError(["%s: %s is out of range %s or %s~%s" % (Command, Value, special, minimum, maximum)])
+        raise ProfileError(["%s: %s is out of range %s~%s" % (Command, Value, minimum, maximum)])
+
+    if int == kind:
+        return str(number)
+    if isinstance(Value, str):
+        return Value.strip()
+    return str(number)
+
+def _SameValue(a, b):
+    """! Compare two setting values numerically when possible
+    """
+    try:
+        return float(a) == float(b)
+    except (TypeError, ValueError):
+        return str(a) == str(b)
+
+class Profile():
+    """! Echosounder configuration profile
+    Keeps ordered {CommandID: value} settings and optional mode commands (e.g. "IdSetDualFreq").
+    Values are validated offline against CommandRanges and the echosounder's command table,
+    so a bad profile fails before anything is sent to the unit.
+    """
+    def __init__(self, settings, commands = None, name = ""):
+        """! Constructor
+        @param settings Dictionary {CommandID: value}, or grouped {"group": {CommandID: value}} as used in test scripts
+        @param commands List of mode commands run before the settings
+        @param name Profile name
+        """
+        self._name = name
+        self._commands = list(commands) if None != commands else []
+        self._settings = {}
+        for key, value in settings.items():
+            if isinstance(value, dict):
+                for Command, groupvalue in value.items():
+                    self._settings[Command] = groupvalue
+            else:
+                self._settings[key] = value
+
+    @staticmethod
+    def Load(path, commands = None):
+        """! Load and validate profile from JSON file
+            File contains either settings only, or {"name": ..., "commands": [...], "settings": {...}}
+        @param path File path
+        @param commands Command table to validate against (e.g. DualEchosounderCommands), None - ranges only
+        @result Profile
+        @exception ProfileError profile is invalid
+        """
+        try:
+            with open(path, "r", encoding = "utf-8") as f:
+                document = json.load(f)
+        except (OSError, ValueError) as e:
+            raise ProfileError(["%s: %s" % (path, e)])
+
+        if not isinstance(document, dict):
+            raise ProfileError(["%s: profile should be a JSON object" % path])
+
+        if "settings" in document:
+            profile = Profile(document["settings"], document.get("commands"), document.get("name", path))
+        else:
+            profile = Profile(document, None, path)
+
+        profile.Validate(commands)
+        return profile
+
+    def Save(self, path):
+        """! Save profile to JSON file
+        @param path File path
+        """
+        with open(path, "w", encoding = "utf-8") as f:
+            json.dump({"name": self._name, "commands": self._commands, "settings": self._settings}, f, indent = 4)
+
+    def GetName(self):
+        """! Return profile name
+        """
+        return self._name
+
+    def GetSettings(self):
+        """! Return copy of profile settings {CommandID: value}
+        """
+        return dict(self._settings)
+
+    def GetCommands(self):
+        """! Return list of mode commands
+        """
+        return list(self._commands)
+
+    def Validate(self, commands = None, current = None):
+        """! Validate profile and normalize its values
+        @param commands Command table of the echosounder (e.g. DualEchosounderCommands), None - ranges only
+        @param current Current echosounder settings used for cross checks (deadzone vs range)
+        @result dictionary {CommandID: normalized text value}
+        @exception ProfileError with all errors found
+        """
+        errors = []
+        normalized = {}
+        settable = None
+        known = None
+
+        if None != commands:
+            settable = set(command[0] for command in commands if len(command[2]) > 0)
+            known = set(command[0] for command in commands)
+
+        for Command in self._commands:
+            if Command not in ModeCommands or (None != known and Command not in known):
+                errors.append("%s: not a mode command of this echosounder" % Command)
+
+        for Command, Value in self._settings.items():
+            if Command not in CommandRanges or (None != settable and Command not in settable):
+                errors.append("%s: unknown or read-only parameter" % Command)
+                continue
+            try:
+                normalized[Command] = NormalizeValue(Command, Value)
+            except ProfileError as e:
+                errors.extend(e.errors)
+
+        merged = dict(current) if None != current else {}
+        merged.update(normalized)
+        for deadzone, workrange in DeadzoneRanges.items():
+            if deadzone in normalized and workrange in merged:
+                try:
+                    if float(merged[deadzone]) > float(merged[workrange]):
+                        errors.append("%s: %s mm exceeds %s %s mm" % (deadzone, merged[deadzone], workrange, merged[workrange]))
+                except ValueError:
+                    pass
+
+        if len(errors) > 0:
+            raise ProfileError(errors)
+
+        return normalized
+
+    def Plan(self, current = None, commands = None):
+        """! Compile profile into the minimal ordered command plan
+            Settings already equal to the current ones are skipped, working ranges go before deadzones
+        @param current Current echosounder settings (Echosounder.GetSettings()), None - send everything
+        @param commands Command table of the echosounder, None - ranges only
+        @result list of (CommandID, value) pairs
+        @exception ProfileError profile is invalid
+        """
+        normalized = self.Validate(commands, current)
+        current = current if None != current else {}
+        plan = []
+
+        for Command, Value in normalized.items():
+            if Command in current and _SameValue(current[Command], Value):
+                continue
+            plan.append((Command, Value))
+
+        plan.sort(key = lambda item: 0 if item[0] in DeadzoneRanges.values() else 1)
+        return plan
+
+    def Apply(self, echosounder, pipelined = True):
+        """! Validate profile, run mode commands and send only changed settings with a single Stop/Start cycle
+        @param echosounder Echosounder instance
+        @param pipelined Pipeline settings (see Echosounder.SetValues())
+        @result list of (CommandID, value, result code) for everything sent
+        @exception ProfileError profile is invalid, nothing is sent
+        """
+        commands = echosounder.GetCommands()
+        current = echosounder.GetSettings()
+        plan = self.Plan(current, commands)
+        results = []
+
+        for Command in self._commands:
+            results.append((Command, None, echosounder.SendCommand(Command)))
+
+        if len(plan) > 0:
+            codes = echosounder.SetValues(plan, pipelined)
+            results.extend((Command, Value, code) for (Command, Value), code in zip(plan, codes))
+
+        return results
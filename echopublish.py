@@ -0,0 +1,252 @@
+# Copyright (c) EofE Ultrasonics Co., Ltd., 2024
+import selectors
+import socket
+import threading
+
+from echonmea import IsValidSentence
+
+DefaultSentences = ("$SDDBT", "$SDDPT", "$SDMTW", "$SDXDR")
+
+class NmeaPublisher():
+    """! NMEA network publisher
+    Re-broadcasts validated sentences received from one echosounder over UDP (unicast or multicast) and to any number
+    of TCP clients. Sentences of one Publish() call share datagrams up to max_datagram bytes. Every TCP client has its
+    own buffer and non-blocking socket, a client whose backlog exceeds max_client_buffer is disconnected, so a slow
+    client never delays the others or the acquisition.
+    """
+    def __init__(self, udp_targets = None, tcp_port = None, tcp_host = "0.0.0.0", sentences = DefaultSentences,
+                 max_datagram = 1400, multicast_ttl = 1, max_client_buffer = 262144):
+        """! Constructor
+        @param udp_targets List of (host, port), multicast groups are allowed, None - no UDP
+        @param tcp_port TCP port to listen on (0 - any free port), None - no TCP
+        @param tcp_host TCP address to listen on
+        @param sentences Tuple of sentence prefixes to publish, None - every valid sentence
+        @param max_datagram Maximum UDP payload in bytes
+        @param multicast_ttl TTL of multicast datagrams
+        @param max_client_buffer Maximum backlog of a TCP client in bytes
+        """
+        self._udp_targets = list(udp_targets) if None != udp_targets else []
+        self._sentences = tuple(sentences) if None != sentences else None
+        self._max_datagram = max_datagram
+        self._max_client_buffer = max_client_buffer
+        self._lock = threading.RLock() # guards client list and buffers
+        self._clients = {}
+        self._thread = None
+        self._running = False
+        self._stats = { "sentences": 0, "rejected": 0, "datagrams": 0, "udp_errors": 0,
+                        "clients": 0, "dropped_clients": 0, "tcp_bytes": 0 }
+
+        self._udp = None
+        if len(self._udp_targets) > 0:
+            self._udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._udp.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, multicast_ttl)
+            self._udp.setblocking(False)
+
+        self._selector = selectors.DefaultSelector()
+        self._wakeup_recv, self._wakeup_send = socket.socketpair()
+        self._wakeup_recv.setblocking(False)
+        self._wakeup_send.setblocking(False)
+        self._selector.register(self._wakeup_recv, selectors.EVENT_READ, None)
+
+        self._server = None
+        if None != tcp_port:
+            self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self._server.bind((tcp_host, tcp_port))
+            self._server.listen(64)
+            self._server.setblocking(False)
+            self._selector.register(self._server, selectors.EVENT_READ, None)
+
+    def GetTcpAddress(self):
+        """! Return (host, port) the TCP server listens on, None - no TCP
+        """
+        return self._server.getsockname() if None != self._server else None
+
+    def __Filter(self, lines):
+        """! Return encoded sentences to publish
+        """
+        out = []
+        for line in lines:
+            line = line.strip()
+            if None != self._sentences and not line.startswith(self._sentences):
+                continue
+            if False == IsValidSentence(line):
+                self._stats["rejected"] += 1
+                continue
+            out.append(bytes(line + "\r\n", 'latin_1'))
+        return out
+
+    def Publish(self, lines):
+        """! Publish sentences
+        @param lines List of received lines (any lines, only valid configured sentences are sent)
+        @result Number of sentences published
+        """
+        sentences = self.__Filter(lines)
+        if 0 == len(sentences):
+            return 0
+        self._stats["sentences"] += len(sentences)
+
+        if None != self._udp:
+            self.__SendDatagrams(sentences)
+
+        if None != self._server:
+            payload = b"".join(sentences)
+            pending = False
+            with self._lock:
+                for client, buffer in list(self._clients.items()):
+                    buffer += payload
+                    if len(buffer) > self._max_client_buffer:
+                        self.__DropClient(client)
+                        self._stats["dropped_clients"] += 1
+                        continue
+                    self.__Flush(client, buffer)
+                    pending = pending or len(buffer) > 0
+            if True == pending:
+                self.__Wakeup()
+
+        return len(sentences)
+
+    def PublishChunk(self, chunk):
+        """! Publish StreamChunk (can be used as StreamBus subscriber callback)
+        """
+        self.Publish(chunk.data.decode("latin_1").splitlines())
+
+    def __SendDatagrams(self, sentences):
+        """! Pack sentences into datagrams and send them to all UDP targets
+        """
+        datagrams = []
+        current = b""
+        for sentence in sentences:
+            if len(current) + len(sentence) > self._max_datagram and len(current) > 0:
+                datagrams.append(current)
+                current = b""
+            current += sentence
+        datagrams.append(current)
+
+        for datagram in datagrams:
+            for target in self._udp_targets:
+                try:
+                    self._udp.sendto(datagram, target)
+                    self._stats["datagrams"] += 1
+                except OSError:
+                    self._stats["udp_errors"] += 1
+
+    def __Flush(self, client, buffer):
+        """! Send as much of client buffer as the socket takes without blocking
+        """
+        try:
+            sent = client.send(buffer)
+            self._stats["tcp_bytes"] += sent
+            del buffer[:sent]
+        except BlockingIOError:
+            pass
+        except OSError:
+            self.__DropClient(client)
+
+    def __DropClient(self, client):
+        """! Disconnect TCP client
+        """
+        with self._lock:
+            if client not in self._clients:
+                return
+            del self._clients[client]
+        try:
+            self._selector.unregister(client)
+        except (KeyError, ValueError):
+            pass
+        client.close()
+
+    def __Wakeup(self):
+        """! Wake up the server thread to wait for writable client sockets
+        """
+        try:
+            self._wakeup_send.send(b"\0")
+        except OSError:
+            pass
+
+    def __Serve(self):
+        """! Server thread: accepts clients and flushes client buffers
+        """
+        while True == self._running:
+            with self._lock:
+                clients = list(self._clients.items())
+            for client, buffer in clients:
+                events = selectors.EVENT_READ | (selectors.EVENT_WRITE if len(buffer) > 0 else 0)
+                try:
+                    self._selector.modify(client, events, buffer)
+                except (KeyError, ValueError):
+                    pass
+
+            for key, events in self._selector.select(0.5):
+                if key.fileobj is self._wakeup_recv:
+                    try:
+                        self._wakeup_recv.recv(4096)
+                    except OSError:
+                        pass
+                elif key.fileobj is self._server:
+                    try:
+                        client, address = self._server.accept()
+                    except OSError:
+                        continue
+                    client.setblocking(False)
+                    client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                    buffer = bytearray()
+                    with self._lock:
+                        self._clients[client] = buffer
+                    self._selector.register(client, selectors.EVENT_READ, buffer)
+                    self._stats["clients"] += 1
+                else:
+                    client = key.fileobj
+                    if events & selectors.EVENT_READ:
+                        try:
+                            data = client.recv(4096) # clients are not expected to talk, EOF means disconnect
+                        except BlockingIOError:
+                            data = None
+                        except OSError:
+                            data = b""
+                        if b"" == data:
+                            self.__DropClient(client)
+                            continue
+                    if events & selectors.EVENT_WRITE:
+                        with self._lock:
+                            self.__Flush(client, key.data)
+
+    def Start(self):
+        """! Start server thread (needed for TCP clients)
+        """
+        if None != self._thread and self._thread.is_alive():
+            return
+        self._running = True
+        self._thread = threading.Thread(target = self.__Serve, name = "nmea-publisher", daemon = True)
+        self._thread.start()
+
+    def Stop(self):
+        """! Stop server thread and close all sockets
+        """
+        self._running = False
+        self.__Wakeup()
+        if None != self._thread:
+            self._thread.join()
+        with self._lock:
+            clients = list(self._clients.keys())
+        for client in clients:
+            self.__DropClient(client)
+        if None != self._server:
+            self._selector.unregister(self._server)
+            self._server.close()
+        if None != self._udp:
+            self._udp.close()
+        self._selector.close()
+        self._wakeup_recv.close()
+        self._wakeup_send.close()
+
+    def GetClientCount(self):
+        """! Return number of connected TCP clients
+        """
+        with self._lock:
+            return len(self._clients)
+
+    def GetStats(self):
+        """! Return counters: sentences, rejected, datagrams, udp_errors, clients (accepted), dropped_clients, tcp_bytes
+        """
+        return dict(self._stats)
@@ -0,0 +1,269 @@
+# Copyright (c) EofE Ultrasonics Co., Ltd., 2024
+import json
+import math
+import os
+
+import numpy
+
+from echonmea import Ping
+
+# Channels of Ping aggregated by default
+PyramidChannels = ("depth", "ema", "pitch", "roll")
+# Per bucket and channel statistics: number of values, min, max, sum (mean = sum / count)
+BucketFields = ("count", "min", "max", "sum")
+PyramidKey = "__pyramid__"
+
+class _Bucket():
+    """! Statistics of one bucket being filled
+    """
+    def __init__(self, number, channels):
+        self.number = number
+        self.count = [0] * channels
+        self.min = [math.inf] * channels
+        self.max = [-math.inf] * channels
+        self.sum = [0.0] * channels
+
+    def AddValues(self, values):
+        """! Add one value per channel, None - missing
+        """
+        for i, value in enumerate(values):
+            if None == value or value != value:
+                continue
+            self.count[i] += 1
+            self.sum[i] += value
+            if value < self.min[i]:
+                self.min[i] = value
+            if value > self.max[i]:
+                self.max[i] = value
+
+    def AddBucket(self, other):
+        """! Add statistics of a finer bucket
+        """
+        for i in range(len(self.count)):
+            self.count[i] += other.count[i]
+            self.sum[i] += other.sum[i]
+            self.min[i] = min(self.min[i], other.min[i])
+            self.max[i] = max(self.max[i], other.max[i])
+
+class PyramidBuilder():
+    """! Incremental builder of a multi-resolution pyramid of ping channels
+    Level 0 buckets are base seconds wide, level k buckets are base * 2^k seconds wide. Every non empty bucket keeps
+    count, min, max and sum of every channel, separately for every frequency. A finished bucket is added to the
+    bucket of the next level, so building costs O(1) amortized per ping and the whole pyramid is about twice the
+    size of level 0. Pings must come in time order per frequency, older pings are counted as out_of_order and skipped.
+    """
+    def __init__(self, base = 1.0, levels = 20, channels = PyramidChannels):
+        """! Constructor
+        @param base Level 0 bucket width in seconds
+        @param levels Number of levels
+        @param channels Ping fields aggregated
+        """
+        self._base = float(base)
+        self._levels = levels
+        self._channels = tuple(channels)
+        self._fields = [Ping._fields.index(channel) for channel in self._channels]
+        self._current = {}  # frequency: [current bucket of every level]
+        self._finished = {} # frequency: [list of finished buckets of every level]
+        self.out_of_order = 0
+
+    def __Close(self, frequency, level, bucket):
+        """! Store finished bucket and add it to the next level
+        """
+        self._finished[frequency][level].append(bucket)
+        if level + 1 >= self._levels:
+            return
+        current = self._current[frequency]
+        parent = current[level + 1]
+        if None != parent and parent.number != bucket.number >> 1:
+            self.__Close(frequency, level + 1, parent)
+            parent = None
+        if None == parent:
+            parent = _Bucket(bucket.number >> 1, len(self._channels))
+            current[level + 1] = parent
+        parent.AddBucket(bucket)
+
+    def Add(self, ping):
+        """! Add ping (pings without time are skipped)
+        @param ping Ping (see echonmea)
+        """
+        if None == ping.time:
+            return
+        frequency = ping.frequency if None != ping.frequency else 0
+        current = self._current.get(frequency)
+        if None == current:
+            current = [None] * self._levels
+            self._current[frequency] = current
+            self._finished[frequency] = [[] for level in range(self._levels)]
+
+        number = math.floor(ping.time / self._base)
+        bucket = current[0]
+        if None != bucket and number != bucket.number:
+            if number < bucket.number:
+                self.out_of_order += 1
+                return
+            self.__Close(frequency, 0, bucket)
+            bucket = None
+        if None == bucket:
+            bucket = _Bucket(number, len(self._channels))
+            current[0] = bucket
+        bucket.AddValues([ping[field] for field in self._fields])
+
+    def AddPings(self, pings):
+        """! Add several pings
+        """
+        for ping in pings:
+            self.Add(ping)
+
+    def Finish(self, settings = None):
+        """! Close all open buckets
+        @param settings Echosounder settings stored with the pyramid (e.g. from the "_meta.csv" sidecar)
+        @result Pyramid
+        """
+        for frequency, current in self._current.items():
+            for level in range(self._levels):
+                if None != current[level]:
+                    bucket = current[level]
+                    current[level] = None
+                    self.__Close(frequency, level, bucket)
+
+        arrays = {}
+        for frequency, levels in self._finished.items():
+            for level, buckets in enumerate(levels):
+                prefix = "f%d.l%d." % (frequency, level)
+                arrays[prefix + "bucket"] = numpy.array([bucket.number for bucket in buckets], numpy.int64)
+                for i, channel in enumerate(self._channels):
+                    arrays[prefix + channel + ".count"] = numpy.array([bucket.count[i] for bucket in buckets], numpy.int64)
+                    for field in ("min", "max", "sum"):
+                        arrays[prefix + channel + "." + field] = numpy.array([getattr(bucket, field)[i] for bucket in buckets], numpy.float64)
+        return Pyramid(arrays, self._base, self._levels, self._channels, settings)
+
+def BuildPyramid(columns, base = 1.0, levels = 20, channels = PyramidChannels, settings = None):
+    """! Vectorized pyramid of archived ping columns (see echoexport.LoadColumns())
+    @param columns Dictionary {name: numpy array}
+    @param base, levels, channels See PyramidBuilder
+    @param settings Echosounder settings stored with the pyramid
+    @result Pyramid
+    """
+    time = numpy.asarray(columns["time"], dtype = numpy.float64)
+    frequency = numpy.asarray(columns["frequency"])
+    arrays = {}
+
+    for value in numpy.unique(frequency[numpy.isfinite(time)]):
+        selected = (frequency == value) & numpy.isfinite(time)
+        number = numpy.floor(time[selected] / base).astype(numpy.int64)
+        order = numpy.argsort(number, kind = "stable")
+        number = number[order]
+        stats = {}
+        for channel in channels:
+            data = numpy.asarray(columns[channel], dtype = numpy.float64)[selected][order]
+            finite = numpy.isfinite(data)
+            stats[channel] = { "count": finite.astype(numpy.int64), "sum": numpy.where(finite, data, 0.0),
+                               "min": numpy.where(finite, data, numpy.inf), "max": numpy.where(finite, data, -numpy.inf) }
+
+        for level in range(levels):
+            if 0 == len(number):
+                starts = numpy.zeros(0, numpy.int64)
+            else:
+                starts = numpy.flatnonzero(numpy.concatenate(([True], number[1:] != number[:-1])))
+            prefix = "f%d.l%d." % (int(value), level)
+            number = number[starts] if len(number) > 0 else number
+            arrays[prefix + "bucket"] = number
+            for channel in channels:
+                fields = stats[channel]
+                if len(starts) > 0:
+                    fields = { "count": numpy.add.reduceat(fields["count"], starts),
+                               "sum": numpy.add.reduceat(fields["sum"], starts),
+                               "min": numpy.minimum.reduceat(fields["min"], starts),
+                               "max": numpy.maximum.reduceat(fields["max"], starts) }
+                stats[channel] = fields
+                for field in BucketFields:
+                    arrays[prefix + channel + "." + field] = fields[field]
+            number = number >> 1
+
+    return Pyramid(arrays, base, levels, channels, settings)
+
+class Pyramid():
+    """! Multi-resolution min/max/mean pyramid of ping channels (see PyramidBuilder, BuildPyramid())
+    Query() serves any time window in O(log n + pixels) from the level with about one bucket per pixel.
+    """
+    def __init__(self, arrays, base, levels, channels, settings = None):
+        """! Constructor
+        @param arrays Dictionary {"f<frequency>.l<level>.<field>": numpy array}
+        @param base Level 0 bucket width in seconds
+        @param levels Number of levels
+        @param channels Channel names
+        @param settings Echosounder settings stored with the pyramid
+        """
+        self._arrays = arrays
+        self._base = base
+        self._levels = levels
+        self._channels = tuple(channels)
+        self._settings = dict(settings) if None != settings else {}
+
+    def GetFrequencies(self):
+        """! Return sorted list of frequencies
+        """
+        return sorted(set(int(key.split(".")[0][1:]) for key in self._arrays.keys()))
+
+    def GetChannels(self):
+        """! Return channel names
+        """
+        return self._channels
+
+    def GetSettings(self):
+        """! Return echosounder settings stored with the pyramid
+        """
+        return dict(self._settings)
+
+    def GetLevel(self, frequency, level, channel):
+        """! Return arrays of one level
+        @result dictionary {"time": bucket start times, "count", "min", "max", "mean"}
+        """
+        prefix = "f%d.l%d." % (frequency, level)
+        count = self._arrays[prefix + channel + ".count"]
+        with numpy.errstate(invalid = "ignore", divide = "ignore"):
+            mean = self._arrays[prefix + channel + ".sum"] / count
+        empty = 0 == count
+        return { "time": self._arrays[prefix + "bucket"] * (self._base * 2 ** level), "count": count,
+                 "min": numpy.where(empty, numpy.nan, self._arrays[prefix + channel + ".min"]),
+                 "max": numpy.where(empty, numpy.nan, self._arrays[prefix + channel + ".max"]),
+                 "mean": numpy.where(empty, numpy.nan, mean) }
+
+    def Query(self, frequency, channel, start, end, pixels = 1000):
+        """! Return min/max/mean series of a time window for display
+        @param frequency Frequency in Hz
+        @param channel Channel name
+        @param start, end Time window (UTC seconds)
+        @param pixels Horizontal resolution, the result has at most about 2 * pixels buckets
+        @result dictionary {"time", "count", "min", "max", "mean"} of the buckets in the window
+        """
+        width = max(end - start, self._base) / max(pixels, 1)
+        level = 0
+        while level + 1 < self._levels and self._base * 2 ** (level + 1) <= width:
+            level += 1
+        prefix = "f%d.l%d." % (frequency, level)
+        scale = self._base * 2 ** level
+        bucket = self._arrays[prefix + "bucket"]
+        first = numpy.searchsorted(bucket, int(numpy.floor(start / scale)), side = "left")
+        last = numpy.searchsorted(bucket, int(numpy.floor(end / scale)), side = "right")
+        series = self.GetLevel(frequency, level, channel)
+        return { name: values[first:last] for name, values in series.items() }
+
+    def Save(self, path):
+        """! Write pyramid into .npz file
+        """
+        header = json.dumps({ "base": self._base, "levels": self._levels, "channels": list(self._channels),
+                              "settings": self._settings })
+        with open(path + ".tmp", "wb") as f:
+            numpy.savez_compressed(f, **{ PyramidKey: numpy.array(header) }, **self._arrays)
+        os.replace(path + ".tmp", path)
+
+    @staticmethod
+    def Load(path):
+        """! Read pyramid written by Save()
+        @result Pyramid
+        """
+        with numpy.load(path) as f:
+            header = json.loads(str(f[PyramidKey]))
+            arrays = { key: f[key] for key in f.files if PyramidKey != key }
+        return Pyramid(arrays, header["base"], header["levels"], header["channels"], header.get("settings"))
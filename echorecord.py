@@ -0,0 +1,204 @@
+# Copyright (c) EofE Ultrasonics Co., Ltd., 2024
+"""! Headless recorder
+
+    python -m echosndr record <port> [--dual] [--profile survey.json] [--output recordings] [--columnar npz] ...
+
+The profile is applied in one batch, the unit is started and supervised (stalls and serial errors are recovered),
+received lines are fanned out by a StreamBus to rotating raw segments and optionally to columnar ping files and the
+network, so a slow sink never stops the serial port from being drained. SIGINT/SIGTERM stop the unit (also during
+reconnect) and flush and close every sink before exit.
+"""
+import argparse
+import os
+import signal
+import sys
+import time
+
+from echobus import StreamBus, PolicyBlock, PolicyDropOldest
+from echocommands import SingleEchosounderCommands, DualEchosounderCommands
+from echolink import LinkMonitor
+from echoprofile import Profile, ProfileError
+from echorotate import RotatingRecorder
+from echosession import SupervisedSession
+
+def _Address(text):
+    """! Parse "host:port"
+    """
+    host, port = text.rsplit(":", 1)
+    return (host, int(port))
+
+class Recorder():
+    """! Recording loop: supervised session -> StreamBus -> raw segments, columnar ping files, network publisher
+    Raw segments are lossless (blocking subscriber with a deep queue), decoding/columnar files and the publisher
+    drop the oldest chunks when they fall behind, their drops are reported in the bus statistics.
+    """
+    def __init__(self, session, recorder, directory, device, columnar = None, publisher = None, stats_interval = 60.0):
+        """! Constructor
+        @param session SupervisedSession of the started echosounder
+        @param recorder RotatingRecorder of the raw stream
+        @param directory Output directory of columnar files
+        @param device Device name used in link statistics
+        @param columnar Columnar format ("npz", "parquet", "hdf5"), None - no columnar files
+        @param publisher NmeaPublisher, None - no network output
+        @param stats_interval Interval in seconds of link statistics updates in the manifest
+        """
+        self._session = session
+        self._recorder = recorder
+        self._directory = directory
+        self._device = device
+        self._columnar = columnar
+        self._publisher = publisher
+        self._stats_interval = stats_interval
+        self._monitor = LinkMonitor()
+        self._sink = None
+        self._sink_segment = None
+        self._last_stats = time.monotonic()
+        self._bus = None
+        self._running = True # Stop() may come before Run(), e.g. from a signal during startup
+
+    def Stop(self, *args):
+        """! Request the recording loop to finish (can be used as signal handler), reconnect in progress is aborted
+        """
+        self._running = False
+        self._session.Abort()
+
+    def __RotateSink(self):
+        """! Open columnar file next to the current raw segment
+        """
+        from echoexport import ColumnarSink
+        segment = self._recorder.GetCurrent()
+        if None == segment or segment == self._sink_segment: # None - raw segment is being rotated right now
+            return
+        if None != self._sink:
+            self._sink.Close()
+        extension = { "npz": ".npz", "parquet": ".parquet", "hdf5": ".h5" }[self._columnar]
+        path = os.path.join(self._directory, os.path.splitext(segment)[0] + extension)
+        self._sink = ColumnarSink(path, self._session.GetEchosounder().GetSettings(), self._columnar)
+        self._sink_segment = segment
+
+    def __Decode(self, chunk):
+        """! Bus subscriber: link statistics and columnar ping files
+        """
+        pings = self._monitor.Feed(self._device, chunk.data.decode("latin_1").splitlines())
+        if None != self._columnar:
+            self.__RotateSink()
+            self._sink.WritePings(pings)
+
+        now = time.monotonic()
+        if now - self._last_stats >= self._stats_interval:
+            self._recorder.SetInfo("link", self._monitor.GetStats())
+            self._recorder.SetInfo("bus", self._bus.GetStats())
+            self._last_stats = now
+
+    def Run(self, maxbytes = 65536, timeout = 0.5):
+        """! Record until Stop() is called or the session gives up
+        @param maxbytes Maximum number of bytes per read
+        @param timeout Read timeout in seconds, the loop notices Stop() within this time
+        @result None, or the serial error which ended the recording
+        """
+        self._bus = StreamBus(self._session, maxbytes, timeout)
+        self._bus.Subscribe("raw", maxsize = 4096, policy = PolicyBlock, callback = self._recorder.WriteChunk)
+        self._bus.Subscribe("decode", maxsize = 1024, policy = PolicyDropOldest, callback = self.__Decode)
+        if None != self._publisher:
+            self._bus.Subscribe("publish", maxsize = 1024, policy = PolicyDropOldest, callback = self._publisher.PublishChunk)
+        self._bus.Start()
+
+        while True == self._running and True == self._bus.IsRunning():
+            time.sleep(timeout)
+
+        self._bus.Stop() # consumers finish their queues
+        return self._bus.GetError()
+
+    def Close(self):
+        """! Stop the echosounder, flush and close all sinks
+        """
+        try:
+            self._session.Stop()
+        except OSError:
+            pass # lost port, sinks are closed anyway
+        ping = self._monitor.GetDecoder(self._device).Flush() # the last ping block has no following marker
+        if None != ping and None != self._sink:
+            self._sink.WritePings([ping])
+        self._recorder.SetInfo("link", self._monitor.GetStats())
+        if None != self._bus:
+            self._recorder.SetInfo("bus", self._bus.GetStats())
+        self._recorder.SetInfo("gaps", [list(gap) for gap in self._session.GetGaps()])
+        if None != self._sink:
+            self._sink.Close()
+        if None != self._publisher:
+            self._publisher.Stop()
+        self._recorder.Close()
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(prog = "python -m echosndr record", description = "Record echosounder data")
+    parser.add_argument("port", help = "serial port (e.g. /dev/ttyUSB0 or COM10)")
+    parser.add_argument("--baud", type = int, default = 115200, help = "baud rate")
+    parser.add_argument("--dual", action = "store_true", help = "dual frequency echosounder")
+    parser.add_argument("--profile", default = None, help = "profile JSON file applied before start")
+    parser.add_argument("--output", default = "recordings", help = "output directory")
+    parser.add_argument("--prefix", default = "sonar", help = "segment file name prefix")
+    parser.add_argument("--rotate-size", type = int, default = 64, help = "segment size in MiB")
+    parser.add_argument("--rotate-time", type = float, default = 3600.0, help = "segment duration in seconds")
+    parser.add_argument("--compression", choices = ["gzip", "xz", "bz2", "zstd", "none"], default = "gzip", help = "closed segment compression")
+    parser.add_argument("--disk-budget", type = float, default = None, help = "maximum size of all segments in GiB")
+    parser.add_argument("--columnar", choices = ["npz", "parquet", "hdf5"], default = None, help = "also write decoded pings")
+    parser.add_argument("--udp", action = "append", default = [], help = "publish sentences to host:port (repeatable)")
+    parser.add_argument("--tcp", type = int, default = None, help = "publish sentences to TCP clients on this port")
+    parser.add_argument("--reconnects", type = int, default = None, help = "reconnect attempts before giving up (default: no limit)")
+    args = parser.parse_args(argv)
+
+    from echosndr import SingleEchosounder, DualEchosounder
+
+    commands = DualEchosounderCommands if True == args.dual else SingleEchosounderCommands
+    try:
+        profile = Profile.Load(args.profile, commands) if None != args.profile else None
+    except ProfileError as e:
+        print("Profile is invalid: %s" % e, file = sys.stderr)
+        return 1
+
+    cls = DualEchosounder if True == args.dual else SingleEchosounder
+    ss = cls(args.port, args.baud, lazy = None != profile)
+    if False == ss.IsDetected() and False == ss.Detect():
+        print("Echosounder is not detected on %s" % args.port, file = sys.stderr)
+        return 1
+
+    if None != profile:
+        failed = [(Command, code) for Command, Value, code in profile.Apply(ss) if 1 != code]
+        if len(failed) > 0:
+            print("Profile not applied: %s" % failed, file = sys.stderr)
+            return 1
+    ss.SetCurrentTime()
+
+    publisher = None
+    if len(args.udp) > 0 or None != args.tcp:
+        from echopublish import NmeaPublisher
+        publisher = NmeaPublisher([_Address(target) for target in args.udp], args.tcp)
+        publisher.Start()
+
+    recorder = RotatingRecorder(args.output, args.prefix, args.rotate_size * 1024 * 1024, args.rotate_time,
+                                None if "none" == args.compression else args.compression,
+                                disk_budget = None if None == args.disk_budget else int(args.disk_budget * 1024 ** 3))
+    recorder.Write(b"") # open the first segment, columnar files are named after it
+    recorder.SetInfo("settings", ss.GetSettings(), every = True)
+
+    session = SupervisedSession(ss, profile, max_attempts = args.reconnects)
+    loop = Recorder(session, recorder, args.output, args.port, args.columnar, publisher)
+    signal.signal(signal.SIGINT, loop.Stop)
+    signal.signal(signal.SIGTERM, loop.Stop)
+
+    if False == session.Start():
+        print("Echosounder did not start", file = sys.stderr)
+        loop.Close()
+        return 1
+
+    try:
+        error = loop.Run()
+    finally:
+        loop.Close()
+    if None != error:
+        print("Recording stopped: %s" % error, file = sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
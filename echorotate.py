@@ -0,0 +1,249 @@
+# Copyright (c) EofE Ultrasonics Co., Ltd., 2024
+import bz2
+import gzip
+import json
+import lzma
+import os
+import queue
+import shutil
+import threading
+import time
+
+def _OpenCompressed(path, compression):
+    """! Open compressed output file
+    @result tuple (file object, final path)
+    """
+    if "gzip" == compression:
+        return gzip.open(path + ".gz", "wb", compresslevel = 6), path + ".gz"
+    if "xz" == compression:
+        return lzma.open(path + ".xz", "wb", preset = 6), path + ".xz"
+    if "bz2" == compression:
+        return bz2.open(path + ".bz2", "wb"), path + ".bz2"
+    if "zstd" == compression:
+        import zstandard
+        return zstandard.ZstdCompressor(level = 10).stream_writer(open(path + ".zst", "wb")), path + ".zst"
+    raise ValueError("Unknown compression: %s" % compression)
+
+class RotatingRecorder():
+    """! Recording file with rotation, background compression and retention
+    Data goes to "<prefix>_<dd-mm-YYYY>_<HHhMMmSS>_<n>.log" segments. A segment is closed when it reaches max_bytes or
+    max_seconds, then a background thread compresses it (gzip, xz, bz2 or zstd) and applies the retention policy
+    (maximum number of segments and/or disk budget, oldest closed segments are removed first), so the acquisition
+    thread only ever writes to an open file. Segments are listed in a JSON manifest with their host UTC time ranges.
+    """
+    def __init__(self, directory, prefix, max_bytes = 64 * 1024 * 1024, max_seconds = 3600.0, compression = "gzip",
+                 max_segments = None, disk_budget = None, manifest = None, on_closed = None):
+        """! Constructor
+        @param directory Output directory
+        @param prefix File name prefix (e.g. "200kHzsonar")
+        @param max_bytes Segment size limit in bytes, None - no limit
+        @param max_seconds Segment duration limit in seconds, None - no limit
+        @param compression "gzip", "xz", "bz2", "zstd" (needs zstandard) or None - keep closed segments as they are
+        @param max_segments Maximum number of segments kept, None - no limit
+        @param disk_budget Maximum total size of segments in bytes, None - no limit
+        @param manifest Manifest path, None - "<prefix>_manifest.json" in directory
+        @param on_closed Function called by the worker with the path of every closed (and compressed) segment,
+            e.g. Catalog.AddFile
+        """
+        self._directory = directory
+        self._prefix = prefix
+        self._max_bytes = max_bytes
+        self._max_seconds = max_seconds
+        self._compression = compression
+        self._max_segments = max_segments
+        self._disk_budget = disk_budget
+        self._manifest = manifest if None != manifest else os.path.join(directory, prefix + "_manifest.json")
+        self._on_closed = on_closed
+        self._lock = threading.Lock()
+        self._tasks = queue.Queue()
+        self._segments = []
+        self._info = {}     # stored in every new segment
+        self._file = None
+        self._segment = None
+        self._opened = 0.0
+        self._index = 0
+
+        os.makedirs(directory, exist_ok = True)
+        if os.path.exists(self._manifest):
+            self.__Recover()
+
+        self._worker = threading.Thread(target = self.__Work, name = "recorder-compress", daemon = True)
+        self._worker.start()
+
+    def __Recover(self):
+        """! Load manifest of a previous run
+            Segments left "open" by a crash are closed with their file size, closed segments which were not
+            compressed yet are queued for the worker, removed segments are dropped from the manifest.
+        """
+        with open(self._manifest, "r", encoding = "utf-8") as f:
+            document = json.load(f)
+        segments = document.get("segments", [])
+        self._index = max(document.get("next_index", 0), len(segments))
+        self._segments = [segment for segment in segments if "removed" != segment.get("state")]
+
+        for segment in self._segments:
+            stale = "open" == segment["state"]
+            if True == stale:
+                path = os.path.join(self._directory, segment["file"])
+                if os.path.exists(path):
+                    segment["bytes"] = os.path.getsize(path)
+                segment["state"] = "closed"
+            if True == stale or ("closed" == segment["state"] and None != self._compression):
+                self._tasks.put(segment)
+        self._tasks.put(None) # manifest update
+
+    def __Open(self, now):
+        """! Open new segment
+        """
+        stamp = time.localtime(now)
+        name = "%s_%s_%s_%04d.log" % (self._prefix, time.strftime("%d-%m-%Y", stamp), time.strftime("%Hh%Mm%S", stamp), self._index)
+        self._index += 1
+        self._file = open(os.path.join(self._directory, name), "wb", buffering = 1024 * 1024)
+        self._segment = { "file": name, "start": now, "end": now, "bytes": 0, "state": "open" }
+        self._opened = time.monotonic()
+        with self._lock:
+            self._segment.update(self._info)
+            self._segments.append(self._segment)
+        self._tasks.put(None) # manifest update
+
+    def Write(self, data):
+        """! Write data, rotate segment if needed
+        @param data bytes
+        """
+        now = time.time()
+        if None == self._file:
+            self.__Open(now)
+        elif (None != self._max_bytes and self._segment["bytes"] >= self._max_bytes) or \
+             (None != self._max_seconds and time.monotonic() - self._opened >= self._max_seconds):
+            self.Rotate()
+            self.__Open(now)
+
+        self._file.write(data)
+        self._segment["bytes"] += len(data)
+        self._segment["end"] = now
+
+    def WriteChunk(self, chunk):
+        """! Write StreamChunk (can be used as StreamBus subscriber callback)
+        """
+        self.Write(chunk.data)
+
+    def Rotate(self):
+        """! Close current segment and hand it over to the background worker
+        """
+        if None == self._file:
+            return
+        self._file.close()
+        self._file = None
+        with self._lock:
+            self._segment["state"] = "closed"
+        self._tasks.put(self._segment)
+        self._segment = None
+
+    def Close(self, wait = True):
+        """! Close current segment and stop the worker
+        @param wait True - wait until all closed segments are compressed
+        """
+        self.Rotate()
+        self._tasks.put(False)
+        if True == wait:
+            self._worker.join()
+
+    def SetInfo(self, key, value, every = False):
+        """! Store information in the manifest entry of the current segment (e.g. LinkMonitor.GetStats())
+        @param key Entry key
+        @param value JSON serializable value
+        @param every True - store it also in every segment opened later (e.g. echosounder settings)
+        """
+        with self._lock:
+            if True == every:
+                self._info[key] = value
+            if None == self._segment:
+                return
+            self._segment[key] = value
+        self._tasks.put(None) # manifest update
+
+    def GetCurrent(self):
+        """! Return file name of the open segment, None - no segment open
+        """
+        return self._segment["file"] if None != self._segment else None
+
+    def GetSegments(self):
+        """! Return copy of the manifest segment list
+        """
+        with self._lock:
+            return [dict(segment) for segment in self._segments]
+
+    def __Compress(self, segment):
+        """! Compress closed segment
+        """
+        path = os.path.join(self._directory, segment["file"])
+        if None == self._compression or not os.path.exists(path):
+            return
+        output, target = _OpenCompressed(path, self._compression)
+        with open(path, "rb") as source, output:
+            shutil.copyfileobj(source, output, 1024 * 1024)
+        os.remove(path)
+        with self._lock:
+            segment["file"] = os.path.basename(target)
+            segment["stored_bytes"] = os.path.getsize(target)
+            segment["state"] = "compressed"
+
+    def __Retain(self):
+        """! Remove oldest closed segments exceeding max_segments or disk_budget
+        """
+        with self._lock:
+            stored = list(self._segments) # removed segments are dropped from the list
+            total = sum(s.get("stored_bytes", s["bytes"]) for s in stored)
+            removable = [s for s in stored if s["state"] != "open"]
+            remove = []
+            while len(removable) > 0 and \
+                  ((None != self._max_segments and len(stored) - len(remove) > self._max_segments) or
+                   (None != self._disk_budget and total > self._disk_budget)):
+                segment = removable.pop(0)
+                remove.append(segment)
+                total -= segment.get("stored_bytes", segment["bytes"])
+            for segment in remove:
+                segment["state"] = "removed"
+                self._segments.remove(segment)
+
+        for segment in remove:
+            try:
+                os.remove(os.path.join(self._directory, segment["file"]))
+            except OSError:
+                pass
+
+    def __WriteManifest(self):
+        """! Write manifest atomically
+        """
+        with self._lock:
+            document = { "prefix": self._prefix, "compression": self._compression, "next_index": self._index,
+                         "segments": self._segments }
+            text = json.dumps(document, indent = 1)
+        with open(self._manifest + ".tmp", "w", encoding = "utf-8") as f:
+            f.write(text)
+        os.replace(self._manifest + ".tmp", self._manifest)
+
+    def __Work(self):
+        """! Background worker: compression, retention and manifest
+        """
+        while True:
+            task = self._tasks.get()
+            if False == task:
+                self.__WriteManifest()
+                return
+            if None != task:
+                try:
+                    self.__Compress(task)
+                except (OSError, ImportError, ValueError) as e:
+                    with self._lock:
+                        task["error"] = str(e)
+                self.__Retain()
+                self.__WriteManifest()
+                if None != self._on_closed and "removed" != task["state"]:
+                    try:
+                        self._on_closed(os.path.join(self._directory, task["file"]))
+                    except Exception as e: # a failing consumer must not stop compression
+                        with self._lock:
+                            task["error"] = "%s: %s" % (type(e).__name__, e)
+            else:
+                self.__WriteManifest()
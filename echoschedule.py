@@ -0,0 +1,198 @@
+# Copyright (c) EofE Ultrasonics Co., Ltd., 2024
+import re
+import time
+
+# Working frequency modes of DualEchosounder and their commands
+ScheduleModes = { "H": "IdSetHighFreq", "L": "IdSetLowFreq", "D": "IdSetDualFreq" }
+
+_Marker = re.compile(rb"#F (\d+) Hz")
+
+def ParsePattern(pattern):
+    """! Parse switching pattern
+    @param pattern String of modes (e.g. "HHHL" - three high frequency pings per low frequency ping, "D" - dual)
+        or list of (mode, pings), e.g. [("H", 3), ("L", 1)]
+    @result list of (mode, pings) runs with consecutive equal modes joined
+    @exception ValueError unknown mode or bad number of pings
+    """
+    if isinstance(pattern, str):
+        pattern = [(mode, 1) for mode in pattern.upper() if not mode.isspace()]
+    runs = []
+    for mode, pings in pattern:
+        if mode not in ScheduleModes:
+            raise ValueError("Unknown mode: %s" % mode)
+        if int(pings) < 1:
+            raise ValueError("Number of pings should be positive: %s" % pings)
+        if len(runs) > 0 and runs[-1][0] == mode:
+            runs[-1] = (mode, runs[-1][1] + int(pings))
+        else:
+            runs.append((mode, int(pings)))
+    if len(runs) > 1 and runs[0][0] == runs[-1][0]: # cycle wraps around: join last run with the first one
+        runs[0] = (runs[0][0], runs[0][1] + runs[-1][1])
+        runs.pop()
+    if 0 == len(runs):
+        raise ValueError("Empty pattern")
+    return runs
+
+def PlanSchedule(runs):
+    """! Find the cheapest command sequence for a pattern
+        One mode - set it once and let the unit run. Single high and low pings alternating - dual mode, the unit
+        interleaves both frequencies itself. Otherwise every run boundary needs one Stop/mode command/Start cycle.
+    @param runs List of (mode, pings) (see ParsePattern())
+    @result list of (mode, pings), pings None - free running, no switching
+    """
+    modes = set(mode for mode, pings in runs)
+    if 1 == len(runs):
+        return [(runs[0][0], None)]
+    if modes == set(("H", "L")) and all(1 == pings for mode, pings in runs):
+        return [("D", None)]
+    return list(runs)
+
+class FrequencyScheduler():
+    """! Working frequency scheduler of DualEchosounder
+    Runs a high/low/dual pattern with the cheapest command sequence (see PlanSchedule()): the mode is switched only
+    at run boundaries. The running unit is stopped by '\r' and the command prompt without detecting it again
+    (Echosounder.Stop(redetect = False)), then the mode command and "#go" follow; Detect() is used only as fallback.
+    Ping markers ("#F <frequency> Hz") are counted per frequency to report the achieved ping rates against the
+    rates requested by "IdInterval", and the time spent switching.
+    """
+    def __init__(self, echosounder, pattern, interval = None):
+        """! Constructor
+        @param echosounder DualEchosounder instance
+        @param pattern Pattern (see ParsePattern())
+        @param interval Ping interval in seconds set before start, None - current "IdInterval"
+        """
+        self._echosounder = echosounder
+        self._runs = ParsePattern(pattern)
+        self._plan = PlanSchedule(self._runs)
+        self._interval = interval
+        self._mode = None
+        self.__Reset()
+
+    def __Reset(self):
+        """! Clear counters
+        """
+        self._pings = {}
+        self._switches = 0
+        self._switch_time = 0.0
+        self._elapsed = 0.0
+
+    def GetPlan(self):
+        """! Return planned command sequence: list of (mode, pings), pings None - free running
+        """
+        return list(self._plan)
+
+    def __Count(self, data):
+        """! Count ping markers per frequency
+        @result number of markers
+        """
+        count = 0
+        for match in _Marker.finditer(data):
+            frequency = int(match.group(1))
+            self._pings[frequency] = self._pings.get(frequency, 0) + 1
+            count += 1
+        return count
+
+    def __Switch(self, mode):
+        """! Switch working frequency mode, running unit is stopped without detection and started again
+        @result True - mode switched
+        """
+        if mode == self._mode:
+            return True
+        ss = self._echosounder
+        start = time.monotonic()
+        wasrunning = True == ss.IsRunning()
+        result = False
+        if False == wasrunning or True == ss.Stop(redetect = False):
+            result = 1 == ss.SendCommand(ScheduleModes[mode])
+            if True == wasrunning:
+                result = True == ss.Start() and True == result
+        self._switch_time += time.monotonic() - start
+        self._switches += 1
+        if True == result:
+            self._mode = mode
+        return result
+
+    def Run(self, duration = None, cycles = None, callback = None, maxbytes = 4096, timeout = 1.0):
+        """! Run the pattern
+        @param duration Run time in seconds, None - no limit
+        @param cycles Number of pattern cycles (ignored for free running plans), None - no limit
+        @param callback Function called with every received data chunk (bytes), None - data is discarded
+        @param maxbytes, timeout See Echosounder.ReadAvailable()
+        @result report (see GetReport())
+        @exception ValueError neither duration nor cycles given for a switching plan, or none for a free running plan
+        """
+        if None == duration and (None == cycles or None == self._plan[0][1]):
+            raise ValueError("Run needs a duration (or cycles for a switching pattern)")
+
+        ss = self._echosounder
+        self.__Reset()
+        if None != self._interval:
+            ss.SetValue("IdInterval", str(self._interval))
+        self._mode = None
+
+        start = time.monotonic()
+        deadline = None if None == duration else start + duration
+        cycle = 0
+
+        def receive():
+            data = ss.ReadAvailable(maxbytes, timeout if None == deadline else max(0.0, min(timeout, deadline - time.monotonic())))
+            if len(data) > 0 and None != callback:
+                callback(data)
+            return self.__Count(data)
+
+        if False == self.__Switch(self._plan[0][0]) or False == ss.Start():
+            self._elapsed = time.monotonic() - start
+            return self.GetReport()
+
+        while None == deadline or time.monotonic() < deadline:
+            if None != cycles and None != self._plan[0][1] and cycle >= cycles:
+                break
+            for mode, pings in self._plan:
+                if False == self.__Switch(mode):
+                    break
+                received = 0
+                while (None == pings or received < pings) and (None == deadline or time.monotonic() < deadline):
+                    received += receive()
+                if None != deadline and time.monotonic() >= deadline:
+                    break
+            cycle += 1
+
+        self._elapsed = time.monotonic() - start
+        ss.Stop(redetect = False)
+        return self.GetReport()
+
+    def GetReport(self):
+        """! Return achieved ping rates and switching loss of the last Run()
+        @result dictionary: plan, elapsed (seconds), interval (requested "IdInterval"), switches, switch_time
+            (seconds spent in mode commands), switch_loss (switch_time / elapsed) and per_frequency
+            {frequency: {pings, rate (pings per second), requested_rate, achieved (rate / requested_rate)}}
+        """
+        interval = self._interval
+        if None == interval:
+            try:
+                interval = float(self._echosounder.GetSettings().get("IdInterval"))
+            except (TypeError, ValueError):
+                interval = None
+
+        # share of the pings of every mode in one pattern cycle
+        total = sum(pings for mode, pings in self._plan if None != pings)
+        shares = {}
+        for mode, pings in self._plan:
+            share = 1.0 if None == pings else float(pings) / total
+            for part in (("H", "L") if "D" == mode else (mode,)):
+                shares[part] = shares.get(part, 0.0) + share
+
+        elapsed = self._elapsed
+        frequencies = sorted(self._pings.keys(), reverse = True)
+        per_frequency = {}
+        for frequency in frequencies:
+            rate = self._pings[frequency] / elapsed if elapsed > 0 else 0.0
+            # the higher of two frequencies is the high frequency
+            part = "H" if frequency == frequencies[0] and (len(frequencies) > 1 or "L" not in shares) else "L"
+            requested = shares.get(part, 0.0) / interval if None != interval and interval > 0 else None
+            per_frequency[frequency] = { "pings": self._pings[frequency], "rate": rate, "requested_rate": requested,
+                                         "achieved": rate / requested if None != requested and requested > 0 else None }
+
+        return { "plan": list(self._plan), "elapsed": elapsed, "interval": interval, "switches": self._switches,
+                 "switch_time": self._switch_time, "switch_loss": self._switch_time / elapsed if elapsed > 0 else 0.0,
+                 "per_frequency": per_frequency }
@@ -0,0 +1,377 @@
+# Copyright (c) EofE Ultrasonics Co., Ltd., 2024
+import json
+import os
+import socket
+import threading
+
+# Echosounder methods available over the control connection
+ControlMethods = ("SendCommand", "SetValue", "SetValues", "GetValue", "GetSettings", "QueryValue", "QueryValues",
+                  "Start", "Stop", "SetCurrentTime", "IsRunning", "IsDetected", "GetState")
+
+# Requests which can be merged into a single SetValues() call (one Stop/Start cycle)
+CoalescedMethods = ("SetValue", "SetValues")
+
+class ControlError(RuntimeError):
+    """! Control request failed on the server side
+    """
+
+def _CreateSocket(address):
+    """! Create socket for address: path string - Unix socket, (host, port) - TCP socket
+    @exception ValueError Unix socket path given on a platform without Unix sockets (Windows)
+    """
+    if isinstance(address, str):
+        if None == getattr(socket, "AF_UNIX", None):
+            raise ValueError("Unix sockets are not supported on this platform, use (host, port): %s" % address)
+        return socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    return socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+
+class _Request():
+    """! Pending control request
+    """
+    def __init__(self, method, params):
+        self.method = method
+        self.params = params
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+class ControlServer():
+    """! Local control server owning one echosounder
+    Several processes (logger, operator tool) send requests over a Unix or TCP socket using newline delimited JSON:
+    {"id": n, "method": "SetValue", "params": ["IdGainH", "3"]} -> {"id": n, "result": true} or {"id": n, "error": "..."}.
+    All requests are executed by one worker thread. Pending SetValue/SetValues requests are merged into one
+    SetValues() call, so a running echosounder is stopped and started once for all of them.
+    The data stream has to be read through ReadAvailable() of the server (e.g. StreamBus(server)), so reading and
+    commands never use the serial port at the same time.
+    """
+    def __init__(self, echosounder, address, slice_timeout = 0.05, request_timeout = 20.0):
+        """! Constructor
+        @param echosounder Echosounder instance
+        @param address Unix socket path or (host, port) for TCP
+        @param slice_timeout Longest time in seconds the data reader holds the port while a request is waiting
+        @param request_timeout Time in seconds a request waits for its result, shorter than the ControlClient timeout
+            so the client receives an error response instead of a socket timeout
+        """
+        self._echosounder = echosounder
+        self._address = address
+        self._slice_timeout = slice_timeout
+        self._request_timeout = request_timeout
+        self._port_lock = threading.Lock()
+        self._condition = threading.Condition()
+        self._pending = []
+        self._running = False
+        self._threads = []
+        self._connections = []
+        self._requests = 0
+        self._batches = 0
+        self._server = None
+
+    def GetAddress(self):
+        """! Return address the server listens on
+        """
+        return self._server.getsockname() if None != self._server else self._address
+
+    def Start(self):
+        """! Start listening and the worker thread
+        @exception ValueError Unix socket path on a platform without Unix sockets
+        """
+        self._server = _CreateSocket(self._address)
+        if isinstance(self._address, str):
+            if os.path.exists(self._address):
+                os.unlink(self._address)
+        else:
+            self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind(self._address)
+        self._server.listen(16)
+        self._running = True
+
+        for target, name in ((self.__Accept, "control-accept"), (self.__Work, "control-worker")):
+            thread = threading.Thread(target = target, name = name, daemon = True)
+            self._threads.append(thread)
+            thread.start()
+
+    def Stop(self):
+        """! Stop server, pending requests fail
+        """
+        with self._condition:
+            self._running = False
+            self.__Fail(self._pending, "Server stopped")
+            self._pending = []
+            self._condition.notify_all()
+        try:
+            self._server.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._server.close()
+        for connection in list(self._connections):
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        for thread in self._threads:
+            thread.join(1.0)
+        if isinstance(self._address, str) and os.path.exists(self._address):
+            os.unlink(self._address)
+
+    def ReadAvailable(self, maxbytes = 4096, timeout = 1.0):
+        """! Read complete lines from echosounder (see Echosounder.ReadAvailable()) between control requests
+            The port is released every slice_timeout seconds so requests wait at most that long
+        """
+        remaining = timeout
+        while True:
+            step = min(remaining, self._slice_timeout)
+            with self._port_lock:
+                data = self._echosounder.ReadAvailable(maxbytes, step)
+            remaining -= step
+            if len(data) > 0 or remaining <= 0 or False == self._running:
+                return data
+
+    def Call(self, method, *params):
+        """! Execute request in the worker thread (for callers in the server process)
+        @result method result
+        @exception ControlError request failed, server stopped or no result within request_timeout
+        """
+        if method not in ControlMethods:
+            raise ControlError("Unknown method: %s" % method)
+        request = _Request(method, list(params))
+        with self._condition:
+            if False == self._running:
+                raise ControlError("Server stopped")
+            self._pending.append(request)
+            self._condition.notify_all()
+        if False == request.done.wait(self._request_timeout):
+            with self._condition:
+                if request in self._pending: # not started yet, it is not executed later
+                    self._pending.remove(request)
+            raise ControlError("%s: no result within %s seconds" % (method, self._request_timeout))
+        if None != request.error:
+            raise ControlError(request.error)
+        return request.result
+
+    def GetStats(self):
+        """! Return counters: requests (executed), batches (worker wake ups), clients (connected)
+        """
+        return { "requests": self._requests, "batches": self._batches, "clients": len(self._connections) }
+
+    def __Accept(self):
+        """! Accept thread
+        """
+        while True == self._running:
+            try:
+                connection, address = self._server.accept()
+            except OSError:
+                return
+            if connection.family in (socket.AF_INET, socket.AF_INET6):
+                connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._connections.append(connection)
+            thread = threading.Thread(target = self.__Serve, args = (connection,), name = "control-client", daemon = True)
+            thread.start()
+
+    def __Serve(self, connection):
+        """! Client connection thread: one request line in, one response line out
+        """
+        stream = connection.makefile("rb")
+        try:
+            for line in stream:
+                identifier = None
+                try:
+                    message = json.loads(line)
+                    identifier = message.get("id")
+                    result = self.Call(message["method"], *message.get("params", []))
+                    response = { "id": identifier, "result": result }
+                except (ControlError, ValueError, KeyError, TypeError) as e:
+                    response = { "id": identifier, "error": str(e) }
+                connection.sendall(bytes(json.dumps(response) + "\n", "utf-8"))
+        except OSError:
+            pass
+        finally:
+            stream.close()
+            connection.close()
+            if connection in self._connections:
+                self._connections.remove(connection)
+
+    def __Work(self):
+        """! Worker thread: executes pending requests in order, consecutive set requests are merged
+        """
+        while True:
+            with self._condition:
+                while 0 == len(self._pending) and True == self._running:
+                    self._condition.wait()
+                batch = self._pending
+                self._pending = []
+
+            if False == self._running:
+                self.__Fail(batch, "Server stopped")
+                return
+
+            self._batches += 1
+            with self._port_lock:
+                i = 0
+                while i < len(batch):
+                    j = i
+                    while j < len(batch) and batch[j].method in CoalescedMethods:
+                        j += 1
+                    if j - i > 1:
+                        self.__SetValuesMerged(batch[i:j])
+                        i = j
+                    else:
+                        self.__Execute(batch[i])
+                        i += 1
+            self._requests += len(batch)
+
+    def __Fail(self, requests, error):
+        """! Complete requests with error
+        """
+        for request in requests:
+            request.error = error
+            request.done.set()
+
+    def __Execute(self, request):
+        """! Execute single request
+        """
+        try:
+            request.result = getattr(self._echosounder, request.method)(*request.params)
+        except Exception as e: # any failure is reported to the client, the server keeps running
+            request.error = "%s: %s" % (type(e).__name__, e)
+        request.done.set()
+
+    def __SetValuesMerged(self, requests):
+        """! Execute several SetValue/SetValues requests with a single SetValues() call
+        """
+        values = []
+        counts = []
+        for request in requests:
+            try:
+                if "SetValue" == request.method:
+                    items = [(request.params[0], request.params[1])]
+                else:
+                    items = request.params[0]
+                    items = list(items.items()) if isinstance(items, dict) else [tuple(item) for item in items]
+            except (IndexError, TypeError, ValueError, AttributeError) as e:
+                request.error = "%s: %s" % (type(e).__name__, e)
+                items = []
+            values.extend(items)
+            counts.append(len(items))
+
+        try:
+            codes = self._echosounder.SetValues(values)
+        except Exception as e:
+            codes = None
+            error = "%s: %s" % (type(e).__name__, e)
+
+        first = 0
+        for request, count in zip(requests, counts):
+            if None == request.error:
+                if None == codes:
+                    request.error = error
+                elif "SetValue" == request.method:
+                    request.result = 1 == codes[first]
+                else:
+                    request.result = codes[first:first + count]
+            first += count
+            request.done.set()
+
+class ControlClient():
+    """! Client of ControlServer with the same method names as Echosounder
+    """
+    def __init__(self, address, timeout = 30.0):
+        """! Constructor
+        @param address Unix socket path or (host, port) of the server
+        @param timeout Request timeout in seconds (a request on a running unit includes Stop/Start)
+        @exception ValueError Unix socket path on a platform without Unix sockets
+        """
+        self._socket = _CreateSocket(address)
+        self._socket.settimeout(timeout)
+        self._socket.connect(address)
+        if self._socket.family in (socket.AF_INET, socket.AF_INET6):
+            self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._stream = self._socket.makefile("rb")
+        self._id = 0
+        self._lock = threading.Lock()
+
+    def Close(self):
+        """! Close connection
+        """
+        self._stream.close()
+        self._socket.close()
+
+    def Call(self, method, *params):
+        """! Call echosounder method on the server
+        @result method result
+        @exception ControlError request failed on the server
+        """
+        with self._lock:
+            self._id += 1
+            self._socket.sendall(bytes(json.dumps({ "id": self._id, "method": method, "params": params }) + "\n", "utf-8"))
+            line = self._stream.readline()
+        if 0 == len(line):
+            raise ControlError("Connection closed")
+        response = json.loads(line)
+        if "error" in response:
+            raise ControlError(response["error"])
+        return response["result"]
+
+    def SendCommand(self, Command):
+        """! See Echosounder.SendCommand()
+        """
+        return self.Call("SendCommand", Command)
+
+    def SetValue(self, Command, Value):
+        """! See Echosounder.SetValue()
+        """
+        return self.Call("SetValue", Command, Value)
+
+    def SetValues(self, values):
+        """! See Echosounder.SetValues()
+        """
+        return self.Call("SetValues", list(values.items()) if isinstance(values, dict) else list(values))
+
+    def GetValue(self, Command):
+        """! See Echosounder.GetValue()
+        """
+        return self.Call("GetValue", Command)
+
+    def GetSettings(self):
+        """! See Echosounder.GetSettings()
+        """
+        return self.Call("GetSettings")
+
+    def QueryValue(self, Command):
+        """! See Echosounder.QueryValue()
+        """
+        return self.Call("QueryValue", Command)
+
+    def QueryValues(self, Commands):
+        """! See Echosounder.QueryValues()
+        """
+        return self.Call("QueryValues", list(Commands))
+
+    def Start(self):
+        """! See Echosounder.Start()
+        """
+        return self.Call("Start")
+
+    def Stop(self):
+        """! See Echosounder.Stop()
+        """
+        return self.Call("Stop")
+
+    def SetCurrentTime(self):
+        """! See Echosounder.SetCurrentTime()
+        """
+        return self.Call("SetCurrentTime")
+
+    def IsRunning(self):
+        """! See Echosounder.IsRunning()
+        """
+        return self.Call("IsRunning")
+
+    def IsDetected(self):
+        """! See Echosounder.IsDetected()
+        """
+        return self.Call("IsDetected")
+
+    def GetState(self):
+        """! See Echosounder.GetState()
+        """
+        return self.Call("GetState")
@@ -0,0 +1,179 @@
+# Copyright (c) EofE Ultrasonics Co., Ltd., 2024
+import collections
+import threading
+import time
+
+Gap = collections.namedtuple("Gap", "start end cause")
+Gap.__doc__ = """! Interruption of the data stream: start/end host UTC time in seconds and the cause"""
+
+class SupervisedSession():
+    """! Supervised acquisition session
+    Wraps a running echosounder, watches the data stream and recovers it without manual restart:
+    a stalled stream (no "#F" marker within stall_factor * "IdInterval") or a serial error reopens the port,
+    detects the echosounder again, applies the cached configuration and starts it again.
+    Every interruption is recorded as Gap(start, end, cause). Recovery ends after max_attempts or when Abort() is called.
+    """
+    def __init__(self, echosounder, profile = None, commands = None, stall_factor = 5.0, min_stall = 2.0, retry_interval = 1.0,
+                 max_attempts = None):
+        """! Constructor
+        @param echosounder Echosounder instance (already configured)
+        @param profile Profile applied after reconnect, None - cached settings of the echosounder are applied
+        @param commands Mode commands run after reconnect (e.g. ["IdSetDualFreq"]), profile commands are used if None
+        @param stall_factor Stream is stalled when no ping marker received during stall_factor ping intervals
+        @param min_stall Minimum stall timeout in seconds
+        @param retry_interval Pause in seconds between reconnect attempts
+        @param max_attempts Reconnect attempts of one recovery, None - until recovered or aborted
+        """
+        self._echosounder = echosounder
+        self._profile = profile
+        self._commands = list(commands) if None != commands else []
+        self._stall_factor = stall_factor
+        self._min_stall = min_stall
+        self._retry_interval = retry_interval
+        self._max_attempts = max_attempts
+        self._abort = threading.Event()
+        self._gaps = []
+        self._reconnects = 0
+        self._stall_timeout = min_stall
+        self._last_marker = time.monotonic()
+        self._last_marker_utc = time.time()
+
+    def __UpdateStallTimeout(self):
+        """! Calculate stall timeout from the current ping interval
+        """
+        try:
+            interval = float(self._echosounder.GetSettings().get("IdInterval", 1.0))
+        except ValueError:
+            interval = 1.0
+        self._stall_timeout = max(self._min_stall, self._stall_factor * interval)
+
+    def __ApplyConfiguration(self):
+        """! Apply configuration to the just detected echosounder
+        """
+        ss = self._echosounder
+
+        if None != self._profile:
+            for Command in self._profile.GetCommands():
+                ss.SendCommand(Command)
+            ss.SetValues(self._profile.Plan(None, ss.GetCommands()))
+        else:
+            for Command in self._commands:
+                ss.SendCommand(Command)
+            settable = set(command[0] for command in ss.GetCommands() if len(command[2]) > 0)
+            settable.discard("IdTime")
+            ss.SetValues([(Command, Value) for Command, Value in ss.GetSettings().items() if Command in settable])
+
+        ss.SetCurrentTime() # unit time is cleared upon reset
+
+    def __Recover(self, cause):
+        """! Reconnect until echosounder is running again and record the gap
+        @param cause Reason of recovery
+        @result True - echosounder is running again, False - recovery aborted or max_attempts reached
+        """
+        start = self._last_marker_utc
+        recovered = False
+        attempts = 0
+
+        while False == self._abort.is_set() and (None == self._max_attempts or attempts < self._max_attempts):
+            self._reconnects += 1
+            attempts += 1
+            try:
+                if True == self._echosounder.Reopen():
+                    self.__ApplyConfiguration()
+                    if True == self._echosounder.Start():
+                        recovered = True
+                        break
+            except OSError:
+                pass
+            self._abort.wait(self._retry_interval)
+
+        if False == recovered:
+            cause += ", aborted" if True == self._abort.is_set() else ", not recovered after %d attempts" % attempts
+        self._gaps.append(Gap(start, time.time(), cause))
+        self.__UpdateStallTimeout()
+        self._last_marker = time.monotonic()
+        self._last_marker_utc = time.time()
+        return recovered
+
+    def Start(self):
+        """! Start echosounder and the watchdog
+        @result True - echosounder started, False - echosounder not started
+        """
+        self._abort.clear()
+        self.__UpdateStallTimeout()
+        self._last_marker = time.monotonic()
+        self._last_marker_utc = time.time()
+        return self._echosounder.Start()
+
+    def Abort(self):
+        """! End recovery in progress and do not recover any more (can be called from another thread or signal handler)
+            ReadAvailable() still reads, but returns b"" instead of reconnecting
+        """
+        self._abort.set()
+
+    def Stop(self):
+        """! Stop echosounder, a lost echosounder (not detected, or stalled when recovery was aborted) is not detected again
+        @result True - echosounder stopped, False - echosounder not detected
+        """
+        stalled = time.monotonic() - self._last_marker > self._stall_timeout
+        if False == self._echosounder.IsDetected() or (True == self._abort.is_set() and True == stalled):
+            return False
+        return self._echosounder.Stop()
+
+    def ReadAvailable(self, maxbytes = 4096, timeout = 1.0):
+        """! Return complete lines received from echosounder (see Echosounder.ReadAvailable())
+            Serial errors and stalled stream are recovered here, so the call can block during recovery
+        @param maxbytes - maximum number of bytes to return
+        @param timeout - timeout in seconds
+        @result bytes containing whole lines, b"" - nothing received
+        @exception OSError echosounder not recovered after max_attempts
+        """
+        try:
+            data = self._echosounder.ReadAvailable(maxbytes, timeout)
+        except OSError as e:
+            if True == self._abort.is_set():
+                return b""
+            self.__Check(self.__Recover("serial error: %s" % e))
+            return b""
+
+        now = time.monotonic()
+        if b"#F" in data:
+            self._last_marker = now
+            self._last_marker_utc = time.time()
+        elif now - self._last_marker > self._stall_timeout and False == self._abort.is_set():
+            self.__Check(self.__Recover("stall: no ping for %.1f s" % (now - self._last_marker)))
+
+        return data
+
+    def __Check(self, recovered):
+        """! Raise OSError when recovery gave up (not when it was aborted)
+        """
+        if False == recovered and False == self._abort.is_set():
+            raise OSError("Echosounder not recovered: %s" % self._gaps[-1].cause)
+
+    def ReadSentences(self, maxbytes = 4096, timeout = 1.0):
+        """! Return complete sentences received from echosounder (see ReadAvailable())
+        @result list of sentences without line endings
+        """
+        data = self.ReadAvailable(maxbytes, timeout)
+        return [line for line in data.decode("latin_1").splitlines() if len(line) > 0]
+
+    def GetGaps(self):
+        """! Return list of Gap(start, end, cause) recorded so far
+        """
+        return list(self._gaps)
+
+    def GetLostTime(self):
+        """! Return total time in seconds without data because of gaps
+        """
+        return sum(gap.end - gap.start for gap in self._gaps)
+
+    def GetReconnects(self):
+        """! Return number of reconnect attempts
+        """
+        return self._reconnects
+
+    def GetEchosounder(self):
+        """! Return supervised echosounder
+        """
+        return self._echosounder
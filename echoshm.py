@@ -0,0 +1,182 @@
+# Copyright (c) EofE Ultrasonics Co., Ltd., 2024
+import struct
+import time
+from multiprocessing import shared_memory
+
+# Ring header: magic, version, slot payload size, number of slots, next sequence number to write
+RingHeader = struct.Struct("<IIIIQ")
+# Slot header: sequence number (0 - empty, WritingSeq - being written), host time.monotonic(), payload length
+SlotHeader = struct.Struct("<QdI4x")
+RingMagic = 0x45434852 # "RHCE"
+RingVersion = 1
+RingHeaderSize = 64
+WritingSeq = 0xFFFFFFFFFFFFFFFF
+
+def _Attach(name):
+    """! Attach to existing shared memory without letting this process' resource tracker remove it on exit
+    """
+    try:
+        return shared_memory.SharedMemory(name = name, track = False)
+    except TypeError: # Python < 3.13 has no "track" argument, skip registration while attaching
+        from multiprocessing import resource_tracker
+        register = resource_tracker.register
+        resource_tracker.register = lambda name, rtype: None
+        try:
+            return shared_memory.SharedMemory(name = name)
+        finally:
+            resource_tracker.register = register
+
+class SharedRingWriter():
+    """! Writer side of the cross-process acquisition ring
+    The reader process keeps the serial port drained and writes every chunk of received lines into a fixed slot ring
+    in shared memory, slot = sequence number % slots. Processes attached by SharedRingReader read it without pickling.
+    Writer never waits for readers: a reader which is too slow detects the overwritten slots by their sequence numbers.
+    """
+    def __init__(self, name = None, slots = 1024, slot_size = 4096):
+        """! Constructor
+        @param name Shared memory name, None - generated (see GetName())
+        @param slots Number of slots
+        @param slot_size Maximum payload of one slot in bytes, larger chunks occupy several slots
+        """
+        self._slots = slots
+        self._slot_size = slot_size
+        self._stride = SlotHeader.size + slot_size
+        self._shm = shared_memory.SharedMemory(name = name, create = True, size = RingHeaderSize + slots * self._stride)
+        self._buffer = self._shm.buf
+        self._buffer[:RingHeaderSize + slots * self._stride] = bytes(RingHeaderSize + slots * self._stride)
+        self._seq = 1
+        RingHeader.pack_into(self._buffer, 0, RingMagic, RingVersion, slot_size, slots, self._seq)
+
+    def GetName(self):
+        """! Return shared memory name to pass to SharedRingReader
+        """
+        return self._shm.name
+
+    def Write(self, data, timestamp = None):
+        """! Write data, split into slots at line ends where possible
+        @param data bytes
+        @param timestamp Host time.monotonic() of arrival, None - now
+        @result Sequence number of the last slot written
+        """
+        if None == timestamp:
+            timestamp = time.monotonic()
+
+        view = memoryview(data)
+        while True:
+            size = len(view)
+            if size > self._slot_size:
+                end = bytes(view[:self._slot_size]).rfind(b'\n')
+                size = end + 1 if end >= 0 else self._slot_size
+
+            offset = RingHeaderSize + (self._seq % self._slots) * self._stride
+            SlotHeader.pack_into(self._buffer, offset, WritingSeq, timestamp, size)
+            self._buffer[offset + SlotHeader.size:offset + SlotHeader.size + size] = view[:size]
+            SlotHeader.pack_into(self._buffer, offset, self._seq, timestamp, size)
+
+            self._seq += 1
+            RingHeader.pack_into(self._buffer, 0, RingMagic, RingVersion, self._slot_size, self._slots, self._seq)
+
+            view = view[size:]
+            if 0 == len(view):
+                return self._seq - 1
+
+    def WriteChunk(self, chunk):
+        """! Write StreamChunk (can be used as StreamBus subscriber callback)
+        """
+        self.Write(chunk.data, chunk.time)
+
+    def Close(self, unlink = True):
+        """! Close shared memory
+        @param unlink True - remove shared memory (readers keep their mapping until they close)
+        """
+        self._buffer.release()
+        self._shm.close()
+        if True == unlink:
+            self._shm.unlink()
+
+class SharedRingReader():
+    """! Reader side of the cross-process acquisition ring, see SharedRingWriter
+    """
+    def __init__(self, name, from_start = False):
+        """! Constructor
+        @param name Shared memory name (SharedRingWriter.GetName())
+        @param from_start True - read the oldest slot still in the ring, False - only new slots
+        """
+        self._shm = _Attach(name)
+        self._buffer = self._shm.buf
+        magic, version, self._slot_size, self._slots, head = RingHeader.unpack_from(self._buffer, 0)
+        if RingMagic != magic or RingVersion != version:
+            self._shm.close()
+            raise ValueError("%s is not an acquisition ring" % name)
+        self._stride = SlotHeader.size + self._slot_size
+        self._next = max(1, head - self._slots + 1) if True == from_start else head
+        self._lost = 0
+
+    def __Head(self):
+        """! Next sequence number the writer will write
+        """
+        return RingHeader.unpack_from(self._buffer, 0)[4]
+
+    def ReadView(self, timeout = None):
+        """! Return next slot without copying
+            The view stays valid only until the writer wraps around, check it by IsValid(seq) after use
+        @param timeout Timeout in seconds, None - wait forever, 0 - do not wait
+        @result tuple (seq, time, memoryview), None - timeout
+        """
+        deadline = None if None == timeout else time.monotonic() + timeout
+        pause = 0.0005
+
+        while True:
+            head = self.__Head()
+            if self._next < head:
+                if head - self._next > self._slots - 1: # writer lapped the reader
+                    self._lost += head - self._slots + 1 - self._next
+                    self._next = head - self._slots + 1
+
+                offset = RingHeaderSize + (self._next % self._slots) * self._stride
+                seq, timestamp, size = SlotHeader.unpack_from(self._buffer, offset)
+                if seq == self._next:
+                    self._next += 1
+                    return (seq, timestamp, self._buffer[offset + SlotHeader.size:offset + SlotHeader.size + size])
+                if seq != WritingSeq and seq > self._next: # overwritten while we were looking
+                    self._lost += 1
+                    self._next += 1
+                continue
+
+            if None != deadline and time.monotonic() >= deadline:
+                return None
+            time.sleep(pause)
+            pause = min(pause * 2, 0.01)
+
+    def IsValid(self, seq):
+        """! Return True if the slot with sequence number seq was not overwritten yet
+        """
+        offset = RingHeaderSize + (seq % self._slots) * self._stride
+        return SlotHeader.unpack_from(self._buffer, offset)[0] == seq
+
+    def Read(self, timeout = None):
+        """! Return copy of the next slot
+        @param timeout Timeout in seconds, None - wait forever, 0 - do not wait
+        @result tuple (seq, time, bytes), None - timeout
+        """
+        while True:
+            slot = self.ReadView(timeout)
+            if None == slot:
+                return None
+            seq, timestamp, view = slot
+            data = bytes(view)
+            view.release()
+            if True == self.IsValid(seq):
+                return (seq, timestamp, data)
+            self._lost += 1
+
+    def GetLost(self):
+        """! Return number of slots overwritten before they were read
+        """
+        return self._lost
+
+    def Close(self):
+        """! Detach from shared memory
+        """
+        self._buffer.release()
+        self._shm.close()
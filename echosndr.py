@@ -1,132 +1,36 @@
 # Copyright (c) EofE Ultrasonics Co., Ltd., 2024
-import serial
 import time
 import re
 
-SingleEchosounderCommands = [ 
-    ( "IdInfo",            "#info",       "",      ""),
-    ( "IdRange",           "#range",      "50000", " - #range[ ]{0,}\\[[ ]{0,}([0-9]{1,}) mm[ ]{0,}\\].*"),
-    ( "IdInterval",        "#interval",   "0.1",   " - #interval[ ]{0,}\\[[ ]{0,}(([0-9]*[.])?[0-9]+) sec[ ]{0,}\\].*") ,
-    ( "IdTxLength",        "#txlength",   "50",    " - #txlength[ ]{0,}\\[[ ]{0,}([0-9]{1,}) uks[ ]{0,}\\].*" ),
-    ( "IdGain",            "#gain",       "0.0",   " - #gain[ ]{0,}\\[[ ]{0,}([+-]?([0-9]*[.])?[0-9]+) dB[ ]{0,}\\].*" ),
-    ( "IdTVGMode",         "#tvgmode",    "1",     " - #tvgmode[ ]{0,}\\[[ ]{0,}([0-4]{1})[ ]{0,}\\].*" ),
-    ( "IdTVGAbs",          "#tvgabs",     "0.140", " - #tvgabs[ ]{0,}\\[[ ]{0,}([+-]?([0-9]*[.])?[0-9]+) dB\\/m[ ]{0,}\\].*" ),
-    ( "IdTVGSprd",         "#tvgsprd",    "15.0",  " - #tvgsprd[ ]{0,}\\[[ ]{0,}([+-]?([0-9]*[.])?[0-9]+)[ ]{0,}\\].*" ),
-    ( "IdSound",           "#sound",      "1500",  " - #sound[ ]{0,}\\[[ ]{0,}([0-9]{1,}) mps[ ]{0,}\\].*" ),
-    ( "IdDeadzone",        "#deadzone",   "300",   " - #deadzone[ ]{0,}\\[[ ]{0,}([0-9]{1,}) mm[ ]{0,}\\].*" ),
-    ( "IdThreshold",       "#threshold",  "10",    " - #threshold[ ]{0,}\\[[ ]{0,}([0-9]{1,}) %[ ]{0,}\\].*" ),
-    ( "IdOffset",          "#offset",     "0",     " - #offset[ ]{0,}\\[[ ]{0,}([0-9]{1,}) mm[ ]{0,}\\].*" ),
-    ( "IdMedianFlt",       "#medianflt",  "2",     " - #medianflt[ ]{0,}\\[[ ]{0,}([0-9]{1,3})[ ]{0,}\\].*" ),
-    ( "IdSMAFlt",          "#movavgflt",  "1",     " - #movavgflt[ ]{0,}\\[[ ]{0,}([0-9]{1,3})[ ]{0,}\\].*" ),
-    ( "IdOutrate",         "#outrate",    "0.0",   " - #nmearate[ ]{0,}\\[[ ]{0,}([+-]?([0-9]*[.])?[0-9]+) sec[ ]{0,}\\].*" ),
-    ( "IdNMEADBT",         "#nmeadbt",    "1",     " - #nmeadbt[ ]{0,}\\[[ ]{0,}([01]{1})[ ]{0,}\\].*" ),
-    ( "IdNMEADPT",         "#nmeadpt",    "1",     " - #nmeadpt[ ]{0,}\\[[ ]{0,}([01]{1})[ ]{0,}\\].*" ),
-    ( "IdNMEADPTOffset",   "#nmeadptoff", "0.0",   " - #nmeadptoff[ ]{0,}\\[[ ]{0,}([+-]?([0-9]*[.])?[0-9]+) m[ ]{0,}\\].*" ),
-    ( "IdNMEADPTZero",     "#nmeadpzero", "1",     " - #nmeadpzero[ ]{0,}\\[[ ]{0,}([01]{1})[ ]{0,}\\].*" ),
-    ( "IdNMEAMTW",         "#nmeamtw",    "1",     " - #nmeamtw[ ]{0,}\\[[ ]{0,}([01]{1})[ ]{0,}\\].*" ),
-    ( "IdAltprec",         "#altprec",    "3",     " - #altprec[ ]{0,}\\[[ ]{0,}([1-4]{1})[ ]{0,}\\].*" ),
-    ( "IdNMEAXDR",         "#nmeaxdr",    "1",     " - #nmeaxdr[ ]{0,}\\[[ ]{0,}([01]{1})[ ]{0,}\\].*" ),
-    ( "IdNMEAEMA",         "#nmeaema",    "1",     " - #nmeaema[ ]{0,}\\[[ ]{0,}([01]{1})[ ]{0,}\\].*" ),
-    ( "IdNMEAZDA",         "#nmeazda",    "0",     " - #nmeazda[ ]{0,}\\[[ ]{0,}([01]{1})[ ]{0,}\\].*" ),
-    ( "IdOutput",          "#output",     "3",     " - #output[ ]{0,}\\[[ ]{0,}([0-9]{1,})[ ]{0,}\\].*" ),
-    ( "IdTime",            "#time",       "0",     " - #time[ ]{0,}\\[[ ]{0,}([0-9]{1,})[ ]{0,}\\].*" ),
-    ( "IdSyncExtern",      "#syncextern", "0",     " - #syncextern[ ]{0,}\\[[ ]{0,}([01]{1})[ ]{0,}\\].*" ),
-    ( "IdSyncExternMode",  "#syncextmod", "1",     " - #syncextmod[ ]{0,}\\[[ ]{0,}([01]{1})[ ]{0,}\\].*" ),
-    ( "IdSyncOutPolarity", "#syncoutpol", "1",     " - #syncoutpol[ ]{0,}\\[[ ]{0,}([01]{1})[ ]{0,}\\].*" ),
-    ( "IdGetWorkFreq",     "",            "",      ".*Working Frequency:[ ]{0,}([0-9]{4,})Hz.*" ),
-    ( "IdVersion",         "#version",    "",      " S\\/W Ver: ([0-9]{1,}[.][0-9]{1,}) .*" ),
-    ( "IdGo",              "#go",         "",      "" )]
-
-DualEchosounderCommands = [
-    ( "IdInfo",            "#info",       "",      ""),
-    ( "IdRange",           "#range",      "50000", " - #range[ ]{0,}\\[[ ]{0,}([0-9]{1,}) mm[ ]{0,}\\].*"),
-    ( "IdRangeH",          "#rangeh",     "50000", " - #rangeh[ ]{0,}\\[[ ]{0,}([0-9]{1,}) mm[ ]{0,}\\].*"),
-    ( "IdRangeL",          "#rangel",     "50000", " - #rangel[ ]{0,}\\[[ ]{0,}([0-9]{1,}) mm[ ]{0,}\\].*"),
-    ( "IdInterval",        "#interval",   "1.0",   " - #interval[ ]{0,}\\[[ ]{0,}(([0-9]*[.])?[0-9]+) sec[ ]{0,}\\].*") ,
-    ( "IdPingonce",        "#pingonce",   "0",     " - #pingonce[ ]{0,}\\[[ ]{0,}([01]{1})[ ]{0,}\\].*" ),
-    ( "IdTxLength",        "#txlength",   "50",    " - #txlength[ ]{0,}\\[[ ]{0,}([0-9]{1,}) uks[ ]{0,}\\].*" ),
-    ( "IdTxLengthH",       "#txlengthh",  "50",    " - #txlengthh[ ]{0,}\\[[ ]{0,}([0-9]{1,}) uks[ ]{0,}\\].*" ),
-    ( "IdTxLengthL",       "#txlengthl",  "100",   " - #txlengthl[ ]{0,}\\[[ ]{0,}([0-9]{1,}) uks[ ]{0,}\\].*" ),
-    ( "IdTxPower",         "#txpower",    "0.0",   " - #txpower[ ]{0,}\\[[ ]{0,}([+-]?([0-9]*[.])?[0-9]+) dB[ ]{0,}\\].*" ),
-    ( "IdGain",            "#gain",       "0.0",   " - #gain[ ]{0,}\\[[ ]{0,}([+-]?([0-9]*[.])?[0-9]+) dB[ ]{0,}\\].*" ),
-    ( "IdGainH",           "#gainh",      "0.0",   " - #gainh[ ]{0,}\\[[ ]{0,}([+-]?([0-9]*[.])?[0-9]+) dB[ ]{0,}\\].*" ),
-    ( "IdGainL",           "#gainl",      "0.0",   " - #gainl[ ]{0,}\\[[ ]{0,}([+-]?([0-9]*[.])?[0-9]+) dB[ ]{0,}\\].*" ),
-    ( "IdTVGMode",         "#tvgmode",    "1",     " - #tvgmode[ ]{0,}\\[[ ]{0,}([0-4]{1})[ ]{0,}\\].*" ),
-    ( "IdTVGAbs",          "#tvgabs",     "0.140", " - #tvgabs[ ]{0,}\\[[ ]{0,}([+-]?([0-9]*[.])?[0-9]+) dB\\/m[ ]{0,}\\].*" ),
-    ( "IdTVGAbsH",         "#tvgabsh",    "0.140", " - #tvgabsh[ ]{0,}\\[[ ]{0,}([+-]?([0-9]*[.])?[0-9]+) dB\\/m[ ]{0,}\\].*" ),
-    ( "IdTVGAbsL",         "#tvgabsl",    "0.060", " - #tvgabsl[ ]{0,}\\[[ ]{0,}([+-]?([0-9]*[.])?[0-9]+) dB\\/m[ ]{0,}\\].*" ),
-    ( "IdTVGSprd",         "#tvgsprd",    "15.0",  " - #tvgsprd[ ]{0,}\\[[ ]{0,}([+-]?([0-9]*[.])?[0-9]+)[ ]{0,}\\].*" ),
-    ( "IdTVGSprdH",        "#tvgsprdh",   "15.0",  " - #tvgsprdh[ ]{0,}\\[[ ]{0,}([+-]?([0-9]*[.])?[0-9]+)[ ]{0,}\\].*" ),
-    ( "IdTVGSprdL",        "#tvgsprdl",   "15.0",  " - #tvgsprdl[ ]{0,}\\[[ ]{0,}([+-]?([0-9]*[.])?[0-9]+)[ ]{0,}\\].*" ),
-    ( "IdAttn",            "#attn",       "0",     " - #attn[ ]{0,}\\[[ ]{0,}([0-9]{1,}) uks[ ]{0,}\\].*" ),
-    ( "IdAttnH",           "#attnh",      "0",     " - #attnh[ ]{0,}\\[[ ]{0,}([0-9]{1,}) uks[ ]{0,}\\].*" ),
-    ( "IdAttnL",           "#attnl",      "0",     " - #attnl[ ]{0,}\\[[ ]{0,}([0-9]{1,}) uks[ ]{0,}\\].*" ),
-    ( "IdSound",           "#sound",      "1500",  " - #sound[ ]{0,}\\[[ ]{0,}([0-9]{1,}) mps[ ]{0,}\\].*" ),
-    ( "IdDeadzone",        "#deadzone",   "300",   " - #deadzone[ ]{0,}\\[[ ]{0,}([0-9]{1,}) mm[ ]{0,}\\].*" ),
-    ( "IdDeadzoneH",       "#deadzoneh",  "300",   " - #deadzoneh[ ]{0,}\\[[ ]{0,}([0-9]{1,}) mm[ ]{0,}\\].*" ),
-    ( "IdDeadzoneL",       "#deadzonel",  "500",   " - #deadzonel[ ]{0,}\\[[ ]{0,}([0-9]{1,}) mm[ ]{0,}\\].*" ),
-    ( "IdThreshold",       "#threshold",  "10",    " - #threshold[ ]{0,}\\[[ ]{0,}([0-9]{1,}) %[ ]{0,}\\].*" ),
-    ( "IdThresholdH",      "#thresholdh", "10",    " - #thresholdh[ ]{0,}\\[[ ]{0,}([0-9]{1,}) %[ ]{0,}\\].*" ),
-    ( "IdThresholdL",      "#thresholdl", "10",    " - #thresholdl[ ]{0,}\\[[ ]{0,}([0-9]{1,}) %[ ]{0,}\\].*" ),
-    ( "IdOffset",          "#offset",     "0",     " - #offset[ ]{0,}\\[[ ]{0,}([0-9]{1,}) mm[ ]{0,}\\].*" ),
-    ( "IdOffsetH",         "#offseth",    "0",     " - #offseth[ ]{0,}\\[[ ]{0,}([0-9]{1,}) mm[ ]{0,}\\].*" ),
-    ( "IdOffsetL",         "#offsetl",    "0",     " - #offsetl[ ]{0,}\\[[ ]{0,}([0-9]{1,}) mm[ ]{0,}\\].*" ),
-    ( "IdMedianFlt",       "#medianflt",  "2",     " - #medianflt[ ]{0,}\\[[ ]{0,}([0-9]{1,3})[ ]{0,}\\].*" ),
-    ( "IdSMAFlt",          "#movavgflt",  "1",     " - #movavgflt[ ]{0,}\\[[ ]{0,}([0-9]{1,3})[ ]{0,}\\].*" ),
-    ( "IdNMEADBT",         "#nmeadbt",    "1",     " - #nmeadbt[ ]{0,}\\[[ ]{0,}([01]{1})[ ]{0,}\\].*" ),
-    ( "IdNMEADPT",         "#nmeadpt",    "0",     " - #nmeadpt[ ]{0,}\\[[ ]{0,}([01]{1})[ ]{0,}\\].*" ),
-    ( "IdNMEAMTW",         "#nmeamtw",    "1",     " - #nmeamtw[ ]{0,}\\[[ ]{0,}([01]{1})[ ]{0,}\\].*" ),
-    ( "IdNMEAXDR",         "#nmeaxdr",    "1",     " - #nmeaxdr[ ]{0,}\\[[ ]{0,}([01]{1})[ ]{0,}\\].*" ),
-    ( "IdNMEAEMA",         "#nmeaema",    "0",     " - #nmeaema[ ]{0,}\\[[ ]{0,}([01]{1})[ ]{0,}\\].*" ),
-    ( "IdNMEAZDA",         "#nmeazda",    "0",     " - #nmeazda[ ]{0,}\\[[ ]{0,}([01]{1})[ ]{0,}\\].*" ),
-    ( "IdOutrate",         "#outrate",    "0.0",   " - #nmearate[ ]{0,}\\[[ ]{0,}([+-]?([0-9]*[.])?[0-9]+) sec[ ]{0,}\\].*" ),
-    ( "IdNMEADPTOffset",   "#nmeadptoff", "0.0",   " - #nmeadptoff[ ]{0,}\\[[ ]{0,}([+-]?([0-9]*[.])?[0-9]+) m[ ]{0,}\\].*" ),
-    ( "IdNMEADPTZero",     "#nmeadpzero", "1",     " - #nmeadpzero[ ]{0,}\\[[ ]{0,}([01]{1})[ ]{0,}\\].*" ),
-    ( "IdOutput",          "#output",     "3",     " - #output[ ]{0,}\\[[ ]{0,}([0-9]{1,})[ ]{0,}\\].*" ),
-    ( "IdAltprec",         "#altprec",    "3",     " - #altprec[ ]{0,}\\[[ ]{0,}([1-4]{1})[ ]{0,}\\].*" ),
-    ( "IdSamplFreq",       "#samplfreq",  "0",     " - #samplfreq[ ]{0,}\\[[ ]{0,}([0-9]{1,6})[ ]{0,}\\].*" ),
-    ( "IdTime",            "#time",       "0",     " - #time[ ]{0,}\\[[ ]{0,}([0-9]{1,})[ ]{0,}\\].*" ),
-    ( "IdSyncExtern",      "#syncextern", "0",     " - #syncextern[ ]{0,}\\[[ ]{0,}([01]{1})[ ]{0,}\\].*" ),
-    ( "IdSyncExternMode",  "#syncextmod", "1",     " - #syncextmod[ ]{0,}\\[[ ]{0,}([01]{1})[ ]{0,}\\].*" ),
-    ( "IdSyncOutPolarity", "#syncoutpol", "1",     " - #syncoutpol[ ]{0,}\\[[ ]{0,}([01]{1})[ ]{0,}\\].*" ),
-    ( "IdAnlgMode",        "#anlgmode",   "0",     " - #anlgmode[ ]{0,}\\[[ ]{0,}([01]{1})[ ]{0,}\\].*" ),
-    ( "IdAnlgRate",        "#anlgrate",   "0.100", " - #anlgrate[ ]{0,}\\[[ ]{0,}([+-]?([0-9]*[.])?[0-9]+) V\/m[ ]{0,}\\].*" ),
-    ( "IdAnlgMaxOut",      "#anlgmax",    "4",     " - #anlgmax[ ]{0,}\\[[ ]{0,}([1-4]{1})[ ]{0,}\\].*" ),
-    ( "IdVersion",         "#version",    "",      " S\\/W Ver: ([0-9]{1,}[.][0-9]{1,}) .*" ),
-
-    ( "IdSetHighFreq",     "#setfh",      "",      "" ),
-    ( "IdSetLowFreq",      "#setfl",      "",      "" ),
-    ( "IdSetDualFreq",     "#setfd",      "",      "" ),
-
-    ( "IdGetHighFreq",     "#getfh",      "",      ".*High Frequency:[ ]{0,}([0-9]{4,})Hz.*" ),
-    ( "IdGetLowFreq",      "#getfl",      "",      ".*Low Frequency:[ ]{0,}([0-9]{4,})Hz.*" ),
-    ( "IdGetWorkFreq",     "#getf",       "",      ".*:[ ]{1,}([0-9]{4,})Hz[ ]{0,}\\(Active\\).*" ),
-
-    ( "IdGo",              "#go",         "",      "" )]
+from echocommands import SingleEchosounderCommands, DualEchosounderCommands, EchosounderState, FindCommand, ParseInfo
 
 class Echosounder():
     """! Base class for access to Echologger(c) Single/Dual Frequency Echosounders
     Contains common access methods for both kinds of echosounders
     It works stable only on echosounders with firmware version > 4.00
     """
-    def __init__(self, serial_port, baud_rate, port_timeout = 0.1, commands = None):
+    def __init__(self, serial_port, baud_rate, port_timeout = 0.1, commands = None, lazy = False, settings = None):
         """! Constructor
         @param serial_port Serial Port URL
         @param baur_rate  Baud rate for Echosounder
         @param timeout Timeout (float) in seconds for the serial port
         @param commands List of echosounder's commands
+        @param lazy False - detect echosounder and read "#info" now, True - only open the port, detection is done
+            by the first command and "#info" is read by the first GetValue() of a value which is not known
+        @param settings Snapshot of settings {CommandID: value} (e.g. saved from GetSettings()) to start with
         """
+        import serial # imported only when a device is opened, see echocommands for the serial-free part
         self._serial_port = serial.Serial(serial_port, baud_rate, timeout = port_timeout)
-        self._is_running = False
-        self._is_detected = False
+        self._state = EchosounderState.Disconnected
         self._info_lines = []
-        self._settings = {}
+        self._info_fetched = False
+        self._settings = dict(settings) if None != settings else {}
         self._command_result = ""
+        self._rx_buffer = bytearray()
 
         self._sonarcommands = commands
         
-        self._is_detected = self.Detect()
-        if True == self._is_detected:
+        if False == lazy and True == self.Detect():
             self.__GetEchosounderInfo()
 
     def __del__(self):
@@ -135,6 +39,12 @@ class Echosounder():
         if hasattr(self, '_serial_port'):
             self._serial_port.close()
 
+    def GetCommands(self):
+        """! Get echosounder's commands table
+        @result list of (CommandID, text command, default value, regular expression) tuples
+        """
+        return self._sonarcommands
+
     def GetSerialPort(self):
         """! Get Serial Port
         @result serial port instance
@@ -165,20 +75,20 @@ class Echosounder():
                 self._command_result = self._command_result + chs 
 
                 if magicidbuffer[-len(okgotoken):] == okgotoken:
-                    self._is_running = True
+                    self._state = EchosounderState.Running
                     return 1
                 if magicidbuffer[-len(oktoken):] == oktoken:
-                    self._is_running = False
+                    self._state = EchosounderState.Idle
                     return 1
                 if magicidbuffer[-len(invalidargtoken):] == invalidargtoken:
-                    self._is_running = False
+                    self._state = EchosounderState.Idle
                     return 2
                 if magicidbuffer[-len(invalidcmdtoken):] == invalidcmdtoken:
-                    self._is_running = False
+                    self._state = EchosounderState.Idle
                     return 3            
 
             period = time.monotonic_ns() - time_begin
-            if period > 4000000000: # 4s timeout hardcoded
+            if period > 4000000000: # 4s timeout hardcoded, nothing is known about the echosounder, state is kept
                 return -2
 
     def __WaitCommandPrompt(self, timeoutms):
@@ -199,26 +109,129 @@ class Echosounder():
             if period > timeoutms * 1000000:
                 return -2
 
+    def __SendPipelined(self, lines, window):
+        """! Send several command lines without waiting for each response
+            Up to "window" commands are queued on the wire, "OK"/"Invalid ..." responses are matched to them in order.
+            Matching stops at the first ambiguous response (timeout, unexpected "OK go", more results than commands,
+            echo of another command - a response was lost), then the port is drained until the echosounder is quiet.
+        @param lines - list of full command lines (with '\r')
+        @param window - maximum number of commands waiting for response
+        @result tuple (codes, responses): list of result codes (1 - success, 2 - invalid argument, 3 - invalid command),
+            None for every command without unambiguous response, and list of response texts received before each result
+        """
+        tokens = { "OK": 1, "Invalid argument": 2, "Invalid command": 3 }
+        codes = [None] * len(lines)
+        responses = [""] * len(lines)
+        response = ""
+        sent = 0
+        received = 0
+        prompts = 0
+        ambiguous = False
+        pending = ""
+        echoes = set(line.strip() for line in lines)
+        port = self._serial_port
+        deadline = time.monotonic() + 4.0 # same timeout as __SendCommandResponseCheck(), per response
+
+        while received < len(lines) and False == ambiguous:
+            if sent < len(lines) and sent - received < window:
+                batch = lines[sent:received + window]
+                port.write(bytes("".join(batch), 'latin_1'))
+                sent += len(batch)
+
+            chunk = port.read(max(1, port.in_waiting))
+            if len(chunk) == 0:
+                if time.monotonic() > deadline:
+                    ambiguous = True
+                continue
+
+            deadline = time.monotonic() + 4.0
+            text = chunk.decode('latin_1')
+            prompts += text.count('>')
+            pending += text
+            *responselines, pending = pending.split('\n')
+
+            for line in responselines:
+                token = line.strip().lstrip('>').strip()
+                if token in tokens:
+                    if received >= sent:
+                        ambiguous = True
+                        break
+                    echoed = [text.lstrip('>').strip() for text in response.splitlines()]
+                    if any(echo in echoes and echo != lines[received].strip() for echo in echoed):
+                        ambiguous = True # echo of a later command: response of this one was lost
+                        break
+                    codes[received] = tokens[token]
+                    responses[received] = response
+                    response = ""
+                    received += 1
+                elif token == "OK go":
+                    ambiguous = True
+                    break
+                else:
+                    response += line.lstrip('>') + '\n' # prompt of the previous command precedes the response
+
+        if True == ambiguous:
+            # Let the echosounder finish whatever is still queued, the rest goes in lockstep
+            quiet_since = time.monotonic()
+            give_up = quiet_since + 4.0
+            while time.monotonic() - quiet_since < 0.2 and time.monotonic() < give_up:
+                if len(port.read(max(1, port.in_waiting))) > 0:
+                    quiet_since = time.monotonic()
+        elif prompts < len(lines) and '>' not in pending:
+            self.__WaitCommandPrompt(1000)
+
+        return codes, responses
+
+    def __BeginCommand(self):
+        """! Enter "Commanding" state, a running echosounder is stopped first
+        @result True - echosounder was running before, False - it was not running, None - echosounder not detected
+            (state is "Disconnected", __EndCommand() must not be called)
+        """
+        wasrunning = EchosounderState.Running == self._state
+
+        if EchosounderState.Disconnected == self._state: # lazy connection or lost echosounder
+            if False == self.Detect():
+                return None
+
+        if True == wasrunning: # '\r' and the prompt stop the output, Detect() only if the prompt does not come
+            if False == self.Stop(redetect = False):
+                return None
+
+        self._state = EchosounderState.Commanding
+        return wasrunning
+
+    def __EndCommand(self, wasrunning):
+        """! Leave "Commanding" state, restart echosounder if it was running before __BeginCommand()
+        @param wasrunning - __BeginCommand() result
+        """
+        if EchosounderState.Commanding == self._state:
+            self._state = EchosounderState.Idle
+
+        if True == wasrunning and EchosounderState.Running != self._state:
+            command_result = self._command_result # keep response of the command, not of "#go"
+            self.Start()
+            self._command_result = command_result
+
     def SendCommand(self, Command):
         """! Send command to the echosounder
         @param Command Echosounder command
         @result Result of command execution
         """
         result = -1
-        wasrunning = self._is_running
-
-        if True == self._is_running:
-            self.Stop()
+        wasrunning = self.__BeginCommand()
+        if None == wasrunning:
+            return -2
 
         for command in self._sonarcommands:
             if command[0] == Command:
                 fullcommand = command[1] + '\r'
                 self._serial_port.write(bytes(fullcommand, 'latin_1'))
                 result = self.__SendCommandResponseCheck()
-                self.__WaitCommandPrompt(1000)
+                if EchosounderState.Running != self._state: # no command prompt after "OK go", data follows
+                    self.__WaitCommandPrompt(1000)
+                break
 
-        if True == wasrunning:
-            self.Start()
+        self.__EndCommand(wasrunning)
 
         return result
     
@@ -234,10 +247,9 @@ class Echosounder():
         @result True - value successfully set, False - set value failed
         """
         retvalue = False
-        wasrunning = self._is_running
-
-        if True == self._is_running:
-            self.Stop()
+        wasrunning = self.__BeginCommand()
+        if None == wasrunning:
+            return retvalue
 
         for command in self._sonarcommands:
             if command[0] == Command and len(command[2]) > 0:
@@ -252,29 +264,145 @@ class Echosounder():
                 self.__WaitCommandPrompt(1000)
                 break
         
-        if True == wasrunning:
-            self.Start()
+        self.__EndCommand(wasrunning)
 
         return retvalue
 
+    def SetValues(self, values, pipelined = True, window = 8):
+        """! Set several echosounder's parameters with a single Stop/Start cycle
+            In pipelined mode commands are streamed without waiting for the command prompt between them and responses
+            are matched in order. Commands without unambiguous response are repeated one by one as SetValue() does.
+        @param values - dictionary {Command: Value} or list of (Command, Value) pairs, applied in order
+        @param pipelined - True - pipeline commands, False - lockstep (command, response, prompt)
+        @param window - maximum number of commands on the wire waiting for response
+        @result list of result codes in order of values: 1 - value set, 2 - invalid argument, 3 - invalid command,
+            -1 - unknown command, -2 - timeout occured
+        """
+        items = list(values.items()) if isinstance(values, dict) else list(values)
+        results = [-1] * len(items)
+        lines = []
+        indexes = []
+
+        for i, (Command, Value) in enumerate(items):
+            for command in self._sonarcommands:
+                if command[0] == Command and len(command[2]) > 0:
+                    lines.append(command[1] + ' ' + str(Value) + '\r')
+                    indexes.append(i)
+                    break
+
+        wasrunning = self.__BeginCommand()
+        if None == wasrunning:
+            for i in indexes:
+                results[i] = -2
+            return results
+
+        if True == pipelined and len(lines) > 1:
+            codes, responses = self.__SendPipelined(lines, max(1, window))
+        else:
+            codes = [None] * len(lines)
+
+        for line, i, code in zip(lines, indexes, codes):
+            if None == code:
+                self._serial_port.write(bytes(line, 'latin_1'))
+                code = self.__SendCommandResponseCheck()
+                self.__WaitCommandPrompt(1000)
+            results[i] = code
+            if 1 == code:
+                self._settings[items[i][0]] = str(items[i][1])
+
+        self.__EndCommand(wasrunning)
+
+        return results
+
     def GetValue(self, Command):
         """! Get echosounder parameters. This method returns values, previosly read from echosounder by __GetEchosounderInfo()
-            or changed by SetValue() method
+            or changed by SetValue() method. In lazy mode "#info" is read the first time an unknown value is requested
         """
+        if Command not in self._settings and False == self._info_fetched:
+            self.__GetEchosounderInfo()
         return self._settings[Command]
+
+    def QueryValues(self, Commands, pipelined = True, window = 8):
+        """! Read back current values of parameters from echosounder without full "#info" dump
+            Every command is sent without value, the " - #name [ value unit ]" line of the response is parsed
+            by the command's regular expression and _settings are updated in place.
+        @param Commands - list of CommandIDs
+        @param pipelined - True - pipeline queries (see SetValues()), False - lockstep
+        @param window - maximum number of queries on the wire waiting for response
+        @result dictionary {CommandID: value}, value is None if it could not be read back
+        """
+        results = {}
+        queries = []
+
+        for Command in Commands:
+            results[Command] = None
+            for command in self._sonarcommands:
+                if command[0] == Command and len(command[1]) > 0 and len(command[3]) > 0:
+                    queries.append(command)
+                    break
+
+        if 0 == len(queries):
+            return results
+
+        lines = [command[1] + '\r' for command in queries]
+        wasrunning = self.__BeginCommand()
+        if None == wasrunning:
+            return results
+
+        if True == pipelined and len(lines) > 1:
+            codes, responses = self.__SendPipelined(lines, max(1, window))
+        else:
+            codes = [None] * len(lines)
+            responses = [""] * len(lines)
+
+        for line, command, code, response in zip(lines, queries, codes, responses):
+            value = self.__MatchValue(command, response) if 1 == code else None
+            if None == value: # no value in pipelined response is ambiguous too, query again in lockstep
+                self._serial_port.write(bytes(line, 'latin_1'))
+                code = self.__SendCommandResponseCheck()
+                response = self._command_result
+                self.__WaitCommandPrompt(1000)
+                value = self.__MatchValue(command, response) if 1 == code else None
+
+            if None != value:
+                results[command[0]] = value
+                self._settings[command[0]] = value
+
+        self.__EndCommand(wasrunning)
+
+        return results
+
+    def __MatchValue(self, command, response):
+        """! Parse value from the response of a query by the command's regular expression
+        @param command - (CommandID, text command, default value, regular expression)
+        @param response - response text
+        @result value, None - no line of the response matches
+        """
+        reg = re.compile(command[3])
+        for responseline in response.splitlines():
+            match = reg.match(responseline)
+            if None != match:
+                return match.group(1)
+        return None
+
+    def QueryValue(self, Command):
+        """! Read back current value of one parameter from echosounder (see QueryValues())
+        @param Command - CommandID
+        @result value, None - value could not be read back
+        """
+        return self.QueryValues([Command], False)[Command]
+
+    def GetSettings(self):
+        """! Get copy of all known echosounder parameters (can be passed back as "settings" snapshot to the constructor)
+        @result dictionary {CommandID: value}
+        """
+        return dict(self._settings)
     
     def __GetAllValues(self):
         """! Get all parameters. This method parse result of the #info command and fill out _settings map by the values.
             It explisetly invoke by the constructor -> __GetEchosounderInfo()
         """
-        self._settings = {}
-        for command in self._sonarcommands:
-            if len(command[3]) > 0:
-                reg = re.compile(command[3])
-                for line in self._info_lines:
-                    if None != reg.match(line):
-                        value = reg.match(line).group(1)
-                        self._settings[command[0]] = value
+        self._settings = ParseInfo(self._info_lines, self._sonarcommands)
 
     def Detect(self):
         """! Detect echosounder. This method should work for both full and half duplex interfaces. 
@@ -285,7 +413,8 @@ class Echosounder():
         @result True - echosounder detected, False - echosounder not detected
         """
         result = False
-        self._is_detected = False
+        self._state = EchosounderState.Commanding
+        self._rx_buffer = bytearray()
         for i in range(0, 10):
             self._serial_port.write(bytes('\r', 'latin_1'))
             time.sleep(0.05)
@@ -307,9 +436,9 @@ class Echosounder():
                 else:
                     self.__WaitCommandPrompt(1000)
                     result = True
-                    self._is_detected = True
                 break
 
+        self._state = EchosounderState.Idle if True == result else EchosounderState.Disconnected
         return result
 
     def __GetEchosounderInfo(self):
@@ -320,45 +449,147 @@ class Echosounder():
         result = self.SendCommand("IdInfo")
 
         if 1 == result:
+            self._info_fetched = True
             self._info_lines = self._command_result.splitlines()
             for line in self._info_lines:
                 line.replace("\r", "").replace("\n", "")
                 
             self.__GetAllValues()
 
+    def Reopen(self):
+        """! Close and open the serial port again and detect echosounder (e.g. after USB adapter dropout or unit brownout)
+            Cached settings are kept, they are not applied to the echosounder again.
+        @result True - echosounder detected, False - echosounder not detected
+        @exception serial.SerialException port can not be opened
+        """
+        self._state = EchosounderState.Disconnected
+        self._rx_buffer = bytearray()
+        try:
+            self._serial_port.close()
+        except OSError:
+            pass
+        self._serial_port.open()
+        return self.Detect()
+
     def IsDetected(self):
         """! Return "Detection" status
         @result True - echosounder is previously detected, False - echosounder is previously not detected
         """
-        return self._is_detected
+        return EchosounderState.Disconnected != self._state
     
     def IsRunning(self):
         """! Return "Running" status
         @result True - echosounder is currently running (output data), False - echosounder stoped
         """
-        return self._is_running
+        return EchosounderState.Running == self._state
+
+    def GetState(self):
+        """! Return protocol state
+        @result EchosounderState value
+        """
+        return self._state
     
     def ReadData(self, numofbytes):
         """! Return data read from echosounder
         @param numofbytes - number of bytes to read
         @result return data read from echosounder
         """
+        if len(self._rx_buffer) > 0:
+            data = bytes(self._rx_buffer[:numofbytes])
+            del self._rx_buffer[:numofbytes]
+            if len(data) < numofbytes and self._serial_port.in_waiting > 0:
+                data += self._serial_port.read(min(self._serial_port.in_waiting, numofbytes - len(data)))
+            return data
         return self._serial_port.read(numofbytes)
+
+    def ReadAvailable(self, maxbytes = 4096, timeout = 1.0):
+        """! Return complete lines received from echosounder
+            Everything already received is taken at once (read size comes from in_waiting), then the method blocks
+            on the serial port until at least one complete line arrives or timeout expires. There are no fixed sleeps,
+            so a sentence is returned as soon as its last byte is received. An incomplete line at the end is kept
+            and returned by the next call.
+        @param maxbytes - maximum number of bytes to return
+        @param timeout - timeout in seconds, 0 - do not block
+        @result bytes containing whole lines, b"" - no complete line before timeout
+        """
+        buffer = self._rx_buffer
+        port = self._serial_port
+        deadline = time.monotonic() + timeout
+
+        while True:
+            room = maxbytes - len(buffer)
+            waiting = port.in_waiting
+            if waiting > 0 and room > 0:
+                buffer += port.read(min(waiting, room))
+
+            end = buffer.rfind(b'\n', 0, maxbytes)
+            if end >= 0:
+                data = bytes(buffer[:end + 1])
+                del buffer[:end + 1]
+                return data
+
+            if len(buffer) >= maxbytes: # line longer than maxbytes: it is not a sentence, give it out as is
+                data = bytes(buffer[:maxbytes])
+                del buffer[:maxbytes]
+                return data
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return b""
+
+            port_timeout = port.timeout
+            if None == port_timeout or remaining < port_timeout: # do not block past the deadline
+                port.timeout = remaining
+                try:
+                    buffer += port.read(1)
+                finally:
+                    port.timeout = port_timeout
+            else:
+                buffer += port.read(1) # blocks until the next byte or port timeout
+
+    def ReadSentences(self, maxbytes = 4096, timeout = 1.0):
+        """! Return complete sentences received from echosounder (see ReadAvailable())
+        @param maxbytes - maximum number of bytes to read
+        @param timeout - timeout in seconds, 0 - do not block
+        @result list of sentences without line endings, empty list - nothing received before timeout
+        """
+        data = self.ReadAvailable(maxbytes, timeout)
+        return [line for line in data.decode("latin_1").splitlines() if len(line) > 0]
     
     def Start(self):
         """! Start echosounder (It start produce data according "output" setting)
         @result True - echosounder started, False - echosounder not started
         """
-        result = self.SendCommand("IdGo")
-        if 1 != self.__SendCommandResponseCheck():
-            result = False
-        return True
+        if EchosounderState.Running == self._state:
+            return True
+        return 1 == self.SendCommand("IdGo")
     
-    def Stop(self):
+    def Stop(self, redetect = True):
         """! Stop echosounder
+            Echosounder in "Idle" state that does not send anything is already stopped, so it is not detected again
+        @param redetect True - stop by Detect(), False - a running echosounder is stopped by '\r' and the command
+            prompt only (no "#speed" check, much faster), Detect() is used if the prompt does not come
+        @result True - echosounder stopped, False - echosounder not detected
         """
+        if EchosounderState.Idle == self._state and 0 == len(self._rx_buffer) and 0 == self._serial_port.in_waiting:
+            return True
+        if False == redetect and EchosounderState.Running == self._state and True == self.__Halt():
+            return True
         return self.Detect()
 
+    def __Halt(self):
+        """! Stop running echosounder without detecting it again: '\r' stops the output, the command prompt confirms it.
+            Several attempts as in Detect(), because a half duplex line can lose '\r' sent while the unit transmits
+        @result True - command prompt received, False - no prompt (state is unchanged)
+        """
+        for i in range(0, 5):
+            self._serial_port.write(bytes('\r', 'latin_1'))
+            if 1 == self.__WaitCommandPrompt(200):
+                self._rx_buffer = bytearray()
+                self._state = EchosounderState.Idle
+                return True
+        return False
+
     def SetCurrentTime(self):
         """! Set current time for echosounder
         """
@@ -367,8 +598,8 @@ class Echosounder():
 class SingleEchosounder(Echosounder):
     """! Class for access to Echologger(c) Single Frequency Ecosounders
     """
-    def __init__(self, serial_port, baud_rate, port_timeout = 0.1, commands = SingleEchosounderCommands):
-        super().__init__(serial_port, baud_rate, port_timeout, commands)
+    def __init__(self, serial_port, baud_rate, port_timeout = 0.1, commands = SingleEchosounderCommands, lazy = False, settings = None):
+        super().__init__(serial_port, baud_rate, port_timeout, commands, lazy, settings)
 
     def __del__(self):
         super().__del__()
@@ -376,15 +607,20 @@ class SingleEchosounder(Echosounder):
 class DualEchosounder(Echosounder):
     """! Class for access to Echologger(c) Dual Frequency Ecosounders
     """
-    def __init__(self, serial_port, baud_rate, port_timeout = 0.1, commands = DualEchosounderCommands):
-        super().__init__(serial_port, baud_rate, port_timeout, commands)
+    def __init__(self, serial_port, baud_rate, port_timeout = 0.1, commands = DualEchosounderCommands, lazy = False, settings = None):
+        super().__init__(serial_port, baud_rate, port_timeout, commands, lazy, settings)
 
     def __del__(self):
         super().__del__()
 
 if __name__ == "__main__":
-    """ Example how to use the Echosounder Class
+    """ Example how to use the Echosounder Class, "python -m echosndr record ..." runs the recorder (see echorecord)
     """
+    import sys
+    if len(sys.argv) > 1 and "record" == sys.argv[1]:
+        import echorecord
+        sys.exit(echorecord.main(sys.argv[2:]))
+
     try:
         ss = SingleEchosounder("\\\\.\\COM31", 115200, 1)
     except:
@@ -0,0 +1,194 @@
+# Copyright (c) EofE Ultrasonics Co., Ltd., 2024
+import functools
+import importlib
+import json
+import os
+import threading
+import time
+
+# Traced operations: (module, class, methods, category). Private methods are listed with their mangled names.
+DefaultTargets = [
+    ("echosndr", "Echosounder", ("Detect", "_Echosounder__GetEchosounderInfo", "_Echosounder__SendPipelined",
+                                 "SendCommand", "SetValue", "SetValues", "QueryValues", "Start", "Stop",
+                                 "SetCurrentTime", "Reopen", "ReadAvailable"), "driver"),
+    ("echonmea", "PingDecoder", ("FeedLines", "Flush"), "parse"),
+    ("echoprofile", "Profile", ("Validate", "Plan", "Apply"), "driver"),
+    ("echosession", "SupervisedSession", ("_SupervisedSession__Recover",), "driver"),
+    ("echobus", "StreamBus", ("Publish",), "pipeline"),
+    ("echopublish", "NmeaPublisher", ("Publish",), "pipeline"),
+    ("echoexport", "ColumnarSink", ("Flush", "Close"), "disk"),
+    ("echorotate", "RotatingRecorder", ("Rotate", "_RotatingRecorder__Compress", "_RotatingRecorder__WriteManifest"), "disk")]
+
+class _NullSpan():
+    """! Span used while tracing is disabled
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NullSpanInstance = _NullSpan()
+
+class _Span():
+    """! Span of a user defined pipeline stage
+    """
+    def __init__(self, tracer, name, category, args):
+        self._tracer = tracer
+        self._name = name
+        self._category = category
+        self._args = args
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._tracer.Add(self._name, self._category, self._start, time.perf_counter() - self._start, self._args)
+        return False
+
+class Tracer():
+    """! Recorder of timed spans, exported in the Chrome trace event format (chrome://tracing, Perfetto)
+    Spans are kept in memory as (name, category, thread, start, duration, args) tuples with time.perf_counter()
+    timestamps, up to max_events (older spans are kept, newer ones are counted as dropped).
+    """
+    def __init__(self, max_events = 1000000):
+        """! Constructor
+        @param max_events Maximum number of spans kept
+        """
+        self._max_events = max_events
+        self._events = []
+        self._dropped = 0
+        self._threads = {}
+        self._origin = time.perf_counter()
+        self._patched = []
+
+    def Add(self, name, category, start, duration, args = None):
+        """! Add finished span
+        @param name Span name
+        @param category Category (driver, parse, disk, pipeline, ...)
+        @param start time.perf_counter() at the beginning
+        @param duration Duration in seconds
+        @param args Dictionary shown with the span, None - nothing
+        """
+        if len(self._events) >= self._max_events:
+            self._dropped += 1
+            return
+        thread = threading.get_ident()
+        if thread not in self._threads:
+            self._threads[thread] = threading.current_thread().name
+        self._events.append((name, category, thread, start, duration, args))
+
+    def Span(self, name, category = "app", args = None):
+        """! Return context manager timing a block
+            with tracer.Span("write"):
+                sink.WritePings(pings)
+        """
+        return _Span(self, name, category, args)
+
+    def Instrument(self, cls, methods, category):
+        """! Replace methods of class by traced wrappers (undone by Restore())
+        """
+        for method in methods:
+            original = cls.__dict__.get(method)
+            if None == original:
+                continue
+            name = "%s.%s" % (cls.__name__, method.split("__")[-1])
+            setattr(cls, method, self.__Wrap(original, name, category))
+            self._patched.append((cls, method, original))
+
+    def __Wrap(self, function, name, category):
+        """! Return traced wrapper of function
+        """
+        tracer = self
+        @functools.wraps(function)
+        def traced(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                tracer.Add(name, category, start, time.perf_counter() - start)
+        return traced
+
+    def Restore(self):
+        """! Restore original methods of instrumented classes
+        """
+        for cls, method, original in reversed(self._patched):
+            setattr(cls, method, original)
+        self._patched = []
+
+    def GetEvents(self):
+        """! Return list of spans (name, category, thread, start, duration, args)
+        """
+        return list(self._events)
+
+    def GetStats(self):
+        """! Return {name: (count, total seconds, maximum seconds)} and the number of dropped spans
+        @result tuple (dictionary, dropped)
+        """
+        stats = {}
+        for name, category, thread, start, duration, args in list(self._events):
+            count, total, longest = stats.get(name, (0, 0.0, 0.0))
+            stats[name] = (count + 1, total + duration, max(longest, duration))
+        return stats, self._dropped
+
+    def Export(self, path):
+        """! Write spans in the Chrome trace event format
+        @param path Output JSON file
+        """
+        pid = os.getpid()
+        events = [{ "name": "thread_name", "ph": "M", "pid": pid, "tid": thread, "args": { "name": name } }
+                  for thread, name in list(self._threads.items())]
+        for name, category, thread, start, duration, args in list(self._events):
+            event = { "name": name, "cat": category, "ph": "X", "pid": pid, "tid": thread,
+                      "ts": round((start - self._origin) * 1e6, 3), "dur": round(duration * 1e6, 3) }
+            if None != args:
+                event["args"] = args
+            events.append(event)
+        with open(path, "w", encoding = "utf-8") as f:
+            json.dump({ "traceEvents": events, "displayTimeUnit": "ms",
+                        "otherData": { "dropped": self._dropped } }, f)
+
+_tracer = None
+
+def Enable(tracer = None, targets = DefaultTargets):
+    """! Enable tracing of driver operations and pipeline stages
+        Methods are wrapped only while tracing is enabled, so disabled tracing costs nothing.
+        Modules of targets which cannot be imported (missing optional dependency) are skipped.
+    @param tracer Tracer, None - new Tracer
+    @param targets List of (module, class, methods, category)
+    @result Tracer
+    """
+    global _tracer
+    Disable()
+    tracer = tracer if None != tracer else Tracer()
+    for module, cls, methods, category in targets:
+        try:
+            tracer.Instrument(getattr(importlib.import_module(module), cls), methods, category)
+        except (ImportError, AttributeError):
+            continue
+    _tracer = tracer
+    return tracer
+
+def Disable():
+    """! Disable tracing and restore the original methods
+    @result Tracer which was enabled, None - tracing was not enabled
+    """
+    global _tracer
+    tracer = _tracer
+    _tracer = None
+    if None != tracer:
+        tracer.Restore()
+    return tracer
+
+def GetTracer():
+    """! Return enabled Tracer, None - tracing is disabled
+    """
+    return _tracer
+
+def Span(name, category = "app", args = None):
+    """! Return context manager timing a block with the enabled Tracer (does nothing when tracing is disabled)
+    """
+    if None == _tracer:
+        return _NullSpanInstance
+    return _tracer.Span(name, category, args)
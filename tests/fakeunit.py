@@ -0,0 +1,214 @@
+# Copyright (c) EofE Ultrasonics Co., Ltd., 2024
+"""! Scripted fake Echologger unit for offline tests
+FakeUnit implements the part of serial.Serial used by echosndr and answers like the unit does: commands are echoed,
+"OK"/"Invalid argument"/"Invalid command" are followed by the '>' prompt, "#go" answers "OK go" and starts ping
+output ("#F <frequency> Hz" marker, ZDA, DBT, MTW, XDR), '\r' stops a running unit and returns the prompt.
+Use Patch() to open echosounders on it:
+
+    with fakeunit.Patch() as units:
+        ss = DualEchosounder("fake", 115200)
+    unit = units[0]
+"""
+import re
+import threading
+import time
+from unittest import mock
+
+from echocommands import DualEchosounderCommands
+from echonmea import NmeaChecksum
+
+def Sentence(body):
+    """! Return NMEA sentence with checksum and line ending
+    """
+    return "$%s*%02X\r\n" % (body, NmeaChecksum(body))
+
+def _Unit(regex):
+    """! Unit of a value as printed by "#info" (" mm", " sec", ...), taken from the command's regular expression
+    """
+    match = re.search(r"\) ([^\[\]]*?)\[ \]\{0,\}\\\]", regex)
+    return " " + match.group(1).replace("\\", "") if None != match else ""
+
+class FakeUnit():
+    """! Fake serial port with a dual frequency unit behind it
+    Knobs: echo (commands are echoed), dead (nothing is answered), stall (running unit sends nothing),
+    lose (set of command names whose next response is lost), replies ({command name: text} replacing the next
+    response), frequencies {"H": Hz, "L": Hz}.
+    Records: lines (every received command line), detects (number of "#speed" commands), stops ('\r' that stopped output).
+    """
+    def __init__(self, port = None, baudrate = 115200, timeout = 0.1, **kwargs):
+        self.port = port
+        self.timeout = timeout
+        self.is_open = True
+        self.echo = True
+        self.dead = False
+        self.stall = False
+        self.lose = set()
+        self.replies = {}
+        self.frequencies = { "H": 200000, "L": 30000 }
+        self.mode = "D"
+        self.running = False
+        self.lines = []
+        self.detects = 0
+        self.stops = 0
+        self.pings = 0
+        self.values = {}
+        self.units = {}
+        for Command, text, default, regex in DualEchosounderCommands:
+            if len(default) > 0:
+                self.values[text] = default
+                self.units[text] = _Unit(regex)
+        self.values["#interval"] = "0.05"
+        self._rx = bytearray()
+        self._command = ""
+        self._condition = threading.Condition()
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target = self.__Generate, name = "fake-unit", daemon = True)
+        self._thread.start()
+
+    def Emit(self, text):
+        """! Queue text for the host
+        """
+        with self._condition:
+            self._rx += text.encode("latin_1")
+            self._condition.notify_all()
+
+    def __Ping(self, frequency):
+        now = time.time()
+        stamp = time.gmtime(now)
+        marker = "#F %d Hz" % frequency
+        depth = 2.5 if frequency == self.frequencies["H"] else 3.0
+        self.pings += 1
+        self.Emit("%s*%02X\r\n" % (marker, NmeaChecksum(marker)) +
+                  Sentence("SDZDA,%02d%02d%05.2f,%02d,%02d,%04d,00,00" % (stamp.tm_hour, stamp.tm_min, stamp.tm_sec + now % 1,
+                                                                        stamp.tm_mday, stamp.tm_mon, stamp.tm_year)) +
+                  Sentence("SDDBT,%.2f,f,%.2f,M,%.2f,F" % (depth * 3.2808, depth, depth * 0.5468)) +
+                  Sentence("SDMTW,20.5,C") + Sentence("SDXDR,A,-0.5,D,PTCH,A,1.0,D,ROLL"))
+
+    def __Generate(self):
+        while False == self._closed.wait(float(self.values["#interval"])):
+            if True == self.running and False == self.stall and False == self.dead:
+                modes = ("H", "L") if "D" == self.mode else (self.mode,)
+                for mode in modes:
+                    self.__Ping(self.frequencies[mode])
+
+    def __Respond(self, line, text):
+        """! Echo command and send response, a lost response sends nothing
+        """
+        name = line.split()[0] if len(line.split()) > 0 else ""
+        if name in self.lose:
+            self.lose.discard(name)
+            return
+        if name in self.replies:
+            text = self.replies.pop(name)
+        self.Emit((line + "\r\n" if True == self.echo else "") + text)
+
+    def __Execute(self, line):
+        if True == self.running:
+            self.running = False
+            self.stops += 1
+            self.Emit("\r\n>")
+            return
+        if "" == line:
+            self.Emit("\r\n>")
+            return
+
+        self.lines.append(line)
+        parts = line.split()
+        name = parts[0]
+        if "#go" == name:
+            self.__Respond(line, "OK go\r\n")
+            self.running = True
+        elif "#speed" == name:
+            self.detects += 1
+            self.__Respond(line, "OK\r\n>")
+        elif name in ("#setfh", "#setfl", "#setfd"):
+            self.mode = name[-1].upper()
+            self.__Respond(line, "OK\r\n>")
+        elif "#info" == name:
+            text = "Echologger EU400D\r\n S/W Ver: 4.12 build\r\n"
+            for command, value in self.values.items():
+                text += " - %s [ %s%s ] description\r\n" % (command, value, self.units[command])
+            text += "High Frequency: %dHz\r\nLow Frequency: %dHz\r\n" % (self.frequencies["H"], self.frequencies["L"])
+            self.__Respond(line, text + "OK\r\n>")
+        elif name not in self.values:
+            self.__Respond(line, "Invalid command\r\n>")
+        elif 1 == len(parts):
+            self.__Respond(line, " - %s [ %s%s ] description\r\nOK\r\n>" % (name, self.values[name], self.units[name]))
+        else:
+            try:
+                float(parts[1])
+            except ValueError:
+                self.__Respond(line, "Invalid argument\r\n>")
+                return
+            self.values[name] = parts[1]
+            self.__Respond(line, "OK\r\n>")
+
+    # serial.Serial interface
+
+    @property
+    def in_waiting(self):
+        with self._condition:
+            return len(self._rx)
+
+    def read(self, size = 1):
+        deadline = time.monotonic() + (self.timeout if None != self.timeout else 1e9)
+        with self._condition:
+            while len(self._rx) < size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            data = bytes(self._rx[:size])
+            del self._rx[:size]
+            return data
+
+    def write(self, data):
+        if True == self.dead:
+            return len(data)
+        for ch in data.decode("latin_1"):
+            if '\r' == ch:
+                line = self._command.strip()
+                self._command = ""
+                self.__Execute(line)
+            else:
+                self._command += ch
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def reset_input_buffer(self):
+        with self._condition:
+            self._rx.clear()
+
+    def open(self):
+        self.is_open = True
+        if True == self._closed.is_set():
+            self._closed = threading.Event()
+            self._thread = threading.Thread(target = self.__Generate, name = "fake-unit", daemon = True)
+            self._thread.start()
+
+    def close(self):
+        self.is_open = False
+        self._closed.set()
+
+def Patch():
+    """! Context manager replacing serial.Serial by FakeUnit, yields the list of created units
+    """
+    units = []
+
+    def create(*args, **kwargs):
+        unit = FakeUnit(*args, **kwargs)
+        units.append(unit)
+        return unit
+
+    class _Patch():
+        def __enter__(self):
+            self._patch = mock.patch("serial.Serial", create)
+            self._patch.start()
+            return units
+
+        def __exit__(self, *args):
+            self._patch.stop()
+
+    return _Patch()
@@ -0,0 +1,114 @@
+# Copyright (c) EofE Ultrasonics Co., Ltd., 2024
+import threading
+import time
+import unittest
+
+from echobus import StreamBus, StreamChunk, PolicyBlock, PolicyDropNewest, PolicyDropOldest
+
+def Chunk(i):
+    return StreamChunk(float(i), b"$SDDBT,%d\r\n" % i)
+
+def Drain(subscriber):
+    chunks = []
+    while False == subscriber.IsClosed():
+        chunk = subscriber.Get(0.1)
+        if None == chunk:
+            break
+        chunks.append(chunk)
+    return [chunk.time for chunk in chunks]
+
+class ScriptedSource():
+    """! ReadAvailable() returns the scripted chunks, then raises the error
+    """
+    def __init__(self, chunks, error):
+        self.chunks = list(chunks)
+        self.error = error
+
+    def ReadAvailable(self, maxbytes = 4096, timeout = 1.0):
+        if len(self.chunks) > 0:
+            return self.chunks.pop(0)
+        raise self.error
+
+class TestPolicies(unittest.TestCase):
+    def setUp(self):
+        self.bus = StreamBus(None)
+
+    def test_drop_newest(self):
+        subscriber = self.bus.Subscribe("newest", maxsize = 3, policy = PolicyDropNewest)
+        for i in range(5):
+            self.bus.Publish(Chunk(i))
+        self.assertEqual({ "published": 5, "delivered": 0, "dropped": 2, "lag": 3, "high_water": 3, "errors": 0 },
+                         subscriber.GetStats())
+        self.assertEqual([0.0, 1.0, 2.0], Drain(subscriber))
+        self.assertEqual(3, subscriber.GetStats()["delivered"])
+
+    def test_drop_oldest(self):
+        subscriber = self.bus.Subscribe("oldest", maxsize = 3, policy = PolicyDropOldest)
+        for i in range(5):
+            self.bus.Publish(Chunk(i))
+        self.assertEqual(2, subscriber.GetStats()["dropped"])
+        self.assertEqual([2.0, 3.0, 4.0], Drain(subscriber))
+
+    def test_block(self):
+        subscriber = self.bus.Subscribe("block", maxsize = 2, policy = PolicyBlock)
+        fast = self.bus.Subscribe("fast", maxsize = 10, policy = PolicyDropOldest)
+        publisher = threading.Thread(target = lambda: [self.bus.Publish(Chunk(i)) for i in range(5)])
+        publisher.start()
+        time.sleep(0.2)
+        self.assertTrue(publisher.is_alive())        # waits for the blocking subscriber
+        self.assertEqual(2, subscriber.GetStats()["lag"])
+
+        received = []
+        while len(received) < 5:
+            received.append(subscriber.Get(1.0).time)
+        publisher.join(1.0)
+        self.assertFalse(publisher.is_alive())
+        self.assertEqual([0.0, 1.0, 2.0, 3.0, 4.0], received)
+        stats = subscriber.GetStats()
+        self.assertEqual((5, 5, 0, 2), (stats["published"], stats["delivered"], stats["dropped"], stats["high_water"]))
+        self.assertEqual(5, fast.GetStats()["lag"])
+
+    def test_unknown_policy(self):
+        self.assertRaises(ValueError, self.bus.Subscribe, "bad", policy = "drop-all")
+
+class TestStreamBus(unittest.TestCase):
+    def test_max_errors(self):
+        bus = StreamBus(None)
+        calls = []
+
+        def fail(chunk):
+            calls.append(chunk.time)
+            raise RuntimeError("disk full")
+
+        subscriber = bus.Subscribe("failing", maxsize = 1, policy = PolicyBlock, callback = fail, max_errors = 3)
+        other = bus.Subscribe("other", maxsize = 100)
+        for i in range(10): # never blocked by the failing subscriber after it is shut down
+            bus.Publish(Chunk(i))
+        deadline = time.monotonic() + 2.0
+        while False == subscriber.IsClosed() and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        self.assertTrue(subscriber.IsClosed())
+        self.assertEqual([0.0, 1.0, 2.0], calls)
+        stats = subscriber.GetStats()
+        self.assertEqual((3, 0), (stats["errors"], stats["lag"]))
+        self.assertEqual(stats["published"], stats["delivered"] + stats["dropped"])
+        self.assertEqual("disk full", str(subscriber.GetError()))
+        self.assertEqual(["other"], list(bus.GetStats()["subscribers"].keys()))
+        self.assertEqual(10, other.GetStats()["lag"])
+        bus.Stop(1.0)
+
+    def test_reader_error(self):
+        bus = StreamBus(ScriptedSource([b"$SDDBT,1\r\n", b"", b"$SDDBT,2\r\n"], OSError("port lost")))
+        received = []
+        subscriber = bus.Subscribe("raw", callback = received.append)
+        bus.Start()
+        bus.Stop(2.0)
+        self.assertFalse(bus.IsRunning())
+        self.assertEqual("port lost", str(bus.GetError()))
+        self.assertEqual([b"$SDDBT,1\r\n", b"$SDDBT,2\r\n"], [chunk.data for chunk in received])
+        self.assertTrue(subscriber.IsClosed())
+        self.assertEqual({ "chunks": 2, "bytes": 20 }, { key: bus.GetStats()[key] for key in ("chunks", "bytes") })
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+# Copyright (c) EofE Ultrasonics Co., Ltd., 2024
+import calendar
+import random
+import time
+import unittest
+
+from fakeunit import Sentence
+from echoclock import ClockModel
+
+class ClockedEchosounder():
+    """! Echosounder which only counts SetCurrentTime() calls
+    """
+    def __init__(self):
+        self.resyncs = 0
+
+    def SetCurrentTime(self):
+        self.resyncs += 1
+        return True
+
+def Samples(offset, drift, seconds, rate = 10.0, jitter = 0.05, seed = 1):
+    """! Synthetic (unit UTC, host monotonic) pairs: the host clock is ahead by offset at the first sample and
+        the unit clock loses drift seconds per second, every sentence is late by 0..jitter seconds
+    """
+    generator = random.Random(seed)
+    wall = time.time() - time.monotonic()
+    origin = 1.7e9
+    for i in range(int(seconds * rate)):
+        unit = origin + i / rate
+        host = unit + offset + drift * (unit - origin) + generator.uniform(0.0, jitter)
+        yield unit, host - wall
+
+class TestClockModel(unittest.TestCase):
+    def test_offset_and_drift(self):
+        model = ClockModel()
+        self.assertFalse(model.IsValid())
+        self.assertEqual(None, model.UnitToHost(1.7e9))
+        for unit, host in Samples(offset = 0.25, drift = 50e-6, seconds = 1000):
+            model.AddSample(unit, host)
+
+        self.assertTrue(model.IsValid())
+        self.assertAlmostEqual(50e-6, model.GetDrift(), delta = 2e-6)
+        self.assertAlmostEqual(0.25, model.GetOffset(), delta = 0.01)     # lower envelope, not the mean delay
+        self.assertAlmostEqual(0.25 + 50e-6 * 1000, model.GetError(), delta = 0.01)
+        utc, monotonic = model.UnitToHost(1.7e9 + 500.0)
+        self.assertAlmostEqual(1.7e9 + 500.0 + 0.25 + 50e-6 * 500.0, utc, delta = 0.01)
+        self.assertAlmostEqual(utc - time.time() + time.monotonic(), monotonic, delta = 0.01)
+
+    def test_resync(self):
+        ss = ClockedEchosounder()
+        model = ClockModel(ss, resync_threshold = 1.0)
+        samples = Samples(offset = 0.2, drift = 1e-3, seconds = 1000) # error crosses 1 s after about 800 s
+        for unit, host in samples:
+            model.AddSample(unit, host)
+            if unit - 1.7e9 >= 700.0:
+                break
+        self.assertFalse(model.NeedsResync())
+        self.assertFalse(model.CheckResync())
+        self.assertEqual(0, ss.resyncs)
+
+        for unit, host in samples:
+            model.AddSample(unit, host)
+            if unit - 1.7e9 >= 900.0:
+                break
+        self.assertTrue(model.NeedsResync())
+        self.assertTrue(model.CheckResync())
+        self.assertEqual(1, ss.resyncs)
+        self.assertFalse(model.IsValid()) # the fit starts again after the unit time was set
+        self.assertFalse(model.CheckResync())
+        self.assertEqual(1, ss.resyncs)
+
+    def test_zda_lines(self):
+        model = ClockModel()
+        origin = calendar.timegm((2024, 5, 17, 12, 30, 0))
+        wall = time.time() - time.monotonic()
+        for i in range(20):
+            unit = origin + i * 0.5
+            stamp = time.gmtime(unit)
+            line = Sentence("SDZDA,%02d%02d%05.2f,%02d,%02d,%04d,00,00" % (stamp.tm_hour, stamp.tm_min, stamp.tm_sec + unit % 1,
+                                                                          stamp.tm_mday, stamp.tm_mon, stamp.tm_year))
+            self.assertEqual(unit, model.AddLine(line.strip(), unit + 2.0 - wall))
+        self.assertEqual(None, model.AddLine("$SDDBT,8.20,f,2.50,M,1.37,F*00", 0.0))
+        self.assertAlmostEqual(2.0, model.GetOffset(), delta = 1e-3)
+        self.assertAlmostEqual(0.0, model.GetDrift(), delta = 1e-6)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+# Copyright (c) EofE Ultrasonics Co., Ltd., 2024
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from echoconvert import ConvertTree, FindGaps, IsConverted
+from echoexport import LoadColumns
+from echonmea import Ping
+
+Root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def Pings(frequency, times):
+    return [Ping(frequency, time, 2.0, 2.0, 20.0, 0.0, 0.0, 10.0) for time in times]
+
+class TestConvertTree(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.input = os.path.join(self.directory, "input")
+        self.output = os.path.join(self.directory, "output")
+        os.makedirs(os.path.join(self.input, "day1"))
+        self.source = os.path.join(self.input, "day1", "sonar_log.txt")
+        shutil.copy(os.path.join(Root, "sonar_log.txt"), self.source)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_convert_twice(self):
+        target = os.path.join(self.output, "day1", "sonar_log")
+        self.assertFalse(IsConverted(self.source, target))
+        results, skipped, errors = ConvertTree(self.input, self.output, "npz", jobs = 1, pattern = "*.txt")
+        self.assertEqual(([], 0, 1), (errors, skipped, len(results)))
+        stats = results[0]
+        self.assertGreater(stats["pings"], 0)
+        self.assertEqual(set(("200000", "30000")), set(stats["frequencies"].keys()))
+        self.assertEqual(target + ".npz", stats["output"])
+        with open(target + ".json", "r", encoding = "utf-8") as f:
+            self.assertEqual(stats["pings"], json.load(f)["pings"])
+        self.assertEqual(stats["pings"], len(LoadColumns(target + ".npz")[0]["depth"]))
+        self.assertTrue(IsConverted(self.source, target))
+
+        # second run skips the converted file
+        self.assertEqual(([], 1, []), ConvertTree(self.input, self.output, "npz", jobs = 1, pattern = "*.txt"))
+
+        # changed source, missing output or force convert it again
+        with open(self.source, "ab") as f:
+            f.write(b"#F 200000 Hz*55\r\n")
+        self.assertFalse(IsConverted(self.source, target))
+        self.assertEqual(1, len(ConvertTree(self.input, self.output, "npz", jobs = 1, pattern = "*.txt")[0]))
+        os.remove(target + ".npz")
+        self.assertFalse(IsConverted(self.source, target))
+        self.assertEqual(1, len(ConvertTree(self.input, self.output, "npz", jobs = 1, pattern = "*.txt")[0]))
+        self.assertEqual(1, len(ConvertTree(self.input, self.output, "npz", jobs = 1, pattern = "*.txt", force = True)[0]))
+        self.assertEqual(0, len([name for name in os.listdir(os.path.dirname(target)) if name.endswith(".tmp")]))
+
+class TestFindGaps(unittest.TestCase):
+    def test_gaps(self):
+        pings = Pings(200000, [0.0, 0.5, 1.0, 5.0, 5.5]) + Pings(30000, [0.25, 1.25, 2.25, 3.25])
+        pings.sort(key = lambda ping: ping.time)
+        self.assertEqual([(1.0, 5.0)], FindGaps(pings, 2.0)) # frequencies are checked separately
+        self.assertEqual([(1.0, 5.0)], FindGaps(pings, 1.5))
+        self.assertEqual([(0.25, 1.25), (1.25, 2.25), (2.25, 3.25), (1.0, 5.0)], FindGaps(pings, 0.75)) # in order of the ping ending them
+
+    def test_time_jump_and_missing_time(self):
+        pings = Pings(200000, [10.0, 10.5, None, 3.0, 3.5]) # unit clock was set back
+        self.assertEqual([(10.5, 3.0)], FindGaps(pings, 2.0))
+        self.assertEqual([], FindGaps(Pings(200000, [None, None]), 2.0))
+        self.assertEqual([], FindGaps([], 2.0))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,198 @@
+# Copyright (c) EofE Ultrasonics Co., Ltd., 2024
+import time
+import unittest
+
+import fakeunit
+from echosndr import DualEchosounder, EchosounderState
+
+class TestStates(unittest.TestCase):
+    def setUp(self):
+        with fakeunit.Patch() as units:
+            self.ss = DualEchosounder("fake", 115200)
+        self.unit = units[0]
+        self.states = []
+        write = self.unit.write
+
+        def record(data): # protocol state at every command line sent to the unit
+            if data.endswith(b'\r') and len(data.strip()) > 0:
+                self.states.append((data.strip().decode("latin_1"), self.ss.GetState()))
+            return write(data)
+
+        self.unit.write = record
+
+    def tearDown(self):
+        self.unit.close()
+
+    def test_command_while_running(self):
+        self.assertEqual(EchosounderState.Idle, self.ss.GetState())
+        self.assertTrue(self.ss.Start())
+        self.assertEqual(EchosounderState.Running, self.ss.GetState())
+        self.assertGreater(len(self.ss.ReadAvailable(timeout = 1.0)), 0)
+
+        detects = self.unit.detects
+        del self.states[:]
+        self.assertEqual(1, self.ss.SendCommand("IdSetHighFreq"))
+
+        # Running -> Commanding (stopped by '\r' and the prompt, no "#speed") -> restarted by "#go"
+        self.assertEqual([("#setfh", EchosounderState.Commanding), ("#go", EchosounderState.Commanding)], self.states)
+        self.assertEqual(detects, self.unit.detects)
+        self.assertEqual(1, self.unit.stops)
+        self.assertEqual(EchosounderState.Running, self.ss.GetState())
+        self.assertTrue(self.unit.running)
+
+        # Running -> Idle
+        self.assertTrue(self.ss.Stop(redetect = False))
+        self.assertEqual(EchosounderState.Idle, self.ss.GetState())
+        self.assertFalse(self.unit.running)
+        self.assertEqual(detects, self.unit.detects)
+
+        # Idle -> Commanding -> Idle, nothing to stop
+        del self.states[:]
+        self.assertTrue(self.ss.SetValue("IdRange", "20000"))
+        self.assertEqual([("#range 20000", EchosounderState.Commanding)], self.states)
+        self.assertEqual(EchosounderState.Idle, self.ss.GetState())
+        self.assertEqual(2, self.unit.stops)
+        self.assertEqual(detects, self.unit.detects)
+
+class TestReadAvailable(unittest.TestCase):
+    def setUp(self):
+        with fakeunit.Patch() as units:
+            self.ss = DualEchosounder("fake", 115200, port_timeout = 2.0)
+        self.unit = units[0]
+
+    def tearDown(self):
+        self.unit.close()
+
+    def test_returns_within_timeout(self):
+        self.assertTrue(self.ss.Start())
+        self.unit.stall = True
+        self.ss.ReadAvailable(timeout = 0.3)
+        self.unit.Emit("$SDDBT,8.20,f,2.50") # incomplete line, the rest never comes
+
+        start = time.monotonic()
+        self.assertEqual(b"", self.ss.ReadAvailable(timeout = 0.2))
+        self.assertLess(time.monotonic() - start, 0.5) # not the 2 seconds of the port timeout
+        self.assertEqual(2.0, self.unit.timeout)       # port timeout is restored
+
+        self.unit.Emit(",M,1.37,F*00\r\n")
+        self.assertEqual(b"$SDDBT,8.20,f,2.50,M,1.37,F*00\r\n", self.ss.ReadAvailable(timeout = 0.2))
+
+class TestPipelining(unittest.TestCase):
+    def setUp(self):
+        with fakeunit.Patch() as units:
+            self.ss = DualEchosounder("fake", 115200)
+        self.unit = units[0]
+        self.writes = []
+        write = self.unit.write
+
+        def record(data): # command lines of every write
+            self.writes.append(data.decode("latin_1").count('\r'))
+            return write(data)
+
+        self.unit.write = record
+        self.values = [("IdRangeH", "20000"), ("IdGainH", "3.5"), ("IdGainL", "-2"), ("IdInterval", "0.2"),
+                       ("IdThreshold", "20"), ("IdOffset", "10"), ("IdSound", "1480"), ("IdTxLengthH", "50")]
+
+    def tearDown(self):
+        self.unit.close()
+
+    def count(self, text):
+        return len([line for line in self.unit.lines if line.split()[0] == text])
+
+    def test_mixed_results(self):
+        del self.unit.values["#gainl"] # unit without this command
+        results = self.ss.SetValues([("IdRangeH", "20000"), ("IdGainH", "high"), ("IdGainL", "-2"), ("IdBogus", "1"),
+                                     ("IdInterval", "0.2")])
+        self.assertEqual([1, 2, 3, -1, 1], results)
+        self.assertEqual(["#rangeh 20000", "#gainh high", "#gainl -2", "#interval 0.2"], self.unit.lines[-4:])
+        self.assertEqual([4], self.writes)  # all in one write, nothing repeated in lockstep
+        self.assertEqual("20000", self.ss.GetValue("IdRangeH"))
+        self.assertNotEqual("high", self.ss.GetValue("IdGainH"))
+
+    def test_window_refill(self):
+        results = self.ss.SetValues(self.values, window = 3)
+        self.assertEqual([1] * 8, results)
+        self.assertEqual([3, 3, 2], self.writes)   # window refilled as responses came in, nothing repeated
+        self.assertEqual("1480", self.unit.values["#sound"])
+        for Command, Value in self.values:
+            self.assertEqual(Value, self.ss.GetValue(Command))
+
+    def test_ambiguous_fallback(self):
+        self.unit.replies["#gainl"] = "OK go\r\n" # unexpected response
+        results = self.ss.SetValues(self.values)
+        self.assertEqual([1] * 8, results)
+        self.assertEqual(1, self.count("#rangeh"))  # matched before the ambiguous response
+        self.assertEqual(1, self.count("#gainh"))
+        self.assertEqual(2, self.count("#gainl"))   # repeated one by one
+        self.assertEqual(2, self.count("#txlengthh"))
+        self.assertEqual(8, self.writes[0])
+        self.assertEqual([1] * 6, self.writes[1:])
+
+    def test_lost_reply(self):
+        self.unit.lose.add("#gainl")
+        start = time.monotonic()
+        results = self.ss.SetValues(self.values, window = 4)
+        self.assertLess(time.monotonic() - start, 2.0) # detected by the echo of the next command, not by timeout
+        self.assertEqual([1] * 8, results)
+        self.assertEqual(1, self.count("#gainh"))
+        self.assertEqual(2, self.count("#gainl"))   # the OK of "#interval" is not taken for "#gainl"
+        self.assertEqual("-2", self.unit.values["#gainl"])
+        self.assertEqual(1, self.ss.SetValues([("IdGainL", "-3")], pipelined = False)[0])
+
+class TestQueries(unittest.TestCase):
+    def open(self, lazy):
+        with fakeunit.Patch() as units:
+            self.ss = DualEchosounder("fake", 115200, lazy = lazy)
+        self.unit = units[0]
+        self.writes = []
+        write = self.unit.write
+
+        def record(data):
+            self.writes.append(data.decode("latin_1"))
+            return write(data)
+
+        self.unit.write = record
+
+    def tearDown(self):
+        self.unit.close()
+
+    def test_query_values(self):
+        self.open(lazy = False)
+        self.unit.values["#rangeh"] = "30000" # changed behind the back of the host
+        self.unit.values["#gainh"] = "-3.5"
+        results = self.ss.QueryValues(["IdRangeH", "IdGainH", "IdInterval", "IdBogus", "IdGo"])
+
+        self.assertEqual({ "IdRangeH": "30000", "IdGainH": "-3.5", "IdInterval": "0.05", "IdBogus": None, "IdGo": None },
+                         results)
+        self.assertEqual(["#rangeh\r#gainh\r#interval\r"], self.writes) # one round trip for the batch
+        self.assertEqual("30000", self.ss.GetValue("IdRangeH"))
+        self.assertEqual({ "IdBogus": None }, self.ss.QueryValues(["IdBogus"]))
+        self.assertEqual(1, len(self.writes))                           # nothing sent for unknown ids
+
+        del self.writes[:]
+        self.unit.values["#sound"] = "1480"
+        self.assertEqual("1480", self.ss.QueryValue("IdSound"))
+        self.assertEqual(["#sound\r"], self.writes)
+        self.assertEqual(None, self.ss.QueryValue("IdBogus"))
+
+    def test_lazy_info_once(self):
+        self.open(lazy = True)
+        self.assertEqual([], self.writes)                               # nothing sent before the first request
+        self.assertEqual("50000", self.ss.GetValue("IdRangeH"))
+        self.assertEqual(1, self.unit.lines.count("#info"))
+        self.assertEqual("0.05", self.ss.GetValue("IdInterval"))
+        self.assertRaises(KeyError, self.ss.GetValue, "IdGo")           # no value, "#info" is not read again
+        self.assertRaises(KeyError, self.ss.GetValue, "IdBogus")
+        self.assertEqual(1, self.unit.lines.count("#info"))
+
+    def test_lazy_settings_snapshot(self):
+        with fakeunit.Patch() as units:
+            self.ss = DualEchosounder("fake", 115200, lazy = True, settings = { "IdRangeH": "20000" })
+        self.unit = units[0]
+        self.assertEqual("20000", self.ss.GetValue("IdRangeH"))          # known value, no "#info"
+        self.assertEqual([], self.unit.lines)
+        self.assertEqual("0.0", self.ss.GetValue("IdGainH"))
+        self.assertEqual(["#speed", "#info"], self.unit.lines)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+# Copyright (c) EofE Ultrasonics Co., Ltd., 2024
+import math
+import os
+import random
+import tempfile
+import unittest
+
+from echoexport import ColumnarSink, LoadColumns
+from echofusion import FusedColumns, FusionStage, FuseColumns
+from echonmea import Ping
+
+def _Pings(count, seed):
+    """! Dual frequency pings with lost pings, repeated frequencies, missing times, depths and EMA
+    """
+    rng = random.Random(seed)
+    pings = []
+    t = 1700000000.0
+    for i in range(count):
+        t += rng.choice((0.05, 0.1, 0.1, 0.1, 0.7))
+        frequency = rng.choice((200000, 30000)) if rng.random() < 0.3 else (200000 if 0 == i % 2 else 30000)
+        if rng.random() < 0.02:
+            frequency = 0
+        time = None if rng.random() < 0.03 else round(t, 2)
+        depth = None if rng.random() < 0.05 else rng.uniform(1.0, 20.0)
+        ema = None if rng.random() < 0.05 else rng.choice((0.0, rng.uniform(5.0, 40.0)))
+        pings.append(Ping(frequency, time, depth, depth, 20.0, 0.0, 0.0, ema))
+    return pings
+
+def _Same(a, b):
+    if None == a:
+        return math.isnan(b)
+    return a == b
+
+class TestFusion(unittest.TestCase):
+    def test_columns_match_stage(self):
+        pings = _Pings(5000, 1)
+        stage = FusionStage(tolerance = 0.2, max_difference = 8.0)
+        fused = stage.FeedPings(pings)
+        self.assertGreater(len(fused), 1000)
+        self.assertGreater(stage.GetStats()["unpaired"], 100)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "pings.npz")
+            sink = ColumnarSink(path, row_group = 1000)
+            sink.WritePings(pings)
+            sink.Close()
+            columns = FuseColumns(LoadColumns(path)[0], tolerance = 0.2, max_difference = 8.0)
+
+        self.assertEqual(len(fused), len(columns["time"]))
+        for i, pair in enumerate(fused):
+            for name in FusedColumns:
+                self.assertTrue(_Same(getattr(pair, name), columns[name][i].item()), (i, name, pair))
+
+    def test_empty(self):
+        columns = FuseColumns({ "frequency": [], "time": [], "depth": [], "ema": [] })
+        self.assertEqual(0, len(columns["time"]))
+
+if __name__ == "__main__":
+    unittest.main()
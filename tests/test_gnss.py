@@ -0,0 +1,134 @@
+# Copyright (c) EofE Ultrasonics Co., Ltd., 2024
+import calendar
+import math
+import time
+import unittest
+
+from fakeunit import Sentence
+from echognss import GeoMerger, GnssDecoder, InterpolatePositions, MergeStreams
+from echonmea import Ping
+
+Day = calendar.timegm((2025, 7, 16, 0, 0, 0))
+Start = Day + 86390.0 # track crosses midnight
+
+def Position(t):
+    """! Straight track: latitude and longitude in degrees at time t
+    """
+    return 59.5 + (t - Start) * 1e-4, 10.25 + (t - Start) * 2e-4
+
+def _Angle(value, degrees):
+    minutes = abs(value) % 1.0 * 60.0
+    return "%0*d%07.4f" % (degrees, int(abs(value)), minutes)
+
+def GnssLines(times, dropout):
+    """! RMC + GGA per second, no fix during dropout (start, end)
+    """
+    lines = []
+    for t in times:
+        stamp = time.gmtime(t)
+        hms = "%02d%02d%05.2f" % (stamp.tm_hour, stamp.tm_min, stamp.tm_sec + t % 1)
+        latitude, longitude = Position(t)
+        position = "%s,N,%s,E" % (_Angle(latitude, 2), _Angle(longitude, 3))
+        quality = 0 if dropout[0] < t < dropout[1] else 4
+        lines.append(Sentence("GPRMC,%s,%s,%s,5.0,45.0,%02d%02d%02d,,,A" % (hms, "V" if 0 == quality else "A", position,
+                                                                           stamp.tm_mday, stamp.tm_mon, stamp.tm_year % 100)))
+        lines.append(Sentence("GNGGA,%s,%s,%d,12,0.8,12.5,M,40.1,M,," % (hms, position, quality)))
+    return lines
+
+def PingStream(times):
+    return [Ping(200000, t, 5.0, 5.0, 20.0, 0.0, 0.0, 10.0) for t in times]
+
+class TestGnssDecoder(unittest.TestCase):
+    def test_decode(self):
+        decoder = GnssDecoder()
+        lines = GnssLines([Start + i for i in range(20)], (Start + 4.5, Start + 7.5))
+        lines.insert(3, lines[2][:-5] + "*00\r\n") # bad checksum
+        fixes = decoder.FeedLines(lines)
+
+        self.assertEqual([Start + i for i in range(20) if i not in (5, 6, 7)], [fix.time for fix in fixes])
+        self.assertEqual(Day + 86400.0, fixes[7].time) # midnight rollover, date from RMC
+        self.assertEqual(set([1]), set(fix.quality for fix in fixes)) # RMC first, GGA of the same epoch is a duplicate
+        for fix in fixes:
+            latitude, longitude = Position(fix.time)
+            self.assertAlmostEqual(latitude, fix.latitude, delta = 1e-5)
+            self.assertAlmostEqual(longitude, fix.longitude, delta = 1e-5)
+        self.assertEqual({ "sentences": 40, "bad_checksums": 1, "invalid": 6, "fixes": 17 }, decoder.GetStats())
+
+    def test_gga_needs_date(self):
+        gga = [line for line in GnssLines([Start, Start + 1.0], (0, 0)) if "GGA" in line]
+        self.assertEqual([], GnssDecoder().FeedLines(gga))
+        fixes = GnssDecoder(date = Start).FeedLines(gga)
+        self.assertEqual([Start, Start + 1.0], [fix.time for fix in fixes])
+        self.assertEqual((4, 12, 0.8, 12.5), fixes[0][3:])
+
+class TestGeoMerger(unittest.TestCase):
+    def setUp(self):
+        # 1 Hz fixes for 20 s with a dropout from 5 to 9 s (fixes 4 s apart), 5 Hz pings from -1 to 21 s
+        self.fixes = GnssDecoder().FeedLines(GnssLines([Start + i for i in range(21)], (Start + 5.5, Start + 8.5)))
+        self.pings = PingStream([Start + i * 0.2 + 0.1 for i in range(-5, 105)])
+
+    def check(self, soundings):
+        self.assertEqual(len(self.pings), len(soundings))
+        unpositioned = []
+        for sounding in soundings:
+            t = sounding.time - Start
+            if t < 0.0 or (5.0 < t < 9.0) or t > 20.0:
+                self.assertEqual((None, None), (sounding.latitude, sounding.longitude))
+                unpositioned.append(sounding.time)
+                continue
+            latitude, longitude = Position(sounding.time)
+            self.assertAlmostEqual(latitude, sounding.latitude, delta = 1e-5)
+            self.assertAlmostEqual(longitude, sounding.longitude, delta = 1e-5)
+            self.assertAlmostEqual(1.0, sounding.span)
+        self.assertEqual(5 + 20 + 5, len(unpositioned))
+        return unpositioned
+
+    def test_merge_streams(self):
+        soundings, merger = MergeStreams(self.pings, self.fixes, max_gap = 2.0)
+        self.check(soundings)
+        self.assertEqual([ping.time for ping in self.pings], sorted(sounding.time for sounding in soundings))
+        self.assertEqual({ "soundings": 110, "unpositioned": 30 }, merger.GetStats())
+        dropout = [sounding for sounding in soundings if 5.0 < sounding.time - Start < 9.0]
+        self.assertEqual(set([4.0]), set(sounding.span for sounding in dropout if None != sounding.span))
+
+    def test_streaming_any_order(self):
+        # fixes arrive 1 s before the pings of the same time during the first 10 s, then 1 s after them
+        arrivals = [(fix.time - 1.0 if fix.time < Start + 10.0 else fix.time + 1.0, 0, fix) for fix in self.fixes]
+        arrivals += [(ping.time, 1, ping) for ping in self.pings]
+        merger = GeoMerger(max_gap = 2.0)
+        soundings = []
+        for arrival, kind, item in sorted(arrivals, key = lambda arrival: arrival[:2]):
+            soundings.extend(merger.AddFix(item) if 0 == kind else merger.AddPing(item))
+        soundings.extend(merger.Flush())
+        self.check(soundings)
+        merged = MergeStreams(self.pings, self.fixes, max_gap = 2.0)[0]
+        positions = lambda soundings: sorted((sounding.time, sounding.latitude, sounding.longitude) for sounding in soundings
+                                             if None != sounding.latitude)
+        self.assertEqual(positions(merged), positions(soundings)) # same positions as the time ordered merge
+
+    def test_vectorized(self):
+        latitude, longitude = InterpolatePositions([ping.time for ping in self.pings], [fix.time for fix in self.fixes],
+                                                   [fix.latitude for fix in self.fixes], [fix.longitude for fix in self.fixes])
+        soundings = sorted(MergeStreams(self.pings, self.fixes, max_gap = 2.0)[0], key = lambda sounding: sounding.time)
+        for i, sounding in enumerate(soundings):
+            if None == sounding.latitude:
+                self.assertTrue(math.isnan(latitude[i]) and math.isnan(longitude[i]))
+            else:
+                self.assertAlmostEqual(sounding.latitude, latitude[i], places = 9)
+                self.assertAlmostEqual(sounding.longitude, longitude[i], places = 9)
+
+    def test_no_time_and_dateline(self):
+        merger = GeoMerger()
+        released = merger.AddPing(Ping(200000, None, 5.0, 5.0, 20.0, 0.0, 0.0, 10.0))
+        self.assertEqual(1, len(released))
+        self.assertEqual(None, released[0].latitude)
+
+        fixes = GnssDecoder(date = Start).FeedLines([Sentence("GPGGA,235950.00,0100.0000,S,17954.0000,E,1,8,1.0,0.0,M,0.0,M,,"),
+                                                     Sentence("GPGGA,235951.00,0100.0000,S,17954.0000,W,1,8,1.0,0.0,M,0.0,M,,")])
+        soundings = MergeStreams(PingStream([fixes[0].time + 0.25, fixes[0].time + 0.75]), fixes)[0]
+        self.assertAlmostEqual(179.95, soundings[0].longitude)
+        self.assertAlmostEqual(-179.95, soundings[1].longitude)
+        self.assertAlmostEqual(-1.0, soundings[0].latitude)
+
+if __name__ == "__main__":
+    unittest.main()
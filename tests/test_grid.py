@@ -0,0 +1,112 @@
+# Copyright (c) EofE Ultrasonics Co., Ltd., 2024
+import math
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+from echognss import Sounding
+from echogrid import DepthGrid, LocalProjection
+
+Products = ("count", "mean", "std", "min", "max")
+
+def Soundings(n, seed = 1):
+    """! Synthetic soundings on both sides of the origin, over several 4 x 4 cell tiles, some without depth
+    """
+    generator = random.Random(seed)
+    points = []
+    for i in range(n):
+        x = generator.uniform(-9.0, 13.0)
+        y = generator.uniform(-5.0, 7.0)
+        depth = float("nan") if 0 == i % 17 else 10.0 + 0.1 * x + generator.gauss(0.0, 0.5)
+        points.append((x, y, depth))
+    return points
+
+class TestDepthGrid(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.points = Soundings(2000)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def assertSameLayers(self, expected, grid):
+        self.assertEqual(expected.soundings, grid.soundings)
+        self.assertEqual(expected.GetTileKeys(), grid.GetTileKeys())
+        for name in Products:
+            layer, x, y = expected.GetLayer(name)
+            other, other_x, other_y = grid.GetLayer(name)
+            self.assertEqual((x, y), (other_x, other_y))
+            numpy.testing.assert_allclose(layer, other, rtol = 1e-9, atol = 1e-9, err_msg = name)
+
+    def reference(self):
+        grid = DepthGrid(1.0, tile_size = 4)
+        for x, y, depth in self.points:
+            grid.Add(x, y, depth)
+        return grid
+
+    def test_add(self):
+        grid = self.reference()
+        valid = [point for point in self.points if point[2] == point[2]]
+        self.assertEqual(len(valid), grid.soundings)
+        self.assertEqual(len(valid), int(grid.GetLayer("count")[0].sum()))
+
+        # one cell checked against numpy statistics
+        x, y, depth = valid[0]
+        cell = [d for px, py, d in valid if math.floor(px) == math.floor(x) and math.floor(py) == math.floor(y)]
+        layers = { name: grid.GetLayer(name) for name in Products }
+        layer, x0, y0 = layers["count"]
+        i, j = int(math.floor(y) - y0), int(math.floor(x) - x0)
+        self.assertEqual(len(cell), layers["count"][0][i, j])
+        self.assertAlmostEqual(numpy.mean(cell), layers["mean"][0][i, j], places = 9)
+        self.assertAlmostEqual(numpy.std(cell, ddof = 1), layers["std"][0][i, j], places = 9)
+        self.assertEqual((min(cell), max(cell)), (layers["min"][0][i, j], layers["max"][0][i, j]))
+        self.assertTrue(numpy.isnan(layers["mean"][0][layers["count"][0] == 0]).all())
+
+    def test_add_arrays(self):
+        grid = DepthGrid(1.0, tile_size = 4)
+        x, y, depth = (numpy.array(values) for values in zip(*self.points))
+        grid.AddArrays(x[:700], y[:700], depth[:700]) # batches on top of existing cells
+        grid.AddArrays(x[700:], y[700:], depth[700:])
+        self.assertSameLayers(self.reference(), grid)
+
+    def test_merge(self):
+        grid = DepthGrid(1.0, tile_size = 4)
+        parts = [DepthGrid(1.0, tile_size = 4) for i in range(3)]
+        for i, (x, y, depth) in enumerate(self.points):
+            parts[i % 3].Add(x, y, depth)
+        for part in parts:
+            grid.Merge(part)
+        self.assertSameLayers(self.reference(), grid)
+        self.assertRaises(ValueError, grid.Merge, DepthGrid(2.0, tile_size = 4))
+
+    def test_eviction(self):
+        grid = DepthGrid(1.0, tile_size = 4, directory = self.directory, max_tiles = 2)
+        for x, y, depth in self.points:
+            grid.Add(x, y, depth)
+        self.assertLessEqual(len(grid._tiles), 2)
+        self.assertGreater(len(grid._stored), 2)
+        self.assertSameLayers(self.reference(), grid)
+
+        # merge of evicted tiles into a grid that evicts too, then Save and Load
+        directory = os.path.join(self.directory, "merged")
+        merged = DepthGrid(1.0, tile_size = 4, directory = directory, max_tiles = 3)
+        merged.Merge(grid)
+        self.assertSameLayers(self.reference(), merged)
+        merged.Save()
+        self.assertSameLayers(self.reference(), DepthGrid.Load(directory, max_tiles = 1))
+
+    def test_soundings(self):
+        projection = LocalProjection(59.5, 10.25)
+        soundings = [Sounding(0.0, 59.5 + y / 111320.0, 10.25 + x / projection._mx, 200000, depth, None, 1, 1.0)
+                     for x, y, depth in self.points]
+        soundings.append(Sounding(0.0, None, None, 200000, 5.0, None, None, None))
+        grid = DepthGrid(1.0, tile_size = 4)
+        grid.AddSoundings(soundings, projection)
+        self.assertSameLayers(self.reference(), grid)
+
+if __name__ == "__main__":
+    unittest.main()
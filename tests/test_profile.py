@@ -0,0 +1,24 @@
+# Copyright (c) EofE Ultrasonics Co., Ltd., 2024
+import unittest
+
+from echoprofile import NormalizeValue, ProfileError
+
+class TestNormalizeValue(unittest.TestCase):
+    def test_range(self):
+        self.assertEqual("20000", NormalizeValue("IdRange", 20000.0))
+        self.assertEqual("0.5", NormalizeValue("IdInterval", " 0.5 "))
+        for value in ("far", 500, 1000.5, float("nan")):
+            self.assertRaises(ProfileError, NormalizeValue, "IdRange", value)
+
+    def test_zero_or_range(self):
+        self.assertEqual("0.0", NormalizeValue("IdOutrate", 0))
+        self.assertEqual("0.1", NormalizeValue("IdOutrate", "0.1"))
+        self.assertEqual("0", NormalizeValue("IdSamplFreq", 0))
+        self.assertEqual("6250", NormalizeValue("IdSamplFreq", 6250))
+        for Command, value in (("IdOutrate", 0.05), ("IdOutrate", 2.5), ("IdSamplFreq", 1000), ("IdSamplFreq", -1)):
+            with self.assertRaises(ProfileError) as context:
+                NormalizeValue(Command, value)
+            self.assertIn("out of range 0 or", str(context.exception))
+
+if __name__ == "__main__":
+    unittest.main()
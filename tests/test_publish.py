@@ -0,0 +1,131 @@
+# Copyright (c) EofE Ultrasonics Co., Ltd., 2024
+import socket
+import threading
+import time
+import unittest
+
+from echonmea import NmeaChecksum
+from echopublish import NmeaPublisher
+
+def _Sentence(body):
+    return "$%s*%02X" % (body, NmeaChecksum(body))
+
+def _Batches(count, size = 4):
+    """! Return list of batches of numbered depth sentences
+    """
+    return [[_Sentence("SDDBT,%d.0,f,%d.%03d,M,0.0,F" % (i, i, j)) for j in range(size)] for i in range(count)]
+
+def _Expected(batches):
+    return [sentence for batch in batches for sentence in batch]
+
+class _TcpReader(threading.Thread):
+    """! TCP client reading everything until the publisher closes the connection
+    """
+    def __init__(self, address, rcvbuf = None):
+        super().__init__(daemon = True)
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if None != rcvbuf:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+        self.socket.connect(address)
+        self.data = bytearray()
+
+    def run(self):
+        while True:
+            data = self.socket.recv(65536)
+            if 0 == len(data):
+                break
+            self.data += data
+        self.socket.close()
+
+    def Lines(self):
+        return self.data.decode("latin_1").splitlines()
+
+def _WaitClients(publisher, count, timeout = 5.0):
+    deadline = time.monotonic() + timeout
+    while publisher.GetClientCount() < count and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return publisher.GetClientCount()
+
+class TestNmeaPublisher(unittest.TestCase):
+    def test_udp_clients_receive_in_order(self):
+        receivers = []
+        for i in range(2):
+            receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            receiver.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+            receiver.bind(("127.0.0.1", 0))
+            receiver.settimeout(2.0)
+            receivers.append(receiver)
+
+        publisher = NmeaPublisher(udp_targets = [receiver.getsockname() for receiver in receivers], max_datagram = 200)
+        batches = _Batches(50)
+        for batch in batches:
+            self.assertEqual(len(batch), publisher.Publish(batch + ["#F 200000 Hz", "$SDDBT,bad*00"]))
+            time.sleep(0.001)
+        publisher.Stop()
+
+        for receiver in receivers:
+            lines = []
+            while len(lines) < len(_Expected(batches)):
+                datagram = receiver.recv(65536)
+                self.assertLessEqual(len(datagram), 200)
+                lines += datagram.decode("latin_1").splitlines()
+            receiver.close()
+            self.assertEqual(_Expected(batches), lines)
+        self.assertEqual(50, publisher.GetStats()["rejected"])
+
+    def test_tcp_clients_receive_in_order(self):
+        publisher = NmeaPublisher(tcp_port = 0, tcp_host = "127.0.0.1")
+        publisher.Start()
+        readers = [_TcpReader(publisher.GetTcpAddress()) for i in range(3)]
+        for reader in readers:
+            reader.start()
+        self.assertEqual(3, _WaitClients(publisher, 3))
+
+        batches = _Batches(500)
+        for batch in batches:
+            publisher.Publish(batch)
+        deadline = time.monotonic() + 5.0
+        total = len(b"".join(bytes(line + "\r\n", "latin_1") for line in _Expected(batches)))
+        while any(len(reader.data) < total for reader in readers) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        publisher.Stop()
+
+        for reader in readers:
+            reader.join(5.0)
+            self.assertEqual(_Expected(batches), reader.Lines())
+        self.assertEqual(0, publisher.GetStats()["dropped_clients"])
+
+    def test_slow_tcp_client_is_dropped(self):
+        publisher = NmeaPublisher(tcp_port = 0, tcp_host = "127.0.0.1", max_client_buffer = 1 << 20)
+        publisher.Start()
+        fast = _TcpReader(publisher.GetTcpAddress())
+        fast.start()
+        slow = socket.socket(socket.AF_INET, socket.SOCK_STREAM) # never reads
+        slow.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        slow.connect(publisher.GetTcpAddress())
+        self.assertEqual(2, _WaitClients(publisher, 2))
+
+        batches = _Batches(60000)
+        start = time.monotonic()
+        for batch in batches:
+            publisher.Publish(batch)
+        elapsed = time.monotonic() - start
+
+        deadline = time.monotonic() + 5.0
+        while publisher.GetClientCount() > 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(1, publisher.GetClientCount())
+        self.assertEqual(1, publisher.GetStats()["dropped_clients"])
+        self.assertLess(elapsed, 10.0)
+
+        total = len(b"".join(bytes(line + "\r\n", "latin_1") for line in _Expected(batches)))
+        deadline = time.monotonic() + 10.0
+        while len(fast.data) < total and time.monotonic() < deadline:
+            time.sleep(0.01)
+        publisher.Stop()
+        fast.join(5.0)
+        slow.close()
+        self.assertEqual(_Expected(batches), fast.Lines())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+# Copyright (c) EofE Ultrasonics Co., Ltd., 2024
+import os
+import random
+import tempfile
+import unittest
+
+import numpy
+
+from echonmea import Ping
+from echoexport import PingColumns
+from echopyramid import BuildPyramid, Pyramid, PyramidBuilder, PyramidChannels
+
+def _Pings(count, seed):
+    """! Time ordered dual frequency pings with gaps and missing values
+    """
+    rng = random.Random(seed)
+    pings = []
+    t = 1700000000.0
+    for i in range(count):
+        t += rng.choice((0.1, 0.1, 0.3, 5.0, 120.0)) if rng.random() < 0.1 else 0.1
+        frequency = 200000 if 0 == i % 2 else 30000
+        value = lambda low, high: None if rng.random() < 0.05 else rng.uniform(low, high)
+        pings.append(Ping(frequency, round(t, 2), value(1.0, 30.0), None, 20.0, value(-5.0, 5.0), value(-5.0, 5.0), value(0.0, 40.0)))
+    return pings
+
+def _Columns(pings):
+    columns = {}
+    for i, (name, dtype) in enumerate(PingColumns):
+        values = [numpy.nan if None == ping[i] else ping[i] for ping in pings]
+        columns[name] = numpy.array(values, dtype)
+    return columns
+
+class TestPyramid(unittest.TestCase):
+    def setUp(self):
+        self.pings = _Pings(20000, 2)
+        builder = PyramidBuilder(base = 0.5, levels = 12)
+        builder.AddPings(self.pings)
+        self.streaming = builder.Finish({ "IdInterval": "0.1" })
+        self.vectorized = BuildPyramid(_Columns(self.pings), base = 0.5, levels = 12, settings = { "IdInterval": "0.1" })
+
+    def assertSamePyramid(self, a, b):
+        self.assertEqual(a.GetFrequencies(), b.GetFrequencies())
+        for frequency in a.GetFrequencies():
+            for level in range(12):
+                for channel in PyramidChannels:
+                    first = a.GetLevel(frequency, level, channel)
+                    second = b.GetLevel(frequency, level, channel)
+                    for name in ("time", "count", "min", "max"):
+                        numpy.testing.assert_array_equal(first[name], second[name], err_msg = "%d %d %s %s" % (frequency, level, channel, name))
+                    numpy.testing.assert_allclose(first["mean"], second["mean"], rtol = 1e-12)
+
+    def test_vectorized_matches_streaming(self):
+        self.assertGreater(len(self.streaming.GetLevel(200000, 0, "depth")["time"]), 1000)
+        self.assertSamePyramid(self.streaming, self.vectorized)
+
+    def test_levels_aggregate_pings(self):
+        for frequency in (200000, 30000):
+            pings = [ping for ping in self.pings if ping.frequency == frequency and None != ping.depth]
+            for level in range(12):
+                series = self.streaming.GetLevel(frequency, level, "depth")
+                self.assertEqual(len(pings), series["count"].sum())
+                self.assertEqual(min(ping.depth for ping in pings), numpy.nanmin(series["min"]))
+                self.assertEqual(max(ping.depth for ping in pings), numpy.nanmax(series["max"]))
+
+    def test_query_window(self):
+        start = self.pings[5000].time
+        end = self.pings[15000].time
+        series = self.streaming.Query(200000, "depth", start, end, pixels = 100)
+        self.assertLessEqual(len(series["time"]), 2 * 100 + 2)
+        self.assertGreater(len(series["time"]), 10)
+        self.assertTrue(numpy.all(numpy.diff(series["time"]) > 0))
+
+    def test_save_load(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "survey.lod.npz")
+            self.streaming.Save(path)
+            loaded = Pyramid.Load(path)
+        self.assertEqual({ "IdInterval": "0.1" }, loaded.GetSettings())
+        self.assertSamePyramid(self.streaming, loaded)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+# Copyright (c) EofE Ultrasonics Co., Ltd., 2024
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import fakeunit
+from echoexport import LoadColumns
+from echorecord import Recorder, main
+from echorotate import RotatingRecorder
+from echosession import SupervisedSession
+from echosndr import DualEchosounder
+
+class TestRecorder(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        with fakeunit.Patch() as units:
+            self.ss = DualEchosounder("fake", 115200)
+        self.unit = units[0]
+        self.recorder = RotatingRecorder(self.directory, "sonar", compression = None)
+        self.recorder.Write(b"")
+        self.session = SupervisedSession(self.ss)
+
+    def tearDown(self):
+        self.unit.close()
+        shutil.rmtree(self.directory)
+
+    def test_stop_before_run(self):
+        loop = Recorder(self.session, self.recorder, self.directory, "fake")
+        self.assertTrue(self.session.Start())
+        loop.Stop() # e.g. SIGINT during startup
+        timer = threading.Timer(3.0, loop.Stop) # do not hang if the first Stop() is lost
+        timer.start()
+        start = time.monotonic()
+        self.assertEqual(None, loop.Run(timeout = 0.1))
+        timer.cancel()
+        self.assertLess(time.monotonic() - start, 1.0)
+        loop.Close()
+        self.assertFalse(self.ss.IsRunning())
+
+    def test_pending_ping_written(self):
+        loop = Recorder(self.session, self.recorder, self.directory, "fake", columnar = "npz")
+        self.assertTrue(self.session.Start())
+        timer = threading.Timer(0.6, loop.Stop)
+        timer.start()
+        self.assertEqual(None, loop.Run(timeout = 0.1))
+        loop.Close()
+        timer.join()
+
+        decoder = loop._monitor.GetDecoder("fake")
+        self.assertEqual(None, decoder.Flush()) # no ping block left behind in the decoder
+        decoded = decoder.GetStats()["pings"]
+        self.assertGreater(decoded, 0)
+        path = os.path.join(self.directory, [name for name in os.listdir(self.directory) if name.endswith(".npz")][0])
+        columns, settings = LoadColumns(path)
+        self.assertEqual(decoded, len(columns["depth"])) # the last ping block is flushed into the file too
+
+class TestMain(unittest.TestCase):
+    def test_invalid_profile(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "profile.json")
+            with open(path, "w") as f:
+                json.dump({ "IdRange": "far" }, f)
+            with fakeunit.Patch() as units:
+                self.assertEqual(1, main(["fake", "--dual", "--profile", path, "--output", directory]))
+            self.assertEqual([], units) # port is not opened
+            self.assertEqual(1, main(["fake", "--profile", os.path.join(directory, "missing.json")]))
+        finally:
+            shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,137 @@
+# Copyright (c) EofE Ultrasonics Co., Ltd., 2024
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from echorotate import RotatingRecorder
+
+def Line(i):
+    return b"$SDDBT,%05d,f,1.00,M,0.55,F\r\n" % i # 30 bytes
+
+class TestRotatingRecorder(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.manifest = os.path.join(self.directory, "sonar_manifest.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read(self, segment):
+        path = os.path.join(self.directory, segment["file"])
+        with (gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb")) as f:
+            return f.read()
+
+    def test_size_rotation(self):
+        recorder = RotatingRecorder(self.directory, "sonar", max_bytes = 100, max_seconds = None, compression = "gzip")
+        for i in range(10):
+            recorder.Write(Line(i))
+        recorder.Close()
+
+        segments = recorder.GetSegments()
+        self.assertEqual([120, 120, 60], [segment["bytes"] for segment in segments]) # rotated once 100 bytes reached
+        self.assertEqual(["compressed"] * 3, [segment["state"] for segment in segments])
+        self.assertEqual(b"".join(Line(i) for i in range(10)), b"".join(self.read(segment) for segment in segments))
+        self.assertEqual(sorted(segment["file"] for segment in segments),
+                         sorted(name for name in os.listdir(self.directory) if name.endswith(".gz")))
+        with open(self.manifest, "r", encoding = "utf-8") as f:
+            self.assertEqual(segments, json.load(f)["segments"])
+
+    def test_time_rotation(self):
+        recorder = RotatingRecorder(self.directory, "sonar", max_bytes = None, max_seconds = 0.2, compression = None)
+        recorder.Write(Line(0))
+        recorder.Write(Line(1))
+        time.sleep(0.25)
+        recorder.Write(Line(2))
+        current = recorder.GetCurrent()
+        recorder.Close()
+
+        segments = recorder.GetSegments()
+        self.assertEqual([60, 30], [segment["bytes"] for segment in segments])
+        self.assertEqual(current, segments[1]["file"])
+        self.assertTrue(segments[0]["file"].endswith("_0000.log") and segments[1]["file"].endswith("_0001.log"))
+        self.assertLessEqual(segments[0]["end"], segments[1]["start"])
+        self.assertEqual(["closed", "closed"], [segment["state"] for segment in segments])
+
+    def test_retention(self):
+        closed = []
+        recorder = RotatingRecorder(self.directory, "sonar", max_bytes = 30, compression = None, max_segments = 3,
+                                    on_closed = closed.append)
+        for i in range(6):
+            recorder.Write(Line(i))
+        recorder.Close()
+
+        segments = recorder.GetSegments()
+        self.assertEqual(["_0003.log", "_0004.log", "_0005.log"], [segment["file"][-9:] for segment in segments])
+        self.assertEqual(3, len([name for name in os.listdir(self.directory) if name.endswith(".log")]))
+        for segment in segments: # kept segments were handed over, removed ones possibly not
+            self.assertIn(os.path.join(self.directory, segment["file"]), closed)
+
+        budget = RotatingRecorder(self.directory, "sonar", max_bytes = 30, compression = None, disk_budget = 100)
+        for i in range(3):
+            budget.Write(Line(i))
+        budget.Close()
+        self.assertEqual(3, len(budget.GetSegments())) # 3 x 30 bytes within 100 bytes
+        self.assertEqual(["_0006.log", "_0007.log", "_0008.log"], [segment["file"][-9:] for segment in budget.GetSegments()])
+
+    def test_manifest_atomic(self):
+        recorder = RotatingRecorder(self.directory, "sonar", max_bytes = 30, compression = None)
+        errors = []
+        done = threading.Event()
+
+        def watch(): # the manifest is replaced, never seen half written
+            while False == done.is_set():
+                try:
+                    with open(self.manifest, "r", encoding = "utf-8") as f:
+                        json.load(f)
+                except FileNotFoundError:
+                    pass
+                except ValueError as e:
+                    errors.append(e)
+
+        watcher = threading.Thread(target = watch)
+        watcher.start()
+        for i in range(200):
+            recorder.Write(Line(i))
+            recorder.SetInfo("count", i)
+        recorder.Close()
+        done.set()
+        watcher.join()
+        self.assertEqual([], errors)
+        self.assertFalse(os.path.exists(self.manifest + ".tmp"))
+
+    def test_recover(self):
+        # previous run crashed: open segment half written, closed segment not compressed yet, one segment removed,
+        # manifest.tmp left behind half written
+        with open(os.path.join(self.directory, "sonar_a_0000.log"), "wb") as f:
+            f.write(Line(0))
+        with open(os.path.join(self.directory, "sonar_a_0001.log"), "wb") as f:
+            f.write(Line(1) + b"$SDDBT,0002,f,1.") # line cut by the crash
+        segments = [{ "file": "sonar_x_0000.log", "start": 1.0, "end": 2.0, "bytes": 30, "state": "removed" },
+                    { "file": "sonar_a_0000.log", "start": 3.0, "end": 4.0, "bytes": 30, "state": "closed" },
+                    { "file": "sonar_a_0001.log", "start": 5.0, "end": 5.0, "bytes": 0, "state": "open", "settings": { "IdRange": "20000" } }]
+        with open(self.manifest, "w", encoding = "utf-8") as f:
+            json.dump({ "prefix": "sonar", "compression": "gzip", "next_index": 3, "segments": segments }, f)
+        with open(self.manifest + ".tmp", "w", encoding = "utf-8") as f:
+            f.write('{"prefix": "sonar", "segm')
+
+        recorder = RotatingRecorder(self.directory, "sonar", compression = "gzip")
+        recorder.Write(Line(3))
+        recorder.Close()
+
+        segments = recorder.GetSegments()
+        self.assertEqual(["sonar_a_0000.log.gz", "sonar_a_0001.log.gz"], [segment["file"] for segment in segments[:2]])
+        self.assertEqual(["compressed"] * 3, [segment["state"] for segment in segments])
+        self.assertEqual(46, segments[1]["bytes"]) # size of the file, not of the stale manifest entry
+        self.assertEqual(Line(1) + b"$SDDBT,0002,f,1.", self.read(segments[1]))
+        self.assertEqual({ "IdRange": "20000" }, segments[1]["settings"])
+        self.assertTrue(segments[2]["file"].endswith("_0003.log.gz")) # numbering continues
+        self.assertEqual(Line(3), self.read(segments[2]))
+        self.assertFalse(os.path.exists(self.manifest + ".tmp"))
+
+if __name__ == "__main__":
+    unittest.main()
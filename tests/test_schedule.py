@@ -0,0 +1,53 @@
+# Copyright (c) EofE Ultrasonics Co., Ltd., 2024
+import unittest
+
+import fakeunit
+from echoschedule import FrequencyScheduler, ParsePattern, PlanSchedule
+from echosndr import DualEchosounder
+
+class TestPlan(unittest.TestCase):
+    def test_parse(self):
+        self.assertEqual([("H", 3), ("L", 1)], ParsePattern("HHHL"))
+        self.assertEqual([("H", 3), ("L", 1)], ParsePattern([("H", 3), ("L", 1)]))
+        self.assertEqual([("L", 2), ("H", 3)], ParsePattern("LHHHL"))
+        for pattern in ("", "X", [("H", 0)]):
+            self.assertRaises(ValueError, ParsePattern, pattern)
+
+    def test_cheapest_plan(self):
+        self.assertEqual([("H", None)], PlanSchedule(ParsePattern("HHH")))
+        self.assertEqual([("D", None)], PlanSchedule(ParsePattern("HLHL")))
+        self.assertEqual([("D", None)], PlanSchedule(ParsePattern("D")))
+        self.assertEqual([("H", 3), ("L", 1)], PlanSchedule(ParsePattern("HHHL")))
+
+class TestScheduler(unittest.TestCase):
+    def setUp(self):
+        with fakeunit.Patch() as units:
+            self.ss = DualEchosounder("fake", 115200)
+        self.unit = units[0]
+
+    def tearDown(self):
+        self.unit.close()
+
+    def test_switch_does_not_detect(self):
+        detects = self.unit.detects
+        scheduler = FrequencyScheduler(self.ss, "HHHL", interval = 0.05)
+        report = scheduler.Run(cycles = 3)
+
+        self.assertEqual(detects, self.unit.detects) # no Detect() ("#speed") at any switch
+        self.assertEqual(6, report["switches"])
+        self.assertGreaterEqual(self.unit.stops, 5)  # stopped by '\r' at the run boundaries
+        self.assertEqual(["#setfh", "#go", "#setfl", "#go"], [line for line in self.unit.lines if line in ("#setfh", "#setfl", "#go")][:4])
+        pings = report["per_frequency"]
+        self.assertGreaterEqual(pings[200000]["pings"], 9)
+        self.assertGreaterEqual(pings[30000]["pings"], 3)
+        self.assertAlmostEqual(0.75 / 0.05, pings[200000]["requested_rate"])
+        self.assertFalse(self.ss.IsRunning())
+
+    def test_free_running_plan(self):
+        report = FrequencyScheduler(self.ss, "HL", interval = 0.05).Run(duration = 0.5)
+        self.assertEqual(1, report["switches"])
+        self.assertIn("#setfd", self.unit.lines)
+        self.assertEqual(set((200000, 30000)), set(report["per_frequency"].keys()))
+
+if __name__ == "__main__":
+    unittest.main()
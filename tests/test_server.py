@@ -0,0 +1,95 @@
+# Copyright (c) EofE Ultrasonics Co., Ltd., 2024
+import threading
+import time
+import unittest
+
+from echoserver import ControlClient, ControlError, ControlServer
+
+class SlowEchosounder():
+    """! Echosounder whose Start() blocks until released, other methods return at once
+    """
+    def __init__(self):
+        self.release = threading.Event()
+        self.values = []
+
+    def Start(self):
+        self.release.wait(10.0)
+        return True
+
+    def IsRunning(self):
+        return False
+
+    def SetValue(self, Command, Value):
+        return [1] == self.SetValues([(Command, Value)])
+
+    def SetValues(self, values):
+        self.values.append(list(values))
+        return [1] * len(values)
+
+    def ReadAvailable(self, maxbytes = 4096, timeout = 1.0):
+        time.sleep(timeout)
+        return b""
+
+class TestControlServer(unittest.TestCase):
+    def setUp(self):
+        self.ss = SlowEchosounder()
+        self.server = ControlServer(self.ss, ("127.0.0.1", 0), request_timeout = 0.3)
+        self.server.Start()
+
+    def tearDown(self):
+        self.ss.release.set()
+        self.server.Stop()
+
+    def test_merged_set_values(self):
+        client = ControlClient(self.server.GetAddress(), timeout = 5.0)
+        try:
+            self.assertEqual(True, client.SetValue("IdGainH", "3"))
+            self.assertEqual([1, 1], client.SetValues({ "IdRange": "20000", "IdGain": "2" }))
+            self.assertEqual(False, client.IsRunning())
+        finally:
+            client.Close()
+
+    def test_request_timeout(self):
+        client = ControlClient(self.server.GetAddress(), timeout = 5.0)
+        try:
+            start = time.monotonic()
+            with self.assertRaises(ControlError) as context:
+                client.Start() # the worker is busy longer than request_timeout
+            self.assertIn("no result within", str(context.exception))
+            self.assertLess(time.monotonic() - start, 2.0)
+
+            # a queued request that timed out is not executed later
+            self.assertRaises(ControlError, self.server.Call, "SetValue", "IdGain", "1")
+            self.ss.release.set()
+            time.sleep(0.1)
+            self.assertEqual([], self.ss.values)
+            self.assertEqual(False, client.IsRunning())
+        finally:
+            client.Close()
+
+    def test_stop_fails_pending(self):
+        self.server._request_timeout = 5.0
+        errors = []
+
+        def call(method):
+            try:
+                self.server.Call(method)
+            except ControlError as e:
+                errors.append(str(e))
+
+        threads = [threading.Thread(target = call, args = (method,)) for method in ("Start", "IsRunning")]
+        for thread in threads:
+            thread.start()
+            time.sleep(0.1) # "Start" occupies the worker, "IsRunning" is pending
+
+        start = time.monotonic()
+        self.server.Stop()
+        threads[1].join(5.0)
+        self.assertLess(time.monotonic() - start, 2.0)
+        self.assertEqual(["Server stopped"], errors)
+        self.assertRaises(ControlError, self.server.Call, "IsRunning")
+        self.ss.release.set()
+        threads[0].join(5.0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+# Copyright (c) EofE Ultrasonics Co., Ltd., 2024
+import threading
+import time
+import unittest
+
+import serial
+
+import fakeunit
+from echosession import SupervisedSession
+from echosndr import DualEchosounder
+
+class TestSupervisedSession(unittest.TestCase):
+    def setUp(self):
+        with fakeunit.Patch() as units:
+            self.ss = DualEchosounder("fake", 115200)
+        self.unit = units[0]
+        self.ss.SetValue("IdInterval", "0.05")
+        self.ss.SetValue("IdRangeH", "20000")
+        self.opened = 0
+        self.unplugged = False
+        read, open = self.unit.read, self.unit.open
+
+        def reopen(): # brownout: the unit comes back with factory settings and sends pings again
+            if True == self.unplugged:
+                raise serial.SerialException("could not open port fake")
+            self.opened += 1
+            self.unit.stall = False
+            self.unit.values["#rangeh"] = "50000"
+            open()
+
+        def unplugged(size = 1):
+            if True == self.unplugged:
+                raise serial.SerialException("device reports readiness to read but returned no data")
+            return read(size)
+
+        self.unit.open = reopen
+        self.unit.read = unplugged
+
+    def tearDown(self):
+        self.unit.close()
+
+    def read(self, session, seconds):
+        data = b""
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            data += session.ReadAvailable(4096, 0.05)
+        return data
+
+    def test_stall_recovered(self):
+        session = SupervisedSession(self.ss, min_stall = 0.3, retry_interval = 0.1)
+        self.assertTrue(session.Start())
+        self.assertIn(b"#F", self.read(session, 0.3))
+        del self.unit.lines[:]
+
+        self.unit.stall = True
+        stalled = time.time()
+        self.read(session, 0.6) # watchdog fires after 0.3 s without a ping marker
+
+        self.assertEqual(1, self.opened)
+        self.assertEqual(1, session.GetReconnects())
+        self.assertTrue(self.ss.IsRunning())
+        self.assertIn(b"#F", self.read(session, 0.3))
+
+        # cached settings are applied again, IdTime only by SetCurrentTime()
+        self.assertEqual("20000", self.unit.values["#rangeh"])
+        self.assertEqual("0.05", self.unit.values["#interval"])
+        times = [line for line in self.unit.lines if line.startswith("#time")]
+        self.assertEqual(1, len(times))
+        self.assertLess(abs(int(times[0].split()[1]) - time.time()), 5)
+        self.assertEqual("#go", self.unit.lines[-1])
+
+        gaps = session.GetGaps()
+        self.assertEqual(1, len(gaps))
+        self.assertTrue(gaps[0].cause.startswith("stall: no ping"))
+        self.assertLessEqual(gaps[0].start, stalled)
+        self.assertGreaterEqual(gaps[0].end - stalled, 0.3)
+        self.assertAlmostEqual(gaps[0].end - gaps[0].start, session.GetLostTime())
+
+    def test_serial_error_recovered(self):
+        session = SupervisedSession(self.ss, min_stall = 0.3, retry_interval = 0.1)
+        self.assertTrue(session.Start())
+        self.unplugged = True
+        threading.Timer(0.35, setattr, (self, "unplugged", False)).start()
+        self.assertEqual(b"", session.ReadAvailable(4096, 0.05)) # blocks until plugged in again
+
+        self.assertGreaterEqual(session.GetReconnects(), 3)
+        self.assertEqual(1, self.opened)
+        self.assertIn(b"#F", self.read(session, 0.3))
+        gaps = session.GetGaps()
+        self.assertEqual(1, len(gaps))
+        self.assertTrue(gaps[0].cause.startswith("serial error: "))
+        self.assertFalse(gaps[0].cause.endswith("aborted"))
+
+    def test_abort_stops_recovery(self):
+        session = SupervisedSession(self.ss, min_stall = 0.3, retry_interval = 0.1)
+        self.assertTrue(session.Start())
+        self.unplugged = True
+        timer = threading.Timer(0.3, session.Abort)
+        timer.start()
+        start = time.monotonic()
+        self.assertEqual(b"", session.ReadAvailable(4096, 0.05)) # no OSError after Abort()
+        self.assertLess(time.monotonic() - start, 1.0)
+        self.assertTrue(session.GetGaps()[-1].cause.endswith(", aborted"))
+
+        reconnects = session.GetReconnects()
+        self.assertEqual(b"", session.ReadAvailable(4096, 0.05)) # no more recovery
+        self.assertEqual(reconnects, session.GetReconnects())
+        self.assertFalse(session.Stop()) # lost unit is not detected again
+        self.assertEqual(0, self.opened)
+
+    def test_gives_up(self):
+        session = SupervisedSession(self.ss, min_stall = 0.3, retry_interval = 0.05, max_attempts = 3)
+        self.assertTrue(session.Start())
+        self.unplugged = True
+        with self.assertRaises(OSError) as context:
+            session.ReadAvailable(4096, 0.05)
+        self.assertIn("not recovered after 3 attempts", str(context.exception))
+        self.assertEqual(3, session.GetReconnects())
+
+if __name__ == "__main__":
+    unittest.main()
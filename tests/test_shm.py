@@ -0,0 +1,100 @@
+# Copyright (c) EofE Ultrasonics Co., Ltd., 2024
+import unittest
+from multiprocessing import resource_tracker, shared_memory
+from unittest import mock
+
+from echoshm import SharedRingReader, SharedRingWriter
+
+def Line(i):
+    return b"$SDDBT,%05d,f,1.00,M,0.55,F\r\n" % i # 30 bytes
+
+class TestSharedRing(unittest.TestCase):
+    def setUp(self):
+        self.writer = SharedRingWriter(slots = 8, slot_size = 64)
+        self.readers = []
+
+    def tearDown(self):
+        for reader in self.readers:
+            reader.Close()
+        self.writer.Close()
+
+    def attach(self, from_start = False):
+        reader = SharedRingReader(self.writer.GetName(), from_start)
+        self.readers.append(reader)
+        return reader
+
+    def test_read(self):
+        reader = self.attach()
+        self.assertEqual(None, reader.Read(0))
+        self.assertEqual(1, self.writer.Write(Line(1), 10.0))
+        self.assertEqual(2, self.writer.Write(Line(2), 11.0))
+        self.assertEqual((1, 10.0, Line(1)), reader.Read(0))
+        self.assertEqual((2, 11.0, Line(2)), reader.Read(0))
+        self.assertEqual(None, reader.Read(0.01))
+        self.assertEqual(0, reader.GetLost())
+
+    def test_split_at_line_ends(self):
+        reader = self.attach()
+        data = b"".join(Line(i) for i in range(5)) # 150 bytes into 64 byte slots
+        self.assertEqual(3, self.writer.Write(data))
+        slots = [reader.Read(0)[2] for i in range(3)]
+        self.assertEqual([Line(0) + Line(1), Line(2) + Line(3), Line(4)], slots)
+
+    def test_overrun(self):
+        reader = self.attach()
+        for i in range(1, 21): # 20 slots into a ring of 8 without reading
+            self.writer.Write(Line(i), float(i))
+
+        seq, timestamp, data = reader.Read(0)
+        self.assertEqual(13, reader.GetLost()) # 7 newest slots are still readable
+        self.assertEqual((14, 14.0, Line(14)), (seq, timestamp, data))
+        received = [seq]
+        while True:
+            slot = reader.Read(0)
+            if None == slot:
+                break
+            self.assertEqual(Line(slot[0]), slot[2]) # seq stamp matches the payload
+            received.append(slot[0])
+        self.assertEqual(list(range(14, 21)), received)
+        self.assertEqual(20, reader.GetLost() + len(received))
+
+    def test_view_overwritten(self):
+        reader = self.attach()
+        self.writer.Write(Line(1))
+        seq, timestamp, view = reader.ReadView(0)
+        self.assertEqual(Line(1), bytes(view))
+        self.assertTrue(reader.IsValid(seq))
+        for i in range(8): # writer wraps around and reuses the slot
+            self.writer.Write(Line(100 + i))
+        self.assertFalse(reader.IsValid(seq))
+        view.release()
+
+    def test_from_start(self):
+        for i in range(1, 11):
+            self.writer.Write(Line(i))
+        late = self.attach()
+        early = self.attach(from_start = True)
+        self.assertEqual(None, late.Read(0))
+        self.assertEqual(4, early.Read(0)[0]) # oldest slot still in the ring
+        self.writer.Write(Line(11))
+        self.assertEqual(11, late.Read(0)[0])
+
+    def test_not_a_ring(self):
+        memory = shared_memory.SharedMemory(create = True, size = 256)
+        try:
+            self.assertRaises(ValueError, SharedRingReader, memory.name)
+        finally:
+            memory.close()
+            memory.unlink()
+
+    def test_reader_not_tracked(self):
+        # a reader process must not remove the writer's shared memory when it exits
+        register = resource_tracker.register
+        with mock.patch("multiprocessing.resource_tracker.register") as tracked:
+            reader = SharedRingReader(self.writer.GetName())
+            self.readers.append(reader)
+        tracked.assert_not_called()
+        self.assertIs(register, resource_tracker.register)
+
+if __name__ == "__main__":
+    unittest.main()